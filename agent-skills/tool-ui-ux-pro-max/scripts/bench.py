@@ -0,0 +1,470 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+UI/UX Pro Max Bench - benchmark the core.py search engine on synthetic corpora
+Usage: python bench.py [--sizes 100,10000,100000,1000000] [--domains style,ux,...] [--queries 200]
+                       [--readers 1,8,32] [--output bench.json] [--compare baseline.json]
+
+Synthetic CSVs keep each CSV_CONFIG table's header: low-cardinality columns
+reuse their real values, text columns draw words Zipf-style from the real
+column's vocabulary plus a long tail of new words that grows with the row
+count. Each (domain, size, backend) is measured in its own subprocess with a
+fresh index directory, so timings start cold and peak RSS is per measurement.
+A last run starts 1, 8 and 32 reader processes on one compiled index and
+reports their RSS and PSS, with the index mapped (shared pages) and with
+a private copy per process for contrast.
+Results are JSON with sorted keys; --compare prints the change per metric.
+"""
+
+import argparse
+import csv
+import json
+import os
+import platform
+import random
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+from array import array
+from collections import Counter
+from pathlib import Path
+
+import core
+
+SIZES = (100, 10_000, 100_000, 1_000_000)
+QUERY_COUNT = 200
+TOP_K = core.MAX_RESULTS
+SEED = 42
+WORKER_TIMEOUT = 3600
+# Processes attached to one compiled index in the shared-memory run
+READERS = (1, 8, 32)
+READER_ROWS = 10_000
+
+# Tail vocabulary: new words per sqrt(rows) (Heaps' law), and Zipf exponent for word draws
+TAIL_WORDS_PER_SQRT_ROW = 20
+ZIPF_EXPONENT = 1.0
+PHRASE_QUERY_SHARE = 0.1
+
+
+# ============ SYNTHETIC DATA ============
+def _column_profiles(filepath):
+    """Header plus, per column, ("values", values) for categorical columns or ("words", words, lengths)"""
+    with open(filepath, "r", encoding="utf-8", newline="") as f:
+        reader = csv.DictReader(f)
+        rows = list(reader)
+        fieldnames = reader.fieldnames or []
+
+    profiles = {}
+    for col in fieldnames:
+        cells = [row.get(col) or "" for row in rows]
+        distinct = sorted(set(cells))
+        if len(distinct) <= core.FACET_MAX_VALUES and all(len(value) <= core.FACET_MAX_LENGTH for value in distinct):
+            profiles[col] = ("values", distinct)
+        else:
+            counts = Counter(word for cell in cells for word in cell.split())
+            words = [word for word, _count in sorted(counts.items(), key=lambda item: (-item[1], item[0]))]
+            profiles[col] = ("words", words, [len(cell.split()) for cell in cells] or [1])
+    return fieldnames, profiles
+
+
+def _vocabulary(words, rows, rng):
+    """Real words (most frequent first) followed by a generated tail; returns (words, cumulative weights)"""
+    tail = int(TAIL_WORDS_PER_SQRT_ROW * rows ** 0.5)
+    vocab = list(words) or ["lorem"]
+    vocab += [f"{rng.choice(vocab[:50])}{i}" for i in range(tail)]
+    cum, total = [], 0.0
+    for rank in range(len(vocab)):
+        total += 1.0 / (rank + 1) ** ZIPF_EXPONENT
+        cum.append(total)
+    return vocab, cum
+
+
+def corpus_spec(domain, rows, seed=SEED):
+    """(header, column profiles, word pool per text column) for a `rows`-row corpus of a domain"""
+    fieldnames, profiles = _column_profiles(core.DATA_DIR / core.CSV_CONFIG[domain]["file"])
+    rng = random.Random(f"{seed}:{domain}:{rows}:vocabulary")
+    pools = {col: _vocabulary(profile[1], rows, rng) for col, profile in profiles.items() if profile[0] == "words"}
+    return fieldnames, profiles, pools
+
+
+def generate_csv(domain, rows, path, seed=SEED):
+    """Write a `rows`-row CSV shaped like the domain's table"""
+    fieldnames, profiles, pools = corpus_spec(domain, rows, seed)
+    rng = random.Random(f"{seed}:{domain}:{rows}")
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp = path.with_suffix(".tmp")
+    with open(tmp, "w", encoding="utf-8", newline="") as f:
+        writer = csv.writer(f)
+        writer.writerow(fieldnames)
+        for _ in range(rows):
+            record = []
+            for col in fieldnames:
+                profile = profiles[col]
+                if profile[0] == "values":
+                    record.append(rng.choice(profile[1]))
+                else:
+                    vocab, cum = pools[col]
+                    record.append(" ".join(rng.choices(vocab, cum_weights=cum, k=rng.choice(profile[2]))))
+            writer.writerow(record)
+    os.replace(tmp, path)
+
+
+def generate_queries(domain, rows, count, seed=SEED):
+    """1-3 word queries drawn like the search columns' words; PHRASE_QUERY_SHARE of them quote a word pair"""
+    _fieldnames, _profiles, pools = corpus_spec(domain, rows, seed)
+    columns = [col for col in core.CSV_CONFIG[domain]["search_cols"] if col in pools]
+    rng = random.Random(f"{seed}:{domain}:queries")
+    queries = []
+    for _ in range(count):
+        vocab, cum = pools[rng.choice(columns)]
+        words = rng.choices(vocab, cum_weights=cum, k=rng.randint(1, 3))
+        if len(words) > 1 and rng.random() < PHRASE_QUERY_SHARE:
+            words[:2] = [f'"{words[0]} {words[1]}"']
+        queries.append(" ".join(words).lower())
+    return queries
+
+
+# ============ MEASUREMENT ============
+def percentiles(latencies):
+    """p50/p95/p99/mean of per-query seconds, in milliseconds"""
+    ordered = sorted(latencies)
+    if not ordered:
+        return {}
+
+    def pick(p):
+        return ordered[min(len(ordered) - 1, int(p / 100 * len(ordered)))] * 1000
+
+    return {"p50_ms": round(pick(50), 4), "p95_ms": round(pick(95), 4), "p99_ms": round(pick(99), 4),
+            "mean_ms": round(sum(ordered) / len(ordered) * 1000, 4)}
+
+
+def _timed(fn, *args, **kwargs):
+    start = time.perf_counter()
+    value = fn(*args, **kwargs)
+    return value, round(time.perf_counter() - start, 6)
+
+
+def _latency(queries, search):
+    """Per-query latency of search(query) after one warm-up call"""
+    search(queries[0])
+    latencies = []
+    for query in queries:
+        start = time.perf_counter()
+        search(query)
+        latencies.append(time.perf_counter() - start)
+    return {**percentiles(latencies), "qps": round(len(queries) / sum(latencies), 1)}
+
+
+def _peak_rss():
+    """Peak resident set size of this process in bytes (None where unsupported)"""
+    try:
+        import resource
+    except ImportError:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak if sys.platform == "darwin" else peak * 1024
+
+
+def _read_documents(filepath, search_cols):
+    """Search documents through the engine's streaming CSV load (byte offsets and facets included)"""
+    with open(filepath, "rb") as f:
+        records = core._iter_records(f)
+        header = next(records, None)
+        fieldnames = header[2] if header else []
+        return list(core._documents(records, fieldnames, search_cols, array("Q"), array("Q"), core.FacetIndex()))
+
+
+def _tokenize_all(docs):
+    return [core.DEFAULT_TOKENIZER(doc) for doc in docs]
+
+
+def _bench_memory(filepath, search_cols, output_cols, queries):
+    result = {}
+    docs, result["load_s"] = _timed(_read_documents, filepath, search_cols)
+    _tokens, result["tokenize_s"] = _timed(_tokenize_all, docs)
+    del _tokens
+    _bm25, result["fit_s"] = _timed(core.BM25().fit, docs)
+    del _bm25, docs
+
+    index, result["build_s"] = _timed(core.load_index, filepath, search_cols, output_cols)
+    core._LOADED.clear()
+    index, result["open_s"] = _timed(core.load_index, filepath, search_cols, output_cols)
+    result["memory_bytes"] = index.memory_usage()
+    result["memory_bytes_per_10k_docs"] = round(index.memory_usage() / max(1, index.bm25.N) * 10_000)
+
+    strategies = {}
+    for strategy in core.RETRIEVAL_STRATEGIES[1:]:
+        index.bm25.strategy = strategy
+        strategies[strategy] = _latency(
+            queries, lambda query: core._search_csv(filepath, search_cols, output_cols, query, TOP_K))
+    index.bm25.strategy = "auto"
+    result["strategies"] = strategies
+
+    scorer = core.batch_scorer(index.bm25)
+    _ranked, elapsed = _timed(scorer.top_k_batch, queries, TOP_K)
+    result["batch"] = {"scorer": type(scorer).__name__, "qps": round(len(queries) / elapsed, 1)}
+
+    if core._numpy() is not None:
+        (_index, dense), build_s = _timed(core.load_dense, filepath, search_cols, output_cols)
+        result["dense"] = {"build_s": build_s, "memory_bytes": dense.memory_usage()}
+        for mode in ("dense", "hybrid"):
+            result["dense"][mode] = _latency(
+                queries, lambda query: core._search_csv(filepath, search_cols, output_cols, query, TOP_K, mode=mode))
+    return result
+
+
+def _bench_fts(filepath, search_cols, output_cols, queries):
+    result = {}
+    _index, result["build_s"] = _timed(core.load_fts, filepath, search_cols, output_cols)
+    core._FTS_INDICES.clear()
+    _index, result["open_s"] = _timed(core.load_fts, filepath, search_cols, output_cols)
+    result["disk_bytes"] = sum(path.stat().st_size for path in core.FTS_PATH.parent.glob(core.FTS_PATH.name + "*"))
+    result["strategies"] = {"bm25": _latency(
+        queries, lambda query: core._search_csv(filepath, search_cols, output_cols, query, TOP_K, backend="fts5"))}
+    return result
+
+
+def run_worker(spec):
+    """Measure one (domain CSV, backend) in this process; returns the result dict"""
+    config = core.CSV_CONFIG[spec["domain"]]
+    filepath = Path(spec["csv"])
+    # Results must be computed, not served from the cache
+    core.RESULT_CACHE = core.ResultCache(0)
+    bench = _bench_fts if spec["backend"] == "fts5" else _bench_memory
+    result = bench(filepath, config["search_cols"], config["output_cols"], spec["queries"])
+    result["peak_rss_bytes"] = _peak_rss()
+    return result
+
+
+def _memory_stats():
+    """RSS/PSS/private/shared bytes of this process from /proc/self/smaps_rollup (Linux);
+    elsewhere only the peak RSS. PSS splits each shared page between the processes mapping it."""
+    try:
+        with open("/proc/self/smaps_rollup", "r", encoding="ascii") as f:
+            fields = dict(line.split(":", 1) for line in f if ":" in line and line[0].isupper())
+    except OSError:
+        return {"rss_bytes": _peak_rss()}
+
+    def kib(*names):
+        return sum(int(fields[name].split()[0]) for name in names if name in fields) * 1024
+    return {"rss_bytes": kib("Rss"), "pss_bytes": kib("Pss"),
+            "private_bytes": kib("Private_Clean", "Private_Dirty"),
+            "shared_bytes": kib("Shared_Clean", "Shared_Dirty")}
+
+
+def run_reader(spec):
+    """Attach to an already compiled index, search it, report memory, then stay
+    attached until stdin closes so the driver can sample all readers at once"""
+    config = core.CSV_CONFIG[spec["domain"]]
+    filepath = Path(spec["csv"])
+    core.RESULT_CACHE = core.ResultCache(0)
+    index = core.load_index(filepath, config["search_cols"], config["output_cols"])
+    if spec.get("compile"):
+        return index
+    if spec.get("private"):
+        # What every reader held before indexes were mapped: its own copy of the arrays
+        index = core.SearchIndex.from_state(core._thaw(index.state()), filepath, config["output_cols"])
+    for query in spec["queries"]:
+        index.bm25.top_k(query, TOP_K)
+    print(json.dumps(_memory_stats()), flush=True)
+    sys.stdin.read()
+    return index
+
+
+# ============ DRIVER ============
+def _measure(spec, work_dir, timeout):
+    """run_worker() in a fresh subprocess with its own empty index directory"""
+    index_dir = tempfile.mkdtemp(prefix="index-", dir=work_dir)
+    env = {**os.environ, "UI_UX_PRO_MAX_INDEX_DIR": index_dir}
+    env.pop("UI_UX_PRO_MAX_RESULT_CACHE", None)
+    try:
+        proc = subprocess.run([sys.executable, str(Path(__file__).resolve()), "--worker", json.dumps(spec)],
+                              env=env, capture_output=True, text=True, timeout=timeout)
+    except subprocess.TimeoutExpired:
+        return {"error": f"timed out after {timeout}s"}
+    finally:
+        shutil.rmtree(index_dir, ignore_errors=True)
+    if proc.returncode != 0:
+        return {"error": (proc.stderr.strip().splitlines() or [f"exit status {proc.returncode}"])[-1]}
+    return json.loads(proc.stdout)
+
+
+def _run_readers(spec, count, env):
+    """Start `count` readers, wait until each has searched, sample them together, then stop them"""
+    command = [sys.executable, str(Path(__file__).resolve()), "--reader", json.dumps(spec)]
+    procs = [subprocess.Popen(command, env=env, stdin=subprocess.PIPE, stdout=subprocess.PIPE, text=True)
+             for _ in range(count)]
+    try:
+        stats = [json.loads(proc.stdout.readline() or "{}") for proc in procs]
+    finally:
+        for proc in procs:
+            proc.stdin.close()
+        for proc in procs:
+            proc.wait()
+    return stats
+
+
+def measure_readers(domain, rows, counts, args):
+    """Memory of 1..N processes searching one compiled index, mapped (shared) vs private copies"""
+    work_dir = Path(args.work_dir)
+    filepath = work_dir / f"{domain}.{rows}.{args.seed}.csv"
+    if args.regenerate or not filepath.exists():
+        generate_csv(domain, rows, filepath, args.seed)
+    index_dir = tempfile.mkdtemp(prefix="index-", dir=work_dir)
+    env = {**os.environ, "UI_UX_PRO_MAX_INDEX_DIR": index_dir}
+    env.pop("UI_UX_PRO_MAX_RESULT_CACHE", None)
+    spec = {"domain": domain, "csv": str(filepath), "queries": generate_queries(domain, rows, args.queries, args.seed)}
+    result = {"domain": domain, "rows": rows}
+    try:
+        # Compile once up front so readers only attach
+        subprocess.run([sys.executable, str(Path(__file__).resolve()), "--reader", json.dumps({**spec, "compile": True})],
+                       env=env, check=True, timeout=args.timeout)
+        index_file = next(Path(index_dir).glob("*.idx"), None)
+        result["index_bytes"] = index_file.stat().st_size if index_file else None
+        for mode, private in (("mapped", False), ("private", True)):
+            result[mode] = {}
+            for count in counts:
+                stats = _run_readers({**spec, "private": private}, count, env)
+                summary = {"readers": count}
+                for key in ("rss_bytes", "pss_bytes", "private_bytes"):
+                    values = [item[key] for item in stats if item.get(key) is not None]
+                    if values:
+                        summary[key.replace("_bytes", "_mean_bytes")] = sum(values) // len(values)
+                        summary[key.replace("_bytes", "_total_bytes")] = sum(values)
+                result[mode][str(count)] = summary
+                print(f"  {mode} x {count}: {summary.get('pss_total_bytes', summary.get('rss_total_bytes'))} bytes",
+                      file=sys.stderr)
+    except (OSError, subprocess.SubprocessError) as e:
+        result["error"] = str(e)
+    finally:
+        shutil.rmtree(index_dir, ignore_errors=True)
+    return result
+
+
+def _git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=Path(__file__).parent,
+                              capture_output=True, text=True, timeout=10).stdout.strip() or None
+    except (OSError, subprocess.SubprocessError):
+        return None
+
+
+def _meta(args):
+    return {
+        "commit": _git_commit(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "numpy": getattr(core._numpy(), "__version__", None),
+        "scipy": getattr(sys.modules.get("scipy") if core._sparse() else None, "__version__", None),
+        "sqlite": core._sqlite3().sqlite_version,
+        "seed": args.seed,
+        "queries": args.queries,
+        "top_k": TOP_K,
+    }
+
+
+def run_bench(args):
+    work_dir = Path(args.work_dir)
+    work_dir.mkdir(parents=True, exist_ok=True)
+    runs = {}
+    for domain in args.domains:
+        for rows in args.sizes:
+            filepath = work_dir / f"{domain}.{rows}.{args.seed}.csv"
+            start = time.perf_counter()
+            if args.regenerate or not filepath.exists():
+                generate_csv(domain, rows, filepath, args.seed)
+            queries = generate_queries(domain, rows, args.queries, args.seed)
+            print(f"{domain} x {rows}: data ready in {time.perf_counter() - start:.1f}s", file=sys.stderr)
+            for backend in args.backends:
+                spec = {"domain": domain, "csv": str(filepath), "backend": backend, "queries": queries}
+                result = _measure(spec, work_dir, args.timeout)
+                runs[f"{domain}/{rows}/{backend}"] = {"domain": domain, "rows": rows, "backend": backend,
+                                                      "csv_bytes": filepath.stat().st_size, **result}
+                print(f"  {backend}: {result.get('error') or 'ok'}", file=sys.stderr)
+    report = {"meta": _meta(args), "runs": runs}
+    if args.readers and args.domains:
+        print(f"{args.domains[0]} x {args.reader_rows}: readers {args.readers}", file=sys.stderr)
+        report["readers"] = measure_readers(args.domains[0], args.reader_rows, args.readers, args)
+    return report
+
+
+def _flatten(value, prefix=""):
+    """{"a": {"b": 1}} -> {"a/b": 1} for numeric leaves"""
+    if isinstance(value, dict):
+        flat = {}
+        for key, item in value.items():
+            flat.update(_flatten(item, f"{prefix}/{key}" if prefix else key))
+        return flat
+    if isinstance(value, (int, float)) and not isinstance(value, bool):
+        return {prefix: value}
+    return {}
+
+
+def compare(base, current):
+    """Lines of "run metric: base -> current (+x%)" for every metric both results share"""
+    lines = []
+    base_runs = {**base.get("runs", {}), "readers": base.get("readers", {})}
+    current_runs = {**current["runs"], "readers": current.get("readers", {})}
+    for run, result in sorted(current_runs.items()):
+        old = _flatten(base_runs.get(run, {}))
+        for metric, value in sorted(_flatten(result).items()):
+            if metric in ("rows",) or metric not in old:
+                continue
+            before = old[metric]
+            change = f"{(value - before) / before * 100:+.1f}%" if before else "n/a"
+            lines.append(f"{run} {metric}: {before:g} -> {value:g} ({change})")
+    return lines
+
+
+def _csv_list(value, cast=str):
+    return [cast(item) for item in value.split(",") if item]
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="UI Pro Max search benchmark")
+    parser.add_argument("--sizes", type=lambda v: _csv_list(v, int), default=list(SIZES),
+                        help="Comma-separated row counts (default: 100,10000,100000,1000000)")
+    parser.add_argument("--domains", type=_csv_list, default=list(core.CSV_CONFIG),
+                        help="Comma-separated CSV_CONFIG domains (default: all)")
+    parser.add_argument("--backends", type=_csv_list, default=list(core.SEARCH_BACKENDS),
+                        help="Comma-separated backends (default: all)")
+    parser.add_argument("--queries", type=int, default=QUERY_COUNT, help="Queries per run (default: 200)")
+    parser.add_argument("--seed", type=int, default=SEED, help="Seed for data and queries")
+    parser.add_argument("--work-dir", default=str(Path(tempfile.gettempdir()) / "ui-ux-pro-max-bench"),
+                        help="Where generated CSVs are kept between runs")
+    parser.add_argument("--regenerate", action="store_true", help="Rewrite generated CSVs even if present")
+    parser.add_argument("--timeout", type=int, default=WORKER_TIMEOUT, help="Seconds allowed per measurement")
+    parser.add_argument("--output", "-o", help="Write results JSON here (default: stdout)")
+    parser.add_argument("--compare", metavar="BASE", help="Print changes against an earlier results JSON")
+    parser.add_argument("--readers", type=lambda v: _csv_list(v, int), default=list(READERS),
+                        help="Concurrent processes sharing one index, for the memory run (default: 1,8,32; '' skips it)")
+    parser.add_argument("--reader-rows", type=int, default=READER_ROWS,
+                        help="Rows of the first domain's corpus used for the readers run (default: 10000)")
+    parser.add_argument("--worker", help=argparse.SUPPRESS)
+    parser.add_argument("--reader", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.worker:
+        print(json.dumps(run_worker(json.loads(args.worker))))
+        sys.exit(0)
+    if args.reader:
+        run_reader(json.loads(args.reader))
+        sys.exit(0)
+
+    unknown = [d for d in args.domains if d not in core.CSV_CONFIG] + \
+              [b for b in args.backends if b not in core.SEARCH_BACKENDS]
+    if unknown:
+        parser.error(f"unknown domain or backend: {', '.join(unknown)}")
+
+    report = run_bench(args)
+    text = json.dumps(report, indent=2, sort_keys=True, ensure_ascii=False)
+    if args.output:
+        Path(args.output).write_text(text + "\n", encoding="utf-8")
+    else:
+        print(text)
+
+    if args.compare:
+        with open(args.compare, "r", encoding="utf-8") as f:
+            print("\n".join(compare(json.load(f), report)), file=sys.stderr)
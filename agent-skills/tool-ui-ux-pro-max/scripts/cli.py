@@ -0,0 +1,489 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Command line, batch mode and daemon behind search.py (see its usage)
+"""
+
+import argparse
+import json
+import os
+import signal
+import sys
+import time
+from pathlib import Path
+
+# The engine (core) is imported on first use: a query a running daemon answers
+# never pays for it. The index directory is resolved as in core.INDEX_DIR.
+INDEX_DIR = Path(os.environ.get("UI_UX_PRO_MAX_INDEX_DIR") or Path(__file__).parent.parent / ".index")
+
+# Daemon address: a Unix socket path, or HOST:PORT for localhost TCP
+DAEMON_ADDRESS = os.environ.get("UI_UX_PRO_MAX_DAEMON") or str(INDEX_DIR / "search.sock")
+DAEMON_TIMEOUT = 2.0
+
+# Settings a request cannot carry: the daemon only answers clients whose
+# environment agrees with its own (others search in-process)
+DAEMON_ENV = ("UI_UX_PRO_MAX_NORMALIZER", "UI_UX_PRO_MAX_CORPORA", "UI_UX_PRO_MAX_ROUTE_FALLBACK",
+              "UI_UX_PRO_MAX_QUERY_LOG")
+
+
+def format_output(result):
+    """Format results for Claude consumption (token-optimized)"""
+    if "error" in result:
+        return f"Error: {result['error']}"
+
+    output = []
+    if result.get("stack"):
+        output.append(f"## UI Pro Max Stack Guidelines")
+        output.append(f"**Stack:** {result['stack']} | **Query:** {result['query']}")
+    else:
+        output.append(f"## UI Pro Max Search Results")
+        output.append(f"**Domain:** {result['domain']} | **Query:** {result['query']}")
+    if result.get("corrections"):
+        fixed = ", ".join(f"{word} → {term}" for word, term in result["corrections"].items())
+        output.append(f"**Corrected:** {fixed}")
+    source = f"**Source:** {result['file']} | **Found:** {result['count']} results"
+    if result.get("corpus"):
+        source = f"**Corpus:** {result['corpus']} | " + source
+    if result.get("omitted"):
+        source += f" (+{result['omitted']} over the {result['max_tokens']}-token budget)"
+    output.append(source + "\n")
+
+    for i, row in enumerate(result["results"], 1):
+        output.append(f"### Result {i}")
+        for key, value in row.items():
+            value_str = str(value)
+            if len(value_str) > 300:
+                value_str = value_str[:300] + "..."
+            output.append(f"- **{key}:** {value_str}")
+        output.append("")
+
+    return "\n".join(output)
+
+
+def _domains():
+    from core import CSV_CONFIG
+    return list(CSV_CONFIG.keys()) + ["all"]
+
+
+def format_design_system(bundle):
+    """Markdown for a resolve_design_system() bundle, one section per joined table"""
+    if "error" in bundle:
+        return f"Error: {bundle['error']}"
+
+    output = ["## UI Pro Max Design System", f"**Query:** {bundle['query']}", ""]
+    sections = [("Product", [bundle["product"]]), ("Style", bundle["style"]),
+                ("Secondary Styles", bundle["secondary_styles"]), ("Colors", bundle["color"]),
+                ("Typography", bundle["typography"]), ("Landing Pattern", bundle["landing"])]
+    for title, rows in sections:
+        for row in rows:
+            output.append(f"### {title}")
+            for key, value in row.items():
+                value_str = str(value)
+                if len(value_str) > 300:
+                    value_str = value_str[:300] + "..."
+                output.append(f"- **{key}:** {value_str}")
+            output.append("")
+    return "\n".join(output)
+
+
+def parse_where(filters):
+    """["Severity=High", "Platform=Web", "Platform=All"] -> {"Severity": ["High"], "Platform": ["Web", "All"]}"""
+    where = {}
+    for item in filters:
+        col, sep, value = item.partition("=")
+        if not sep or not col.strip():
+            raise ValueError(f"Invalid filter: {item!r} (expected Column=Value)")
+        where.setdefault(col.strip(), []).append(value.strip())
+    return where
+
+
+def run_query(request):
+    """Answer one request: {"op": "resolve", "query"} or {"query", "domain", "stack", "max_results", "where", "fuzzy", "mode", "backend", "max_tokens", "corpus"}"""
+    from core import (MAX_RESULTS, SEARCH_BACKENDS, SEARCH_MODES, fit_budget, index_manager,
+                      resolve_design_system, search, search_stack)
+
+    query = request.get("query")
+    if not isinstance(query, str) or not query.strip():
+        return {"error": "Missing 'query'"}
+    if request.get("op") == "resolve":
+        return resolve_design_system(query)
+
+    max_results = request.get("max_results", MAX_RESULTS)
+    if not isinstance(max_results, int) or isinstance(max_results, bool):
+        return {"error": f"Invalid max_results: {max_results!r}"}
+
+    where = request.get("where") or None
+    if where is not None and not (isinstance(where, dict) and all(
+            isinstance(v, str) or (isinstance(v, list) and all(isinstance(x, str) for x in v))
+            for v in where.values())):
+        return {"error": f"Invalid where: {where!r} (expected {{column: value or [values]}})"}
+
+    max_tokens = request.get("max_tokens")
+    if max_tokens is not None and (not isinstance(max_tokens, int) or isinstance(max_tokens, bool) or max_tokens <= 0):
+        return {"error": f"Invalid max_tokens: {max_tokens!r}"}
+
+    fuzzy = request.get("fuzzy")
+    if fuzzy is not None and not isinstance(fuzzy, bool):
+        return {"error": f"Invalid fuzzy: {fuzzy!r}"}
+
+    mode = request.get("mode") or "bm25"
+    if mode not in SEARCH_MODES:
+        return {"error": f"Unknown mode: {mode!r}. Available: {', '.join(SEARCH_MODES)}"}
+
+    backend = request.get("backend") or None
+    if backend is not None and backend not in SEARCH_BACKENDS:
+        return {"error": f"Unknown backend: {backend!r}. Available: {', '.join(SEARCH_BACKENDS)}"}
+
+    corpus = request.get("corpus") or None
+    if corpus is not None and corpus not in index_manager().corpora:
+        return {"error": f"Unknown corpus: {corpus!r}. Registered: {', '.join(index_manager().corpora) or 'none'}"}
+
+    if request.get("stack"):
+        result = search_stack(query, request["stack"], max_results, where, fuzzy, mode, backend, corpus)
+    else:
+        domain = request.get("domain")
+        if domain is not None and domain not in _domains():
+            return {"error": f"Unknown domain: {domain}. Available: {', '.join(_domains())}"}
+        result = search(query, domain, max_results, where, fuzzy, mode, backend, corpus)
+    return fit_budget(result, max_tokens) if max_tokens else result
+
+
+def _answer(request):
+    """run_query() for one line of a stream: a failure becomes that line's error, not the stream's"""
+    try:
+        return run_query(request)
+    except Exception as e:
+        return {"error": str(e) or type(e).__name__}
+
+
+def run_batch(lines, out):
+    """Stream one JSON result line per JSONL request line (indices stay loaded between queries)"""
+    for line in lines:
+        line = line.strip()
+        if not line:
+            continue
+        try:
+            request = json.loads(line)
+            if not isinstance(request, dict):
+                raise ValueError("expected a JSON object")
+        except ValueError as e:
+            request, result = {}, {"error": f"Invalid request: {e}"}
+        else:
+            result = _answer(request)
+
+        # Echo a caller-supplied id so results can be matched to requests
+        if "id" in request:
+            result = {"id": request["id"], **result}
+        out.write(json.dumps(result, ensure_ascii=False) + "\n")
+        out.flush()
+
+
+def _parse_address(address):
+    """Return (is_tcp, address) for a socket path or HOST:PORT"""
+    host, sep, port = address.rpartition(":")
+    if sep and port.isdigit() and "/" not in address:
+        return True, (host or "127.0.0.1", int(port))
+    return False, address
+
+
+def _daemon_env():
+    return {name: os.environ.get(name) or "" for name in DAEMON_ENV}
+
+
+def with_env_defaults(request):
+    """Search request with the defaults this process's environment implies made explicit,
+    so a daemon started under other settings answers it the same way"""
+    request = dict(request)
+    if request.get("fuzzy") is None:
+        request["fuzzy"] = bool(os.environ.get("UI_UX_PRO_MAX_FUZZY"))
+    if not request.get("backend"):
+        request["backend"] = os.environ.get("UI_UX_PRO_MAX_BACKEND") or "memory"
+    return request
+
+
+def query_daemon(request, address=DAEMON_ADDRESS, timeout=DAEMON_TIMEOUT):
+    """Send one request to a running daemon; None when no daemon answers (or it runs with other DAEMON_ENV settings)"""
+    tcp, addr = _parse_address(address)
+    if not tcp and not os.path.exists(addr):
+        return None
+    import socket  # ~5 ms; only worth it once a daemon may be listening
+    try:
+        with socket.socket(socket.AF_INET if tcp else socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+            sock.settimeout(timeout)
+            sock.connect(addr)
+            payload = {**request, "env": _daemon_env()}
+            sock.sendall((json.dumps(payload, ensure_ascii=False) + "\n").encode("utf-8"))
+            with sock.makefile("rb") as f:
+                result = json.loads(f.readline() or "null")
+    except (OSError, ValueError):
+        return None
+    if not isinstance(result, dict) or result.get("env_mismatch"):
+        return None
+    return result
+
+
+def _stats():
+    """This process's result-cache and index-manager counters (the daemon's "stats" reply)"""
+    from core import RESULT_CACHE, index_manager
+    return {"cache": RESULT_CACHE.stats(), "indices": index_manager().stats()}
+
+
+def _handle_connection(rfile, wfile):
+    """One JSON request per line, one JSON response per line, until the client closes"""
+    for line in rfile:
+        try:
+            request = json.loads(line)
+            if not isinstance(request, dict):
+                raise ValueError("expected a JSON object")
+        except ValueError as e:
+            request, result = {}, {"error": f"Invalid request: {e}"}
+        else:
+            if request.get("op") == "ping":
+                result = {"ok": True, "pid": os.getpid()}
+            elif request.get("op") == "stats":
+                result = _stats()
+            elif request.get("env", _daemon_env()) != _daemon_env():
+                result = {"error": "Daemon settings differ from the client's", "env_mismatch": True}
+            else:
+                result = _answer(request)
+        if "id" in request:
+            result = {"id": request["id"], **result}
+        wfile.write((json.dumps(result, ensure_ascii=False) + "\n").encode("utf-8"))
+        wfile.flush()
+
+
+def serve(address=DAEMON_ADDRESS):
+    """Run the search daemon: all indices stay loaded and reload when a CSV changes"""
+    import socketserver  # only the daemon needs it
+    from core import iter_datasets, load_index
+
+    class Handler(socketserver.StreamRequestHandler):
+        def handle(self):
+            _handle_connection(self.rfile, self.wfile)
+
+    tcp, addr = _parse_address(address)
+    if tcp:
+        class Server(socketserver.ThreadingMixIn, socketserver.TCPServer):
+            daemon_threads = True
+            allow_reuse_address = True
+    else:
+        if os.path.exists(addr):
+            if query_daemon({"op": "ping"}, address) is not None:
+                sys.exit(f"Error: a daemon is already listening on {addr}")
+            os.unlink(addr)  # stale socket from a daemon that died
+        os.makedirs(os.path.dirname(addr) or ".", exist_ok=True)
+
+        class Server(socketserver.ThreadingMixIn, getattr(socketserver, "UnixStreamServer", socketserver.TCPServer)):
+            daemon_threads = True
+    server = Server(addr, Handler)
+
+    for _name, filepath, search_cols, output_cols in iter_datasets():
+        if filepath.exists():
+            load_index(filepath, search_cols, output_cols)
+
+    signal.signal(signal.SIGTERM, lambda *_: sys.exit(0))
+    print(f"UI Pro Max search daemon listening on {address}", file=sys.stderr, flush=True)
+    try:
+        server.serve_forever()
+    except (KeyboardInterrupt, SystemExit):
+        pass
+    finally:
+        server.server_close()
+        if not tcp and os.path.exists(addr):
+            os.unlink(addr)
+
+
+def _serve_main(argv):
+    parser = argparse.ArgumentParser(prog="search.py serve", description="UI Pro Max search daemon")
+    group = parser.add_mutually_exclusive_group()
+    group.add_argument("--socket", help=f"Unix socket path (default: {DAEMON_ADDRESS})")
+    group.add_argument("--tcp", metavar="HOST:PORT", help="Listen on localhost TCP instead")
+    args = parser.parse_args(argv)
+    serve(args.tcp or args.socket or DAEMON_ADDRESS)
+
+
+def _build_main(argv):
+    parser = argparse.ArgumentParser(prog="search.py build-index",
+                                     description="Compile every dataset's index in parallel (changed sources only)")
+    parser.add_argument("--workers", "-j", type=int, help="Build processes (default: one per CSV, up to the CPU count)")
+    parser.add_argument("--dense", action="store_true", help="Also build dense vectors (needs numpy)")
+    parser.add_argument("--fts", action="store_true", help="Also compile the SQLite FTS5 backend")
+    parser.add_argument("--json", action="store_true", help="Output as JSON")
+    args = parser.parse_args(argv)
+
+    from core import build_indices
+    start = time.perf_counter()
+    results = build_indices(args.workers, args.dense, args.fts)
+    elapsed = time.perf_counter() - start
+    if args.json:
+        print(json.dumps({"seconds": round(elapsed, 3), "datasets": results}, indent=2))
+    else:
+        for name, result in results.items():
+            detail = result.get("error") or f"{result['rows']} rows in {result['seconds']}s"
+            print(f"{name:<16} {result['status']:<8} {detail}")
+        print(f"{len(results)} datasets in {elapsed:.2f}s")
+    if any(result["status"] == "error" or "fts5_error" in result for result in results.values()):
+        sys.exit(1)
+
+
+def _resolve_main(argv):
+    parser = argparse.ArgumentParser(prog="search.py resolve",
+                                     description="Product type plus the styles, colors, typography and landing pattern it references")
+    parser.add_argument("query", help="Product description, e.g. 'fintech crypto app'")
+    parser.add_argument("--json", action="store_true", help="Output as JSON")
+    parser.add_argument("--daemon", default=DAEMON_ADDRESS, metavar="ADDRESS", help="Daemon to use when one is running")
+    parser.add_argument("--no-daemon", action="store_true", help="Always resolve in-process")
+    args = parser.parse_args(argv)
+
+    request = {"op": "resolve", "query": args.query}
+    bundle = None if args.no_daemon else query_daemon(request, args.daemon)
+    if bundle is None:
+        bundle = run_query(request)
+    print(json.dumps(bundle, indent=2, ensure_ascii=False) if args.json else format_design_system(bundle))
+    if "error" in bundle:
+        sys.exit(1)
+
+
+def main():
+    if sys.argv[1:2] == ["resolve"]:
+        _resolve_main(sys.argv[2:])
+        sys.exit(0)
+    if sys.argv[1:2] == ["serve"]:
+        _serve_main(sys.argv[2:])
+        sys.exit(0)
+    if sys.argv[1:2] == ["build-index"]:
+        _build_main(sys.argv[2:])
+        sys.exit(0)
+
+    parser = argparse.ArgumentParser(description="UI Pro Max Search")
+    parser.add_argument("query", nargs="?", help="Search query")
+    # Choices are checked by run_query() (here or in the daemon), so parsing needs no engine
+    parser.add_argument(
+        "--domain", "-d", help="Search domain: style, prompt, color, chart, landing, product, ux, typography, "
+                               "all (every domain and stack)"
+    )
+    parser.add_argument(
+        "--stack",
+        "-s",
+        help="Stack-specific search (html-tailwind, react, nextjs, ...)",
+    )
+    parser.add_argument(
+        "--max-results",
+        "-n",
+        type=int,
+        help="Max results (default: 3)",
+    )
+    parser.add_argument(
+        "--where",
+        "-w",
+        action="append",
+        default=[],
+        metavar="COL=VALUE",
+        help="Only rank rows whose column equals VALUE (repeatable; same column = any of)",
+    )
+    parser.add_argument(
+        "--fuzzy",
+        action="store_true",
+        default=None,
+        help="Correct misspelled query words to the closest indexed terms (reported as corrections)",
+    )
+    parser.add_argument(
+        "--mode",
+        default="bm25",
+        help="Ranking: bm25 keywords (default), dense LSA vectors (needs numpy), or hybrid of both",
+    )
+    parser.add_argument(
+        "--backend",
+        help="Keyword index storage: in-memory BM25 or SQLite FTS5 (default: UI_UX_PRO_MAX_BACKEND or memory)",
+    )
+    parser.add_argument(
+        "--max-tokens",
+        type=int,
+        metavar="N",
+        help="Fit the output in about N tokens: query-matching snippets, abbreviated fields, best results first",
+    )
+    parser.add_argument(
+        "--corpus",
+        metavar="NAME",
+        help="Search a corpus registered via UI_UX_PRO_MAX_CORPORA (NAME=DIR entries) instead of the bundled data",
+    )
+    parser.add_argument("--json", action="store_true", help="Output as JSON")
+    parser.add_argument(
+        "--batch",
+        nargs="?",
+        const="-",
+        metavar="FILE",
+        help="Read JSONL queries from FILE (default: stdin) and write JSONL results",
+    )
+    parser.add_argument(
+        "--daemon",
+        default=DAEMON_ADDRESS,
+        metavar="ADDRESS",
+        help="Daemon socket path or HOST:PORT to use when one is running",
+    )
+    parser.add_argument(
+        "--no-daemon", action="store_true", help="Always search in-process"
+    )
+    parser.add_argument(
+        "--cache-stats",
+        action="store_true",
+        help="Print result-cache and index-manager counters to stderr when done",
+    )
+
+    args = parser.parse_args()
+
+    if args.batch:
+        if args.batch == "-":
+            run_batch(sys.stdin, sys.stdout)
+        else:
+            with open(args.batch, "r", encoding="utf-8") as f:
+                run_batch(f, sys.stdout)
+        if args.cache_stats:
+            print(json.dumps(_stats()), file=sys.stderr)
+        sys.exit(0)
+
+    if not args.query:
+        parser.error("the following arguments are required: query (or use --batch)")
+
+    try:
+        where = parse_where(args.where)
+    except ValueError as e:
+        parser.error(str(e))
+
+    # Stack search takes priority
+    request = {"query": args.query, "domain": args.domain, "stack": args.stack}
+    if args.max_results is not None:
+        request["max_results"] = args.max_results
+    if where:
+        request["where"] = where
+    if args.fuzzy:
+        request["fuzzy"] = True
+    if args.mode != "bm25":
+        request["mode"] = args.mode
+    if args.backend:
+        request["backend"] = args.backend
+    if args.max_tokens is not None:
+        if args.max_tokens <= 0:
+            parser.error("--max-tokens must be positive")
+        request["max_tokens"] = args.max_tokens
+    if args.corpus:
+        request["corpus"] = args.corpus
+    request = with_env_defaults(request)
+    result = None if args.no_daemon else query_daemon(request, args.daemon)
+    if result is None:
+        result = run_query(request)
+
+    if args.json:
+        print(json.dumps(result, indent=2, ensure_ascii=False))
+    else:
+        print(format_output(result))
+
+    if args.cache_stats:
+        stats = None if args.no_daemon else query_daemon({"op": "stats"}, args.daemon)
+        if stats is None:
+            stats = _stats()
+        print(json.dumps(stats), file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
@@ -5,53 +5,179 @@ UI/UX Pro Max Core - BM25 search engine for UI/UX style guides
 """
 
 import csv
+import functools
+import heapq
+import io
+import json
+import mmap
+import os
 import re
+import sys
+import time
+import threading
+import zlib
+from array import array
 from pathlib import Path
+from bisect import bisect_left
+from itertools import accumulate
 from math import log
-from collections import defaultdict
+from collections import OrderedDict, defaultdict
+from collections.abc import Mapping, Sequence
+
+
+# Optional vectorized backend, imported on first use: importing numpy and
+# scipy costs ~300 ms, more than a whole cold keyword search
+@functools.lru_cache(maxsize=None)
+def _numpy():
+    """The numpy module, or None when it is not installed"""
+    try:
+        import numpy
+    except ImportError:
+        return None
+    return numpy
+
+
+@functools.lru_cache(maxsize=None)
+def _sparse():
+    """The scipy.sparse module, or None when it is not installed"""
+    try:
+        from scipy import sparse
+    except ImportError:
+        return None
+    return sparse
+
+
+@functools.lru_cache(maxsize=None)
+def _sqlite3():
+    """The sqlite3 module, imported on first use (only FTS5 and the disk result cache need it)"""
+    import sqlite3
+    return sqlite3
 
 # ============ CONFIGURATION ============
 DATA_DIR = Path(__file__).parent.parent / "data"
 MAX_RESULTS = 3
 
+# Compiled indices live next to the data unless overridden. Their arrays are
+# mapped read-only from the file, so processes loading one index share its pages.
+INDEX_DIR = Path(os.environ.get("UI_UX_PRO_MAX_INDEX_DIR") or Path(__file__).parent.parent / ".index")
+INDEX_FORMAT = 11
+INDEX_MAGIC = b"UIPMIDX\0"
+INDEX_ALIGN = 64
+
+# Top-k retrieval: "exhaustive" sorts every match, "heap" keeps a bounded heap,
+# "maxscore" also skips documents that cannot beat the current k-th score.
+# "auto" uses maxscore once the corpus is large enough for pruning to pay off;
+# in pure Python its bookkeeping costs more than it saves on mid-size corpora
+# (bench.py: heap ahead at 3k-10k rows, maxscore 10-20% ahead at 100k; Zipf
+# corpora: behind at 50k, ahead at 200k).
+RETRIEVAL_STRATEGIES = ("auto", "exhaustive", "heap", "maxscore")
+MAXSCORE_MIN_DOCS = 150_000
+
+# Documents where adjacent query terms occur within PROXIMITY_WINDOW positions
+# of each other get PROXIMITY_WEIGHT * min(idf) / distance extra per pair
+PROXIMITY_WEIGHT = 1.0
+PROXIMITY_WINDOW = 4
+
+# Search results are memoized per process; set UI_UX_PRO_MAX_RESULT_CACHE to a
+# SQLite file path to also share them across processes and runs
+RESULT_CACHE_SIZE = 512
+RESULT_CACHE_DISK_SIZE = 20000
+RESULT_CACHE_PATH = os.environ.get("UI_UX_PRO_MAX_RESULT_CACHE")
+
+# Set UI_UX_PRO_MAX_QUERY_LOG to a JSONL path to record every search() and
+# search_stack() call (arguments, latency, result ids) for replay.py
+QUERY_LOG_PATH = os.environ.get("UI_UX_PRO_MAX_QUERY_LOG")
+
+# Columns get value bitmaps for --where filters while they stay low-cardinality
+# with short values (prose columns are skipped)
+FACET_MAX_VALUES = 32
+FACET_MAX_LENGTH = 64
+
+# Fuzzy matching maps unknown query words of at least FUZZY_MIN_LENGTH characters
+# to the closest indexed term: up to FUZZY_MAX_DISTANCE edits (one edit for words
+# shorter than 8 characters). Off unless requested or UI_UX_PRO_MAX_FUZZY is set.
+FUZZY_DEFAULT = bool(os.environ.get("UI_UX_PRO_MAX_FUZZY"))
+FUZZY_MAX_DISTANCE = 2
+FUZZY_PREFIX_LENGTH = 7
+FUZZY_MIN_LENGTH = 4
+
+# Dense (LSA) retrieval: latent dimensions per corpus, capped at a quarter of its
+# rows so small tables still generalize; hybrid mode gives BM25 this share
+SEARCH_MODES = ("bm25", "dense", "hybrid")
+DENSE_DIMENSIONS = 128
+HYBRID_WEIGHT = 0.5
+
+# Storage backend for keyword search: "memory" ranks with the compiled BM25 index,
+# "fts5" with a disk-resident SQLite FTS5 database (FTS_PATH) scored by its
+# bm25() using per-column weights (FTS_COLUMN_WEIGHTS, 1.0 when unlisted)
+SEARCH_BACKENDS = ("memory", "fts5")
+SEARCH_BACKEND = os.environ.get("UI_UX_PRO_MAX_BACKEND") or "memory"
+FTS_PATH = INDEX_DIR / "search.fts5.db"
+FTS_COLUMN_WEIGHTS = {}
+FTS_BATCH_SIZE = 1000
+
+# --max-tokens output: tokens are estimated as CHARS_PER_TOKEN characters; fields
+# matching the query keep a SNIPPET_CHARS window, others shrink to ABBREVIATE_CHARS
+CHARS_PER_TOKEN = 4
+SNIPPET_CHARS = 160
+ABBREVIATE_CHARS = 60
+
+# Extra corpora (directories laid out like DATA_DIR) as NAME=DIR entries separated
+# by os.pathsep; their indices load on demand and the least recently used are
+# dropped once the resident indices exceed INDEX_MEMORY_BUDGET bytes
+CORPORA = os.environ.get("UI_UX_PRO_MAX_CORPORA") or ""
+INDEX_MEMORY_BUDGET = int(os.environ.get("UI_UX_PRO_MAX_INDEX_BUDGET") or 256 * 2**20)
+
+# Vectorized scoring materializes (queries x docs) scores; bound each chunk's size
+SPARSE_CHUNK_CELLS = 4_000_000
+
+# name_col: the column naming a row (kept whole by --max-tokens, matched by DESIGN_JOINS)
 CSV_CONFIG = {
     "style": {
         "file": "styles.csv",
+        "name_col": "Style Category",
         "search_cols": ["Style Category", "Keywords", "Best For", "Type"],
         "output_cols": ["Style Category", "Type", "Keywords", "Primary Colors", "Effects & Animation", "Best For", "Performance", "Accessibility", "Framework Compatibility", "Complexity"]
     },
     "prompt": {
         "file": "prompts.csv",
+        "name_col": "Style Category",
         "search_cols": ["Style Category", "AI Prompt Keywords (Copy-Paste Ready)", "CSS/Technical Keywords"],
         "output_cols": ["Style Category", "AI Prompt Keywords (Copy-Paste Ready)", "CSS/Technical Keywords", "Implementation Checklist"]
     },
     "color": {
         "file": "colors.csv",
+        "name_col": "Product Type",
         "search_cols": ["Product Type", "Keywords", "Notes"],
         "output_cols": ["Product Type", "Keywords", "Primary (Hex)", "Secondary (Hex)", "CTA (Hex)", "Background (Hex)", "Text (Hex)", "Border (Hex)", "Notes"]
     },
     "chart": {
         "file": "charts.csv",
+        "name_col": "Data Type",
         "search_cols": ["Data Type", "Keywords", "Best Chart Type", "Accessibility Notes"],
         "output_cols": ["Data Type", "Keywords", "Best Chart Type", "Secondary Options", "Color Guidance", "Accessibility Notes", "Library Recommendation", "Interactive Level"]
     },
     "landing": {
         "file": "landing.csv",
+        "name_col": "Pattern Name",
         "search_cols": ["Pattern Name", "Keywords", "Conversion Optimization", "Section Order"],
         "output_cols": ["Pattern Name", "Keywords", "Section Order", "Primary CTA Placement", "Color Strategy", "Conversion Optimization"]
     },
     "product": {
         "file": "products.csv",
+        "name_col": "Product Type",
         "search_cols": ["Product Type", "Keywords", "Primary Style Recommendation", "Key Considerations"],
         "output_cols": ["Product Type", "Keywords", "Primary Style Recommendation", "Secondary Styles", "Landing Page Pattern", "Dashboard Style (if applicable)", "Color Palette Focus"]
     },
     "ux": {
         "file": "ux-guidelines.csv",
+        "name_col": "Issue",
         "search_cols": ["Category", "Issue", "Description", "Platform"],
         "output_cols": ["Category", "Issue", "Platform", "Description", "Do", "Don't", "Code Example Good", "Code Example Bad", "Severity"]
     },
     "typography": {
         "file": "typography.csv",
+        "name_col": "Font Pairing Name",
         "search_cols": ["Font Pairing Name", "Category", "Mood/Style Keywords", "Best For", "Heading Font", "Body Font"],
         "output_cols": ["Font Pairing Name", "Category", "Heading Font", "Body Font", "Mood/Style Keywords", "Best For", "Google Fonts URL", "CSS Import", "Tailwind Config", "Notes"]
     }
@@ -68,165 +194,2979 @@ STACK_CONFIG = {
     "flutter": {"file": "stacks/flutter.csv"}
 }
 
+# Product columns that point at rows of other tables, followed by
+# resolve_design_system(): (bundle key, target domain, product columns, separator
+# between several names or None). A name is matched against the target's
+# name_col (exactly, then as its leading words), else to the best of its top
+# JOIN_CANDIDATES BM25 hits whose name shares a word with it. Text spread over
+# several columns describes the product rather than naming a row, so a hit
+# sharing JOIN_MIN_SHARED_TERMS terms with it also counts. "N/A ..." names nothing.
+DESIGN_JOINS = (
+    ("style", "style", ("Primary Style Recommendation",), "+"),
+    ("secondary_styles", "style", ("Secondary Styles",), ","),
+    ("color", "color", ("Product Type",), None),
+    ("typography", "typography", ("Product Type", "Keywords", "Primary Style Recommendation", "Color Palette Focus"), None),
+    ("landing", "landing", ("Landing Page Pattern",), None),
+)
+JOIN_CANDIDATES = 5
+JOIN_MIN_SHARED_TERMS = 2
+_NO_REFERENCE = re.compile(r"\s*(n/?a|none)\b|\W*$", re.IGNORECASE)
+
 # Common columns for all stacks
 _STACK_COLS = {
+    "name_col": "Guideline",
     "search_cols": ["Category", "Guideline", "Description", "Do", "Don't"],
     "output_cols": ["Category", "Guideline", "Description", "Do", "Don't", "Code Good", "Code Bad", "Severity", "Docs URL"]
 }
 
 AVAILABLE_STACKS = list(STACK_CONFIG.keys())
 
+# Query keywords that route a search to a domain when none is given; ties go to
+# the domain listed first
+DOMAIN_KEYWORDS = {
+    "color": ["color", "palette", "hex", "#", "rgb"],
+    "chart": ["chart", "graph", "visualization", "trend", "bar", "pie", "scatter", "heatmap", "funnel"],
+    "landing": ["landing", "page", "cta", "conversion", "hero", "testimonial", "pricing", "section"],
+    "product": ["saas", "ecommerce", "e-commerce", "fintech", "healthcare", "gaming", "portfolio", "crypto", "dashboard"],
+    "prompt": ["prompt", "css", "implementation", "variable", "checklist", "tailwind"],
+    "style": ["style", "design", "ui", "minimalism", "glassmorphism", "neumorphism", "brutalism", "dark mode", "flat", "aurora"],
+    "ux": ["ux", "usability", "accessibility", "wcag", "touch", "scroll", "animation", "keyboard", "navigation", "mobile"],
+    "typography": ["font", "typography", "heading", "serif", "sans"]
+}
+DEFAULT_DOMAIN = "style"
+
+# When no keyword matches, optionally route by the IDF mass the query carries in
+# each domain's index (loads every domain index on first use)
+ROUTE_FALLBACK = bool(os.environ.get("UI_UX_PRO_MAX_ROUTE_FALLBACK"))
+
+
+# ============ TOKENIZER ============
+def s_stem(token):
+    """Harman's S-stemmer: fold common English plurals ("animations" -> "animation")"""
+    if token.endswith("ies") and not token.endswith(("eies", "aies")):
+        return token[:-3] + "y"
+    if token.endswith("es") and not token.endswith(("aes", "ees", "oes")):
+        return token[:-1]
+    if token.endswith("s") and not token.endswith(("us", "ss")):
+        return token[:-1]
+    return token
+
+
+NORMALIZERS = {"s-stem": s_stem}
+
+
+class Tokenizer:
+    """Text -> tokens pipeline shared by indexing and querying.
+
+    Lowercases, keeps runs of word characters at least `min_length` long
+    (one precompiled regex pass instead of substitute + split + filter), and
+    optionally applies a named normalizer from NORMALIZERS, memoized so each
+    distinct token is normalized once. Vocabulary tokens are interned by BM25
+    when first indexed, so every index shares one copy of each string.
+    """
+
+    __slots__ = ("min_length", "normalizer", "_pattern", "_normalize", "_memo")
+
+    MEMO_SIZE = 100000
+
+    def __init__(self, min_length=3, normalizer=None):
+        if normalizer is not None and normalizer not in NORMALIZERS:
+            raise ValueError(f"Unknown normalizer: {normalizer}. Available: {', '.join(NORMALIZERS)}")
+        self.min_length = min_length
+        self.normalizer = normalizer
+        # A run of \w is exactly a word left by replacing [^\w\s] with spaces and splitting
+        self._pattern = re.compile(r"\w{%d,}" % min_length)
+        self._normalize = NORMALIZERS.get(normalizer)
+        self._memo = {}
+
+    def __call__(self, text):
+        tokens = self._pattern.findall(str(text).lower())
+        if self._normalize is None:
+            return tokens
+
+        memo = self._memo
+        if len(memo) > self.MEMO_SIZE:
+            memo.clear()
+        normalized = []
+        for token in tokens:
+            value = memo.get(token)
+            if value is None:
+                value = memo[token] = sys.intern(self._normalize(token))
+            normalized.append(value)
+        return normalized
+
+    def spans(self, text):
+        """(token, start, end) per token, with offsets into `text` itself"""
+        spans = []
+        for match in self._pattern.finditer(str(text)):
+            token = match.group().lower()
+            if self._normalize is not None:
+                token = self._memo.get(token) or self._normalize(token)
+            spans.append((token, match.start(), match.end()))
+        return spans
+
+    def spec(self):
+        """Plain-data description; indices built with different specs never mix"""
+        return {"min_length": self.min_length, "normalizer": self.normalizer}
+
+    @classmethod
+    def from_spec(cls, spec):
+        return cls(spec["min_length"], spec["normalizer"])
+
+
+# Pipeline used for every index and query unless one is passed explicitly
+DEFAULT_TOKENIZER = Tokenizer(normalizer=os.environ.get("UI_UX_PRO_MAX_NORMALIZER") or None)
+
+_PHRASE = re.compile(r'"([^"]*)"')
+
+
+def parse_query(query, tokenizer=None):
+    """Split a query into (tokens, phrases).
+
+    Every word is a scoring token; "quoted phrases" are additionally
+    required to appear as consecutive tokens in a matching document.
+    """
+    tokenizer = tokenizer or DEFAULT_TOKENIZER
+    phrases = [tokens for tokens in map(tokenizer, _PHRASE.findall(query)) if tokens]
+    return tokenizer(query), phrases
+
+
+def _token_positions(tokens):
+    """token -> its positions in the document, in first-occurrence order"""
+    positions = {}
+    for i, token in enumerate(tokens):
+        found = positions.get(token)
+        if found is None:
+            positions[token] = [i]
+        else:
+            found.append(i)
+    return positions
+
+
+def _min_distance(first, second):
+    """Smallest gap from an occurrence of `first` to one of `second` (sorted lists).
+
+    Reversed order costs one extra, so "mode ... dark" is a weaker match
+    for the query "dark mode" than "dark mode" itself.
+    """
+    n, m = len(first), len(second)
+    if n == 1 and m == 1:
+        gap = second[0] - first[0]
+        return gap if gap > 0 else 1 - gap
+    best = None
+    i = j = 0
+    while i < n and j < m:
+        if first[i] < second[j]:
+            gap = second[j] - first[i]
+            i += 1
+        else:
+            gap = first[i] - second[j] + 1
+            j += 1
+        if best is None or gap < best:
+            best = gap
+    return best
+
+
+def _sizeof(buffer):
+    """Bytes behind an array, or behind a memoryview mapped from an index file"""
+    return buffer.nbytes if isinstance(buffer, memoryview) else sys.getsizeof(buffer)
+
+
+class _SortedWords:
+    """Terms of a vocabulary blob as UTF-8 bytes in sorted order (a sequence bisect can search)"""
+
+    __slots__ = ("blob", "offsets")
+
+    def __init__(self, blob, offsets):
+        self.blob = blob
+        self.offsets = offsets
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def __getitem__(self, rank):
+        return bytes(self.blob[self.offsets[rank]:self.offsets[rank + 1]])
+
+
+class _TermList(Sequence):
+    """Term id -> token over a Vocabulary (what a fitted BM25 keeps as `terms`)"""
+
+    __slots__ = ("vocab",)
+
+    def __init__(self, vocab):
+        self.vocab = vocab
+
+    def __len__(self):
+        return len(self.vocab)
+
+    def __getitem__(self, term):
+        vocab = self.vocab
+        rank = vocab.ranks[term]
+        return str(vocab.blob[vocab.offsets[rank]:vocab.offsets[rank + 1]], "utf-8")
+
+
+class Vocabulary(Mapping):
+    """Read-only token -> term id mapping over flat blocks, so it can be mapped from an index file.
+
+    The terms are concatenated in sorted UTF-8 order in `blob`; sorted term i
+    is blob[offsets[i]:offsets[i + 1]] with id ids[i], and ranks[id] = i.
+    Lookups bisect the sorted terms instead of hashing into a private dict.
+    """
+
+    __slots__ = ("blob", "offsets", "ids", "ranks", "terms", "_sorted")
+
+    def __init__(self, blob, offsets, ids, ranks):
+        self.blob = blob
+        self.offsets = offsets
+        self.ids = ids
+        self.ranks = ranks
+        self.terms = _TermList(self)
+        self._sorted = _SortedWords(blob, offsets)
+
+    @classmethod
+    def from_terms(cls, terms):
+        """Blocks for a term list (term id = position)"""
+        blob, offsets, ids = array("B"), array("Q", [0]), array("I")
+        for word, term in sorted((word.encode("utf-8"), term) for term, word in enumerate(terms)):
+            blob.frombytes(word)
+            offsets.append(len(blob))
+            ids.append(term)
+        ranks = array("I", bytes(ids.itemsize * len(ids)))
+        for rank, term in enumerate(ids):
+            ranks[term] = rank
+        return cls(blob, offsets, ids, ranks)
+
+    def get(self, token, default=None):
+        word = token.encode("utf-8")
+        rank = bisect_left(self._sorted, word)
+        if rank < len(self.ids) and self._sorted[rank] == word:
+            return self.ids[rank]
+        return default
+
+    def __getitem__(self, token):
+        term = self.get(token)
+        if term is None:
+            raise KeyError(token)
+        return term
+
+    def __contains__(self, token):
+        return self.get(token) is not None
+
+    def __len__(self):
+        return len(self.ids)
+
+    def __iter__(self):
+        for rank in range(len(self.ids)):
+            yield self._sorted[rank].decode("utf-8")
+
+    def memory_usage(self):
+        return sum(_sizeof(block) for block in (self.blob, self.offsets, self.ids, self.ranks))
+
+    def state(self):
+        return {"blob": self.blob, "offsets": self.offsets, "ids": self.ids, "ranks": self.ranks}
+
 
 # ============ BM25 IMPLEMENTATION ============
 class BM25:
-    """BM25 ranking algorithm for text search"""
+    """BM25 ranking algorithm for text search.
 
-    def __init__(self, k1=1.5, b=0.75):
+    Tokens map to integer term ids. Postings live CSR-style in flat arrays:
+    term t's documents are post_docs[post_starts[t]:post_starts[t + 1]]
+    (ascending), with matching term frequencies in post_tfs. Token positions
+    of posting p are post_positions[_pos_offsets[p]:_pos_offsets[p + 1]];
+    they drive quoted-phrase matching and the proximity boost.
+
+    `vocab` (token -> term id) and `terms` (term id -> token) are a dict and a
+    list while fitting, and a mapped Vocabulary once loaded from an index file.
+    """
+
+    __slots__ = ("k1", "b", "strategy", "tokenizer", "vocab", "terms", "doc_lengths", "avgdl", "idf", "doc_freqs",
+                 "post_starts", "post_docs", "post_tfs", "post_positions", "max_scores", "N", "_norms",
+                 "_pos_offsets")
+
+    def __init__(self, k1=1.5, b=0.75, strategy="auto", tokenizer=None):
+        if strategy not in RETRIEVAL_STRATEGIES:
+            raise ValueError(f"Unknown strategy: {strategy}. Available: {', '.join(RETRIEVAL_STRATEGIES)}")
         self.k1 = k1
         self.b = b
-        self.corpus = []
-        self.doc_lengths = []
+        self.strategy = strategy
+        self.tokenizer = tokenizer or DEFAULT_TOKENIZER
+        self.vocab = {}
+        self.terms = []
+        self.doc_lengths = array("I")
         self.avgdl = 0
-        self.idf = {}
-        self.doc_freqs = defaultdict(int)
+        self.idf = array("d")
+        self.doc_freqs = array("I")
+        self.post_starts = array("Q", [0])
+        self.post_docs = array("I")
+        self.post_tfs = array("I")
+        self.post_positions = array("I")
+        self.max_scores = array("d")
         self.N = 0
+        self._norms = array("d")
+        self._pos_offsets = array("Q", [0])
 
     def tokenize(self, text):
-        """Lowercase, split, remove punctuation, filter short words"""
-        text = re.sub(r'[^\w\s]', ' ', str(text).lower())
-        return [w for w in text.split() if len(w) > 2]
+        """Run the index's tokenizer pipeline (the same one for documents and queries)"""
+        return self.tokenizer(text)
 
     def fit(self, documents):
-        """Build BM25 index from documents"""
-        self.corpus = [self.tokenize(doc) for doc in documents]
-        self.N = len(self.corpus)
+        """Build BM25 index and postings lists from documents"""
+        vocab = {}
+        doc_lengths = array("I")
+        per_term = []  # term id -> (doc ids, tfs, positions) while building
+
+        for doc_id, doc in enumerate(documents):
+            tokens = self.tokenize(doc)
+            doc_lengths.append(len(tokens))
+            for word, positions in _token_positions(tokens).items():
+                term = vocab.get(word)
+                if term is None:
+                    term = vocab[sys.intern(word)] = len(per_term)
+                    per_term.append((array("I"), array("I"), array("I")))
+                docs, tfs, term_positions = per_term[term]
+                docs.append(doc_id)
+                tfs.append(len(positions))
+                term_positions.extend(positions)
+
+        self._set_postings(vocab, doc_lengths, per_term)
+
+    def add_documents(self, documents):
+        """Index more documents (ids continue from N) without refitting existing ones.
+
+        Only the new documents are tokenized; their postings are spliced after
+        each term's existing postings, and doc_freqs, avgdl, IDF and the
+        length norms are updated for the new corpus size.
+        """
+        if not isinstance(self.vocab, dict):
+            self.terms = [sys.intern(word) for word in self.terms]
+            self.vocab = {word: term for term, word in enumerate(self.terms)}
+        vocab, terms = self.vocab, self.terms
+        old_terms = len(terms)
+        delta = {}  # term id -> (doc ids, tfs, positions) of the new documents
+        doc_id = self.N
+
+        for doc in documents:
+            tokens = self.tokenize(doc)
+            self.doc_lengths.append(len(tokens))
+            for word, positions in _token_positions(tokens).items():
+                term = vocab.get(word)
+                if term is None:
+                    word = sys.intern(word)
+                    term = vocab[word] = len(terms)
+                    terms.append(word)
+                if term not in delta:
+                    delta[term] = (array("I"), array("I"), array("I"))
+                docs, tfs, term_positions = delta[term]
+                docs.append(doc_id)
+                tfs.append(len(positions))
+                term_positions.extend(positions)
+            doc_id += 1
+
+        if doc_id == self.N:
+            return
+        self.N = doc_id
+
+        # Copy untouched runs of postings in one slice; new ids sort after old ones
+        starts, docs, tfs = self.post_starts, self.post_docs, self.post_tfs
+        positions, offsets = self.post_positions, self._pos_offsets
+        new_starts, new_docs, new_tfs, new_positions = array("Q", [0]), array("I"), array("I"), array("I")
+        copied = 0  # old postings [0, copied) are already in new_docs
+        done = 0    # new_starts holds the start of every term up to and including `done`
+        for term in sorted(delta):
+            upto = min(term, old_terms)
+            if upto > done:
+                shift = len(new_docs) - copied
+                new_docs.extend(docs[copied:starts[upto]])
+                new_tfs.extend(tfs[copied:starts[upto]])
+                new_positions.extend(positions[offsets[copied]:offsets[starts[upto]]])
+                new_starts.extend(start + shift for start in starts[done + 1:upto + 1])
+                copied, done = starts[upto], upto
+
+            term_docs, term_tfs, term_positions = delta[term]
+            if term < old_terms:
+                new_docs.extend(docs[copied:starts[term + 1]])
+                new_tfs.extend(tfs[copied:starts[term + 1]])
+                new_positions.extend(positions[offsets[copied]:offsets[starts[term + 1]]])
+                copied = starts[term + 1]
+                self.doc_freqs[term] += len(term_docs)
+            else:
+                self.doc_freqs.append(len(term_docs))
+            new_docs.extend(term_docs)
+            new_tfs.extend(term_tfs)
+            new_positions.extend(term_positions)
+            new_starts.append(len(new_docs))
+            done = term + 1
+
+        if done < old_terms:
+            shift = len(new_docs) - copied
+            new_docs.extend(docs[copied:])
+            new_tfs.extend(tfs[copied:])
+            new_positions.extend(positions[offsets[copied]:])
+            new_starts.extend(start + shift for start in starts[done + 1:old_terms + 1])
+
+        self.post_starts, self.post_docs, self.post_tfs = new_starts, new_docs, new_tfs
+        self.post_positions = new_positions
+        self._finalize()
+
+    def _set_postings(self, vocab, doc_lengths, per_term, norms=None):
+        """Flatten per-term postings into the CSR arrays and derive the scoring tables"""
+        self.vocab = vocab
+        self.terms = list(vocab)
+        self.doc_lengths = doc_lengths
+        self.N = len(doc_lengths)
+
+        self.post_starts = array("Q", [0])
+        self.post_docs = array("I")
+        self.post_tfs = array("I")
+        self.post_positions = array("I")
+        for docs, tfs, positions in per_term:
+            self.post_docs.extend(docs)
+            self.post_tfs.extend(tfs)
+            self.post_positions.extend(positions)
+            self.post_starts.append(len(self.post_docs))
+        self.doc_freqs = array("I", (len(docs) for docs, _tfs, _positions in per_term))
+        self._finalize(norms)
+
+    def _finalize(self, norms=None):
+        """Derive avgdl, IDF, length norms, MaxScore bounds and position offsets from postings"""
+        self._compute_offsets()
         if self.N == 0:
             return
-        self.doc_lengths = [len(doc) for doc in self.corpus]
-        self.avgdl = sum(self.doc_lengths) / self.N
+        N = self.N
+        self.avgdl = sum(self.doc_lengths) / N
+        self.idf = array("d", (log((N - freq + 0.5) / (freq + 0.5) + 1) for freq in self.doc_freqs))
+        if norms is None:
+            self._compute_norms()
+        else:
+            self._norms = norms
+        self._compute_max_scores()
+
+    def _compute_norms(self):
+        """Per-document length normalization term of the BM25 denominator"""
+        self._norms = array("d", (self.k1 * (1 - self.b + self.b * doc_len / self.avgdl) for doc_len in self.doc_lengths))
+
+    def _compute_offsets(self):
+        """Start of each posting's run in post_positions (prefix sums of the tfs)"""
+        self._pos_offsets = array("Q", accumulate(self.post_tfs, initial=0))
+
+    def _compute_max_scores(self):
+        """Upper bound of each term's contribution to any document (for MaxScore)"""
+        k1_plus_1 = self.k1 + 1
+        norms, starts, docs, tfs = self._norms, self.post_starts, self.post_docs, self.post_tfs
+        self.max_scores = array("d", (
+            max(self.idf[term] * (tf * k1_plus_1) / (tf + norms[doc_id])
+                for doc_id, tf in zip(docs[starts[term]:starts[term + 1]], tfs[starts[term]:starts[term + 1]]))
+            for term in range(len(self.terms))
+        ))
+
+    def memory_usage(self):
+        """Approximate bytes held by the index: arrays, vocabulary and token strings"""
+        arrays = (self.doc_lengths, self.idf, self.doc_freqs, self.post_starts, self.post_docs,
+                  self.post_tfs, self.post_positions, self.max_scores, self._norms, self._pos_offsets)
+        if isinstance(self.vocab, Vocabulary):
+            vocab_bytes = self.vocab.memory_usage()
+        else:
+            vocab_bytes = (sys.getsizeof(self.vocab) + sys.getsizeof(self.terms)
+                           + sum(sys.getsizeof(word) for word in self.terms))
+        return sum(_sizeof(a) for a in arrays) + vocab_bytes
+
+    def state(self):
+        """Return the fitted index as plain data (for persistence)"""
+        return {
+            "k1": self.k1,
+            "b": self.b,
+            "tokenizer": self.tokenizer.spec(),
+            "vocab": (self.vocab if isinstance(self.vocab, Vocabulary) else Vocabulary.from_terms(self.terms)).state(),
+            "doc_lengths": self.doc_lengths,
+            "avgdl": self.avgdl,
+            "idf": self.idf,
+            "doc_freqs": self.doc_freqs,
+            "post_starts": self.post_starts,
+            "post_docs": self.post_docs,
+            "post_tfs": self.post_tfs,
+            "post_positions": self.post_positions,
+            "max_scores": self.max_scores,
+            "norms": self._norms,
+            "pos_offsets": self._pos_offsets,
+            "N": self.N,
+        }
+
+    @classmethod
+    def from_state(cls, state, strategy="auto"):
+        """Rebuild a fitted index from `state()` output without refitting"""
+        bm25 = cls(state["k1"], state["b"], strategy, Tokenizer.from_spec(state["tokenizer"]))
+        bm25.vocab = Vocabulary(**state["vocab"])
+        bm25.terms = bm25.vocab.terms
+        bm25.doc_lengths = state["doc_lengths"]
+        bm25.avgdl = state["avgdl"]
+        bm25.idf = state["idf"]
+        bm25.doc_freqs = state["doc_freqs"]
+        bm25.post_starts = state["post_starts"]
+        bm25.post_docs = state["post_docs"]
+        bm25.post_tfs = state["post_tfs"]
+        bm25.post_positions = state["post_positions"]
+        bm25.max_scores = state["max_scores"]
+        bm25.N = state["N"]
+        # Derived arrays are stored too, so a mapped index needs no private copies
+        bm25._pos_offsets = state["pos_offsets"]
+        bm25._norms = state["norms"]
+        return bm25
 
-        for doc in self.corpus:
-            seen = set()
-            for word in doc:
-                if word not in seen:
-                    self.doc_freqs[word] += 1
-                    seen.add(word)
+    @classmethod
+    def merge(cls, parts):
+        """One index over several fitted ones, without re-tokenizing.
 
-        for word, freq in self.doc_freqs.items():
-            self.idf[word] = log((self.N - freq + 0.5) / (freq + 0.5) + 1)
+        Document ids are renumbered in order. IDF is recomputed over the union,
+        but each document keeps its source's length normalization (per-source
+        avgdl), so short-row and long-row tables score on a comparable scale.
+        """
+        merged = cls(parts[0].k1, parts[0].b, tokenizer=parts[0].tokenizer) if parts else cls()
+        vocab = {}
+        per_term = []
+        doc_lengths = array("I")
+        norms = array("d")
+        offset = 0
+        for part in parts:
+            starts, pos_offsets = part.post_starts, part._pos_offsets
+            for term, word in enumerate(part.terms):
+                target = vocab.get(word)
+                if target is None:
+                    target = vocab[word] = len(per_term)
+                    per_term.append((array("I"), array("I"), array("I")))
+                docs, tfs, positions = per_term[target]
+                start, end = starts[term], starts[term + 1]
+                docs.extend(doc_id + offset for doc_id in part.post_docs[start:end])
+                tfs.extend(part.post_tfs[start:end])
+                positions.extend(part.post_positions[pos_offsets[start]:pos_offsets[end]])
+            doc_lengths.extend(part.doc_lengths)
+            norms.extend(part._norms)
+            offset += part.N
+
+        merged._set_postings(vocab, doc_lengths, per_term, norms)
+        return merged
 
     def score(self, query):
-        """Score all documents against query"""
-        query_tokens = self.tokenize(query)
-        scores = []
+        """Score documents containing at least one query token, best first"""
+        tokens, phrases = parse_query(query, self.tokenizer)
+        allowed = self._phrase_mask(phrases) if phrases else None
+        scores = self._scores(tokens, allowed, self._proximity(self._pairs(tokens), allowed))
+        return sorted(scores.items(), key=_rank_key)
 
-        for idx, doc in enumerate(self.corpus):
-            score = 0
-            doc_len = self.doc_lengths[idx]
-            term_freqs = defaultdict(int)
-            for word in doc:
-                term_freqs[word] += 1
+    def top_k(self, query, k, strategy=None, allowed=None):
+        """Return the k best (doc_id, score) pairs using the selected strategy.
 
-            for token in query_tokens:
-                if token in self.idf:
-                    tf = term_freqs[token]
-                    idf = self.idf[token]
-                    numerator = tf * (self.k1 + 1)
-                    denominator = tf + self.k1 * (1 - self.b + self.b * doc_len / self.avgdl)
-                    score += idf * numerator / denominator
+        `allowed` optionally restricts ranking to a subset: a bytes-like mask
+        indexed by doc id (see FacetIndex.mask), applied before top-k selection.
+        Quoted phrases narrow it further; the proximity boost is added on top.
+        """
+        strategy = strategy or self.strategy
+        if strategy == "auto":
+            strategy = "maxscore" if self.N >= MAXSCORE_MIN_DOCS else "heap"
+        if strategy not in RETRIEVAL_STRATEGIES:
+            raise ValueError(f"Unknown strategy: {strategy}. Available: {', '.join(RETRIEVAL_STRATEGIES)}")
+        if k <= 0:
+            return []  # a negative k would otherwise slice from the end
 
-            scores.append((idx, score))
+        tokens, phrases = parse_query(query, self.tokenizer)
+        if phrases:
+            allowed = self._phrase_mask(phrases, allowed)
+        bonus = self._proximity(self._pairs(tokens), allowed)
 
-        return sorted(scores, key=lambda x: x[1], reverse=True)
+        if strategy == "exhaustive":
+            return sorted(self._scores(tokens, allowed, bonus).items(), key=_rank_key)[:k]
+        if strategy == "heap":
+            return heapq.nsmallest(k, self._scores(tokens, allowed, bonus).items(), key=_rank_key)
+        return self._top_k_maxscore(tokens, k, allowed, bonus)
 
+    def top_k_batch(self, queries, k, strategy=None):
+        """top_k() for each query (same interface as SparseBM25.top_k_batch)"""
+        return [self.top_k(query, k, strategy) for query in queries]
+
+    def _contribution(self, term, doc_id, tf):
+        return self.idf[term] * (tf * (self.k1 + 1)) / (tf + self._norms[doc_id])
+
+    def _posting(self, term, doc_id, lo=None):
+        """Index of doc_id in term's postings, or None"""
+        end = self.post_starts[term + 1]
+        pos = bisect_left(self.post_docs, doc_id, self.post_starts[term] if lo is None else lo, end)
+        return pos if pos < end and self.post_docs[pos] == doc_id else None
+
+    def _positions(self, posting):
+        return self.post_positions[self._pos_offsets[posting]:self._pos_offsets[posting + 1]]
+
+    def _scores(self, query_tokens, allowed, bonus):
+        scores = self._accumulate(query_tokens, allowed)
+        for doc_id, extra in bonus.items():
+            scores[doc_id] += extra
+        return scores
+
+    def _phrase_docs(self, phrases):
+        """Ids of documents containing every phrase as consecutive tokens"""
+        matched = None
+        docs = self.post_docs
+        for phrase in phrases:
+            terms = [self.vocab.get(token) for token in phrase]
+            if None in terms:
+                return set()
+            # Walk the rarest term's postings, probing the others by binary search
+            lead = min(terms, key=lambda term: self.doc_freqs[term])
+            cursors = [self.post_starts[term] for term in terms]
+            found = set()
+            for doc_id in docs[self.post_starts[lead]:self.post_starts[lead + 1]]:
+                if matched is not None and doc_id not in matched:
+                    continue
+                runs = []
+                for i, term in enumerate(terms):
+                    posting = self._posting(term, doc_id, cursors[i])
+                    if posting is None:
+                        break
+                    cursors[i] = posting
+                    runs.append(self._positions(posting))
+                else:
+                    rest = [set(run) for run in runs[1:]]
+                    if any(all(start + i in run for i, run in enumerate(rest, 1)) for start in runs[0]):
+                        found.add(doc_id)
+            matched = found
+        return matched
+
+    def _phrase_mask(self, phrases, allowed=None):
+        """Byte mask of documents matching every phrase (and `allowed`)"""
+        mask = bytearray(self.N)
+        for doc_id in self._phrase_docs(phrases):
+            if allowed is None or allowed[doc_id]:
+                mask[doc_id] = 1
+        return mask
+
+    def _pairs(self, query_tokens):
+        """(term, term, weight) for each distinct pair of adjacent query terms"""
+        pairs = []
+        if PROXIMITY_WEIGHT <= 0:
+            return pairs
+        seen = set()
+        for first, second in zip(query_tokens, query_tokens[1:]):
+            pair = (self.vocab.get(first), self.vocab.get(second))
+            if None in pair or pair[0] == pair[1] or pair in seen:
+                continue
+            seen.add(pair)
+            pairs.append((*pair, PROXIMITY_WEIGHT * min(self.idf[pair[0]], self.idf[pair[1]])))
+        return pairs
+
+    def _proximity(self, pairs, allowed=None):
+        """doc id -> proximity boost for every document, by intersecting each pair's postings.
+
+        Walks the shorter postings list and binary searches the longer one,
+        then compares position lists; document text is never rescanned.
+        """
+        bonus = {}
+        docs, positions, offsets = self.post_docs, self.post_positions, self._pos_offsets
+        for a, b, weight in pairs:
+            swap = self.doc_freqs[a] > self.doc_freqs[b]
+            short, other = (b, a) if swap else (a, b)
+            cursor, end = self.post_starts[other], self.post_starts[other + 1]
+            for posting in range(self.post_starts[short], self.post_starts[short + 1]):
+                doc_id = docs[posting]
+                if allowed is not None and not allowed[doc_id]:
+                    continue
+                cursor = bisect_left(docs, doc_id, cursor, end)
+                if cursor == end:
+                    break
+                if docs[cursor] != doc_id:
+                    continue
+                runs = (positions[offsets[posting]:offsets[posting + 1]],
+                        positions[offsets[cursor]:offsets[cursor + 1]])
+                distance = _min_distance(*(runs[::-1] if swap else runs))
+                if distance <= PROXIMITY_WINDOW:
+                    bonus[doc_id] = bonus.get(doc_id, 0.0) + weight / distance
+        return bonus
+
+    def _accumulate(self, query_tokens, allowed=None):
+        """Term-at-a-time over postings: untouched documents score 0 and are skipped"""
+        scores = defaultdict(float)
+        k1_plus_1 = self.k1 + 1
+        norms, starts, docs, tfs = self._norms, self.post_starts, self.post_docs, self.post_tfs
+
+        for token in query_tokens:
+            term = self.vocab.get(token)
+            if term is None:
+                continue
+            idf = self.idf[term]
+            start, end = starts[term], starts[term + 1]
+            if allowed is None:
+                for doc_id, tf in zip(docs[start:end], tfs[start:end]):
+                    scores[doc_id] += idf * (tf * k1_plus_1) / (tf + norms[doc_id])
+            else:
+                for doc_id, tf in zip(docs[start:end], tfs[start:end]):
+                    if allowed[doc_id]:
+                        scores[doc_id] += idf * (tf * k1_plus_1) / (tf + norms[doc_id])
+
+        return scores
+
+    def _top_k_maxscore(self, query_tokens, k, allowed=None, bonus=None):
+        """Document-at-a-time MaxScore: only "essential" terms generate candidates.
+
+        `bonus` holds per-document proximity boosts; every bound is raised by
+        the largest of them so pruning stays exact.
+        """
+        query_terms = [self.vocab[token] for token in query_tokens if token in self.vocab]
+        if k <= 0 or not query_terms:
+            return []
+
+        counts = defaultdict(int)
+        for term in query_terms:
+            counts[term] += 1
+
+        # Terms by ascending upper bound; cumulative[i] bounds terms[0..i] together.
+        # The slack absorbs rounding differences between bound and exact sums.
+        terms = sorted(counts, key=lambda t: counts[t] * self.max_scores[t])
+        cumulative = []
+        total = 0.0
+        for term in terms:
+            total += counts[term] * self.max_scores[term] * (1 + 1e-9)
+            cumulative.append(total)
+        bonus = bonus or {}
+        max_bonus = max(bonus.values(), default=0.0) * (1 + 1e-9)
+        docs, tfs = self.post_docs, self.post_tfs
+        cursors = [self.post_starts[term] for term in terms]
+        ends = [self.post_starts[term + 1] for term in terms]
+
+        heap = []  # (score, -doc_id): root is the current k-th best
+        threshold = 0.0
+        first_essential = 0
+
+        while True:
+            doc_id = None
+            for i in range(first_essential, len(terms)):
+                pos = cursors[i]
+                if pos < ends[i] and (doc_id is None or docs[pos] < doc_id):
+                    doc_id = docs[pos]
+            if doc_id is None:
+                break
+
+            if allowed is not None and not allowed[doc_id]:
+                for i in range(first_essential, len(terms)):
+                    pos = cursors[i]
+                    if pos < ends[i] and docs[pos] == doc_id:
+                        cursors[i] = pos + 1
+                continue
+
+            contributions = {}
+            partial = 0.0
+            for i in range(first_essential, len(terms)):
+                pos = cursors[i]
+                if pos < ends[i] and docs[pos] == doc_id:
+                    contribution = self._contribution(terms[i], doc_id, tfs[pos])
+                    contributions[terms[i]] = contribution
+                    partial += counts[terms[i]] * contribution
+                    cursors[i] = pos + 1
+
+            # Probe non-essential terms, largest bound first, while the doc can still qualify
+            pruned = False
+            for i in range(first_essential - 1, -1, -1):
+                if partial + cumulative[i] + max_bonus <= threshold:
+                    pruned = True
+                    break
+                pos = cursors[i] = bisect_left(docs, doc_id, cursors[i], ends[i])
+                if pos < ends[i] and docs[pos] == doc_id:
+                    contribution = self._contribution(terms[i], doc_id, tfs[pos])
+                    contributions[terms[i]] = contribution
+                    partial += counts[terms[i]] * contribution
+            if pruned:
+                continue
+
+            # Exact score summed in query order, identical to _accumulate
+            score = 0.0
+            for term in query_terms:
+                score += contributions.get(term, 0.0)
+            if doc_id in bonus:
+                score += bonus[doc_id]
+
+            # Later documents lose ties, so they must strictly beat the threshold
+            if len(heap) < k:
+                heapq.heappush(heap, (score, -doc_id))
+            elif score > heap[0][0]:
+                heapq.heapreplace(heap, (score, -doc_id))
+            else:
+                continue
+
+            if len(heap) == k:
+                threshold = heap[0][0]
+                while first_essential < len(terms) and cumulative[first_essential] + max_bonus <= threshold:
+                    first_essential += 1
+
+        return sorted(((-neg_id, score) for score, neg_id in heap), key=_rank_key)
+
+
+def _rank_key(item):
+    """Best score first, ties broken by original row order"""
+    return (-item[1], item[0])
+
+
+# ============ FUZZY MATCHING ============
+def _deletes(word, distance):
+    """Every string obtained from word by deleting up to `distance` characters"""
+    found = frontier = {word}
+    for _ in range(distance):
+        frontier = {w[:i] + w[i + 1:] for w in frontier for i in range(len(w))}
+        found = found | frontier
+    return found
+
+
+def _edit_distance(a, b, limit):
+    """Optimal string alignment distance (an adjacent swap is one edit); limit + 1 once it exceeds limit"""
+    if abs(len(a) - len(b)) > limit:
+        return limit + 1
+    before, previous = None, list(range(len(b) + 1))
+    for i in range(1, len(a) + 1):
+        current = [i] + [0] * len(b)
+        for j in range(1, len(b) + 1):
+            value = min(previous[j] + 1, current[j - 1] + 1, previous[j - 1] + (a[i - 1] != b[j - 1]))
+            if i > 1 and j > 1 and a[i - 1] == b[j - 2] and a[i - 2] == b[j - 1]:
+                value = min(value, before[j - 2] + 1)
+            current[j] = value
+        if min(current) > limit:
+            return limit + 1
+        before, previous = previous, current
+    return min(previous[-1], limit + 1)
+
+
+_WORD = re.compile(r"\w+")
+
+
+class SpellIndex:
+    """SymSpell-style symmetric-delete dictionary over a BM25 vocabulary.
+
+    Each term's first FUZZY_PREFIX_LENGTH characters are stored under all of
+    their deletions of up to FUZZY_MAX_DISTANCE characters. A misspelled word
+    reaches its candidates through its own deletions, so a lookup is a few
+    dozen dict probes plus exact edit distances on the few candidates found.
+    """
+
+    __slots__ = ("bm25", "_deletes")
+
+    def __init__(self, bm25):
+        self.bm25 = bm25
+        deletes = {}
+        for term, word in enumerate(bm25.terms):
+            for key in _deletes(word[:FUZZY_PREFIX_LENGTH], FUZZY_MAX_DISTANCE):
+                deletes.setdefault(key, []).append(term)
+        self._deletes = deletes
+
+    def lookup(self, token):
+        """Closest indexed term to an unknown token (fewest edits, then most documents), or None"""
+        if token in self.bm25.vocab or len(token) < FUZZY_MIN_LENGTH:
+            return None
+        limit = FUZZY_MAX_DISTANCE if len(token) >= 8 else 1
+        terms, doc_freqs = self.bm25.terms, self.bm25.doc_freqs
+        best = None  # (distance, -doc_freq, word)
+        seen = set()
+        for key in _deletes(token[:FUZZY_PREFIX_LENGTH], limit):
+            for term in self._deletes.get(key, ()):
+                if term in seen:
+                    continue
+                seen.add(term)
+                distance = _edit_distance(token, terms[term], limit)
+                if distance <= limit:
+                    candidate = (distance, -doc_freqs[term], terms[term])
+                    if best is None or candidate < best:
+                        best = candidate
+        return best[2] if best else None
+
+    def correct(self, query):
+        """(query with unknown words replaced by their closest terms, {word: term})"""
+        tokenizer = self.bm25.tokenizer
+        corrections = {}
+
+        def replace(match):
+            tokens = tokenizer(match.group())
+            fixed = self.lookup(tokens[0]) if len(tokens) == 1 else None
+            if fixed is None:
+                return match.group()
+            corrections[match.group().lower()] = fixed
+            return fixed
+
+        return _WORD.sub(replace, query), corrections
+
+
+def _has_unknown_words(query, tokenizer, known):
+    """Whether SpellIndex.correct() could change `query`: a word that is one token,
+    long enough to correct and not `known` (checked before any SpellIndex is built)"""
+    for word in _WORD.findall(query):
+        tokens = tokenizer(word)
+        if len(tokens) == 1 and len(tokens[0]) >= FUZZY_MIN_LENGTH and not known(tokens[0]):
+            return True
+    return False
+
+
+# ============ VECTORIZED BACKEND ============
+class SparseBM25:
+    """BM25 as a sparse doc-term matrix of precomputed term weights.
+
+    A batch of queries becomes a term-count matrix, so scoring it is a single
+    sparse product; phrases and proximity boosts then come from the BM25's
+    positional postings. Weights are taken from a fitted BM25 and match its
+    scores to floating-point tolerance. Uses scipy.sparse when installed, otherwise
+    plain NumPy per-term accumulation. Requires NumPy; see batch_scorer().
+
+    Search itself does not use it: the CLI's --batch mode and the daemon answer
+    each line as it arrives, through search()'s routing and result cache.
+    bench.py measures it against per-query ranking.
+    """
+
+    __slots__ = ("bm25", "N", "vocab", "matrix", "_columns")
+
+    def __init__(self, bm25):
+        np, sparse = _numpy(), _sparse()
+        if np is None:
+            raise ImportError("SparseBM25 requires numpy")
+        self.bm25 = bm25
+        self.N = bm25.N
+        self.vocab = bm25.vocab
+
+        # Weights for every posting at once, read straight from the CSR arrays
+        starts = _as_numpy(bm25.post_starts).astype(np.int64)
+        docs = _as_numpy(bm25.post_docs).astype(np.int64)
+        tfs = _as_numpy(bm25.post_tfs).astype(np.float64)
+        term_of = np.repeat(np.arange(len(bm25.terms)), np.diff(starts))
+        idf = _as_numpy(bm25.idf)
+        norms = _as_numpy(bm25._norms)
+        weights = idf[term_of] * (tfs * (bm25.k1 + 1)) / (tfs + norms[docs]) if len(docs) else tfs
+
+        # Per-term (doc ids, weights) views: the matrix in column-major form
+        self._columns = [(docs[starts[t]:starts[t + 1]], weights[starts[t]:starts[t + 1]])
+                         for t in range(len(bm25.terms))]
+
+        self.matrix = None
+        if sparse is not None and len(docs):
+            self.matrix = sparse.csr_matrix((weights, (docs, term_of)), shape=(self.N, len(bm25.terms)))
+
+    def _query_counts(self, queries):
+        """(term ids, query ids, counts) triples for a batch of query strings"""
+        term_ids, query_ids, counts = [], [], []
+        for q, query in enumerate(queries):
+            tf = defaultdict(int)
+            for token in self.bm25.tokenize(query):
+                term = self.vocab.get(token)
+                if term is not None:
+                    tf[term] += 1
+            for term, count in tf.items():
+                term_ids.append(term)
+                query_ids.append(q)
+                counts.append(count)
+        return term_ids, query_ids, counts
+
+    def score_batch(self, queries):
+        """Dense (len(queries), N) score matrix"""
+        np = _numpy()
+        term_ids, query_ids, counts = self._query_counts(queries)
+        if self.matrix is not None:
+            query_matrix = _sparse().csc_matrix(
+                (np.asarray(counts, dtype=np.float64), (term_ids, query_ids)),
+                shape=(len(self.vocab), len(queries)))
+            return (self.matrix @ query_matrix).T.toarray()
+
+        scores = np.zeros((len(queries), self.N))
+        by_term = defaultdict(list)
+        for term, q, count in zip(term_ids, query_ids, counts):
+            by_term[term].append((q, count))
+        for term, entries in by_term.items():
+            docs, weights = self._columns[term]
+            qs = np.array([q for q, _c in entries])
+            cs = np.array([c for _q, c in entries], dtype=np.float64)
+            scores[np.ix_(qs, docs)] += np.outer(cs, weights)
+        return scores
+
+    def top_k_batch(self, queries, k):
+        """Best k (doc_id, score) pairs per query, ties broken by row order like BM25"""
+        queries = list(queries)
+        if k <= 0 or self.N == 0:
+            return [[] for _ in queries]
+        chunk = max(1, SPARSE_CHUNK_CELLS // self.N)
+        results = []
+        for start in range(0, len(queries), chunk):
+            batch = queries[start:start + chunk]
+            for query, row in zip(batch, self.score_batch(batch)):
+                results.append(_top_k_array(self._apply_positions(query, row), k))
+        return results
+
+    def _apply_positions(self, query, row):
+        """Phrase filter and proximity boost from the positional postings, as in BM25.top_k"""
+        bm25 = self.bm25
+        tokens, phrases = parse_query(query, bm25.tokenizer)
+        allowed = None
+        if phrases:
+            np = _numpy()
+            allowed = bm25._phrase_mask(phrases)
+            row[np.frombuffer(allowed, dtype=np.uint8) == 0] = 0.0
+        for doc_id, extra in bm25._proximity(bm25._pairs(tokens), allowed).items():
+            row[doc_id] += extra
+        return row
+
+
+def _top_k_array(row, k):
+    """Best k (doc_id, score) pairs with score > 0 from a dense score vector, ties by row order"""
+    if k <= 0:
+        return []  # like BM25.top_k (np.partition has no kth for k <= 0)
+    np = _numpy()
+    matches = np.flatnonzero(row > 0)
+    if len(matches) > k:
+        # Keep every document tied with the k-th score, then order exactly
+        kth = np.partition(row[matches], len(matches) - k)[len(matches) - k]
+        matches = matches[row[matches] >= kth]
+    order = np.lexsort((matches, -row[matches]))[:k]
+    return [(int(matches[i]), float(row[matches[i]])) for i in order]
+
+
+def _as_numpy(buffer):
+    """Zero-copy NumPy view of an array.array / memoryview"""
+    np = _numpy()
+    view = memoryview(buffer)
+    return np.frombuffer(view, dtype=np.dtype(view.format))
+
+
+def batch_scorer(bm25):
+    """SparseBM25 for a fitted index when NumPy is installed, else the BM25 itself"""
+    return SparseBM25(bm25) if _numpy() is not None else bm25
+
+
+# ============ DENSE RETRIEVAL ============
+def _truncated_svd(matrix, k, n_iter=4, seed=0):
+    """Top-k right singular vectors and values (randomized range finder; exact when small)"""
+    np = _numpy()
+    n_rows, n_cols = matrix.shape
+    if n_rows * n_cols <= SPARSE_CHUNK_CELLS:
+        dense = matrix.toarray() if hasattr(matrix, "toarray") else matrix
+        _u, values, vt = np.linalg.svd(dense, full_matrices=False)
+        return values[:k], vt[:k]
+
+    rng = np.random.default_rng(seed)
+    basis = matrix @ rng.standard_normal((n_cols, min(n_cols, k + 10)))
+    basis, _r = np.linalg.qr(basis)
+    for _ in range(n_iter):
+        basis, _r = np.linalg.qr(matrix.T @ basis)
+        basis, _r = np.linalg.qr(matrix @ basis)
+    _u, values, vt = np.linalg.svd(np.asarray(matrix.T @ basis).T, full_matrices=False)
+    return values[:k], vt[:k]
+
+
+def _normalize_rows(vectors):
+    np = _numpy()
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    return vectors / np.where(norms > 0, norms, 1.0)
+
+
+class DenseIndex:
+    """LSA embeddings of a fitted BM25: its TF-IDF matrix reduced by truncated SVD.
+
+    Documents and queries are projected into a few latent dimensions in which
+    words that share contexts ("calm", "minimal") lie close together; ranking
+    is a brute-force cosine over every document. Requires NumPy; scipy.sparse
+    is used for the TF-IDF matrix when installed.
+    """
+
+    __slots__ = ("bm25", "doc_vectors", "term_vectors", "sha256")
+
+    def __init__(self, bm25, doc_vectors, term_vectors, sha256=None):
+        self.bm25 = bm25
+        self.doc_vectors = doc_vectors    # (N, dims) float32, unit rows
+        self.term_vectors = term_vectors  # (terms, dims) float32: fold-in projection
+        self.sha256 = sha256
+
+    @classmethod
+    def build(cls, bm25, sha256=None):
+        """Fit the embedding from the BM25 postings (sublinear tf x idf, unit-length rows)"""
+        np, sparse = _numpy(), _sparse()
+        if np is None:
+            raise ImportError("Dense retrieval requires numpy")
+        n_terms = len(bm25.terms)
+        dims = max(1, min(DENSE_DIMENSIONS, bm25.N // 4, n_terms))
+        if bm25.N == 0:
+            return cls(bm25, np.zeros((0, dims), np.float32), np.zeros((n_terms, dims), np.float32), sha256)
+
+        starts = _as_numpy(bm25.post_starts).astype(np.int64)
+        docs = _as_numpy(bm25.post_docs).astype(np.int64)
+        term_of = np.repeat(np.arange(n_terms), np.diff(starts))
+        weights = (1 + np.log(_as_numpy(bm25.post_tfs).astype(np.float64))) * _as_numpy(bm25.idf)[term_of]
+        weights /= np.sqrt(np.bincount(docs, weights * weights, minlength=bm25.N))[docs]
+        if sparse is not None:
+            matrix = sparse.csr_matrix((weights, (docs, term_of)), shape=(bm25.N, n_terms))
+        else:
+            matrix = np.zeros((bm25.N, n_terms))
+            matrix[docs, term_of] = weights
+
+        _values, vt = _truncated_svd(matrix, dims)
+        term_vectors = np.ascontiguousarray(vt.T, dtype=np.float32)
+        doc_vectors = _normalize_rows(np.asarray(matrix @ vt.T)).astype(np.float32)
+        return cls(bm25, doc_vectors, term_vectors, sha256)
+
+    def query_vector(self, query_tokens):
+        """Unit-length latent vector of a tokenized query (zero when no token is indexed)"""
+        np = _numpy()
+        vector = np.zeros(self.term_vectors.shape[1], dtype=np.float32)
+        counts = defaultdict(int)
+        for token in query_tokens:
+            term = self.bm25.vocab.get(token)
+            if term is not None:
+                counts[term] += 1
+        for term, count in counts.items():
+            vector += (1 + log(count)) * self.bm25.idf[term] * self.term_vectors[term]
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm > 0 else vector
+
+    def scores(self, query_tokens):
+        """Cosine similarity of every document to the query"""
+        return self.doc_vectors @ self.query_vector(query_tokens)
+
+    def top_k(self, query, k, allowed=None):
+        """Best k (doc_id, cosine) pairs; phrases and `allowed` restrict candidates as in BM25.top_k"""
+        tokens, phrases = parse_query(query, self.bm25.tokenizer)
+        if phrases:
+            allowed = self.bm25._phrase_mask(phrases, allowed)
+        return _top_k_array(self._masked(self.scores(tokens).astype(_numpy().float64), allowed), k)
+
+    def hybrid_top_k(self, query, k, allowed=None, weight=None):
+        """Fuse max-normalized BM25 scores with cosine similarity (weight = BM25 share)"""
+        np = _numpy()
+        weight = HYBRID_WEIGHT if weight is None else weight
+        bm25 = self.bm25
+        tokens, phrases = parse_query(query, bm25.tokenizer)
+        if phrases:
+            allowed = bm25._phrase_mask(phrases, allowed)
+        lexical = np.zeros(bm25.N)
+        scores = bm25._scores(tokens, allowed, bm25._proximity(bm25._pairs(tokens), allowed))
+        if scores:
+            lexical[list(scores)] = list(scores.values())
+            lexical /= lexical.max()
+        semantic = np.clip(self.scores(tokens), 0.0, None)
+        return _top_k_array(self._masked(weight * lexical + (1 - weight) * semantic, allowed), k)
+
+    @staticmethod
+    def _masked(row, allowed):
+        if allowed is not None:
+            np = _numpy()
+            row[np.frombuffer(bytes(allowed), dtype=np.uint8) == 0] = 0.0
+        return row
+
+    def memory_usage(self):
+        return self.doc_vectors.nbytes + self.term_vectors.nbytes
+
+    def save(self, path):
+        """Write the vectors next to the BM25 index (see _atomic_write)"""
+        np = _numpy()
+        _atomic_write(path, lambda f: np.savez(f, doc_vectors=self.doc_vectors, term_vectors=self.term_vectors,
+                                               sha256=np.array(self.sha256 or "")))
+
+    @classmethod
+    def load(cls, path, bm25, sha256):
+        """Saved vectors for this exact index version, or None"""
+        try:
+            np = _numpy()
+            if np is None:
+                return None
+            with np.load(path) as data:
+                if str(data["sha256"]) != sha256 or data["doc_vectors"].shape[0] != bm25.N:
+                    return None
+                return cls(bm25, data["doc_vectors"], data["term_vectors"], sha256)
+        except (OSError, KeyError, ValueError):
+            return None
+
+
+# ============ COMPILED INDEX ============
+def _iter_records(f, start=0):
+    """Yield (start, end, fields) for each CSV record of a binary file, with byte offsets.
+
+    Lines are decoded one at a time with universal line endings, so a record's
+    byte range can later be re-parsed on its own (see RowStore).
+    """
+    pos = start
+
+    def lines():
+        nonlocal pos
+        for line in f:
+            pos += len(line)
+            text = line.decode("utf-8")
+            if text.endswith("\r\n"):
+                text = text[:-2] + "\n"
+            yield text
+
+    # csv.reader pulls exactly the lines of one record, so `pos` is its end
+    record_start = start
+    for fields in csv.reader(lines()):
+        yield record_start, pos, fields
+        record_start = pos
+
+
+def _record_to_row(fieldnames, fields):
+    """Same dict csv.DictReader would build for this record"""
+    row = dict(zip(fieldnames, fields))
+    if len(fieldnames) < len(fields):
+        row[None] = fields[len(fieldnames):]
+    elif len(fieldnames) > len(fields):
+        for key in fieldnames[len(fields):]:
+            row[key] = None
+    return row
+
+
+class RowStore:
+    """Output rows read lazily from the source CSV through mmap.
+
+    Only byte offsets are kept in memory; a row is decoded into a dict when
+    it is actually returned as a result.
+    """
+
+    __slots__ = ("filepath", "fieldnames", "output_cols", "starts", "ends", "_map")
+
+    def __init__(self, filepath, fieldnames, output_cols, starts, ends):
+        self.filepath = filepath
+        self.fieldnames = fieldnames
+        self.output_cols = output_cols
+        self.starts = starts
+        self.ends = ends
+        self._map = None
+
+    def __len__(self):
+        return len(self.starts)
+
+    def __getitem__(self, row_id):
+        start, end = self.starts[row_id], self.ends[row_id]
+        if self._map is None:
+            with open(self.filepath, "rb") as f:
+                self._map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        _start, _end, fields = next(_iter_records(io.BytesIO(self._map[start:end])))
+        row = _record_to_row(self.fieldnames, fields)
+        return {col: row.get(col, "") for col in self.output_cols if col in row}
+
+    def close(self):
+        """Drop the current mapping (the file grew; the next read maps it again)"""
+        if self._map is not None:
+            self._map.close()
+            self._map = None
+
+    def memory_usage(self):
+        return _sizeof(self.starts) + _sizeof(self.ends)
+
+    def state(self):
+        return {"fieldnames": self.fieldnames, "starts": self.starts, "ends": self.ends}
+
+    @classmethod
+    def from_state(cls, state, filepath, output_cols):
+        return cls(filepath, state["fieldnames"], output_cols, state["starts"], state["ends"])
+
+
+def _facet_value(value):
+    """Filter values match cells case-insensitively, ignoring surrounding whitespace"""
+    return "" if value is None else str(value).strip().lower()
+
+
+_MASK_BYTES = bytes.maketrans(b"01", b"\x00\x01")
+
+
+def _bitmap(bits):
+    """A facet bitmap as an int (mapped ones are little-endian bytes until used)"""
+    return bits if isinstance(bits, int) else int.from_bytes(bits, "little")
+
+
+class FacetIndex:
+    """Value -> row bitmap (a Python int) for each low-cardinality CSV column.
+
+    Row ids are collected while rows stream in and packed into bitmaps by
+    flush(). Bitmaps are persisted as bytes blocks, which a loaded index
+    keeps mapped and converts per query (see _bitmap). A column is dropped as soon as it exceeds FACET_MAX_VALUES
+    distinct values or sees a value longer than FACET_MAX_LENGTH.
+    """
+
+    __slots__ = ("columns", "dropped", "_pending")
+
+    def __init__(self, columns=None, dropped=()):
+        self.columns = columns if columns is not None else {}
+        self.dropped = set(dropped)
+        self._pending = {}
+
+    def add(self, doc_id, row):
+        for col, value in row.items():
+            if col is None or col in self.dropped:
+                continue
+            value = _facet_value(value)
+            values = self.columns.setdefault(col, {})
+            if value not in values:
+                if len(values) >= FACET_MAX_VALUES or len(value) > FACET_MAX_LENGTH:
+                    self.dropped.add(col)
+                    del self.columns[col]
+                    self._pending.pop(col, None)
+                    continue
+                values[value] = 0
+            self._pending.setdefault(col, {}).setdefault(value, array("L")).append(doc_id)
+
+    def flush(self):
+        """Pack the row ids collected by add() into the column bitmaps"""
+        for col, pending in self._pending.items():
+            values = self.columns[col]
+            for value, doc_ids in pending.items():
+                bits = bytearray(doc_ids[-1] // 8 + 1)
+                for doc_id in doc_ids:
+                    bits[doc_id >> 3] |= 1 << (doc_id & 7)
+                values[value] = _bitmap(values[value]) | int.from_bytes(bits, "little")
+        self._pending = {}
+
+    def match(self, where):
+        """Bitmap of rows matching every column in `where` ({column: value or [values]})"""
+        names = {col.lower(): col for col in self.columns}
+        selected = None
+        for col, values in where.items():
+            name = names.get(str(col).strip().lower())
+            if name is None:
+                raise ValueError(f"Cannot filter on column: {col}. Filterable: {', '.join(self.columns)}")
+            if isinstance(values, str):
+                values = [values]
+            bitmap = 0
+            for value in values:
+                bitmap |= _bitmap(self.columns[name].get(_facet_value(value), 0))
+            selected = bitmap if selected is None else selected & bitmap
+        return selected
+
+    def mask(self, where, n):
+        """match() as bytes of 0/1 per row id, for O(1) checks while ranking"""
+        bits = bin(self.match(where))[:1:-1].ljust(n, "0")[:n]
+        return bits.encode("ascii").translate(_MASK_BYTES)
+
+    def memory_usage(self):
+        return sum(_sizeof(bitmap) for values in self.columns.values() for bitmap in values.values())
+
+    def state(self):
+        columns = {col: {value: array("B", bits.to_bytes((bits.bit_length() + 7) // 8, "little"))
+                         if isinstance(bits, int) else bits
+                         for value, bits in values.items()}
+                   for col, values in self.columns.items()}
+        return {"columns": columns, "dropped": sorted(self.dropped)}
+
+    @classmethod
+    def from_state(cls, state):
+        return cls(state["columns"], state["dropped"])
+
+
+class SearchIndex:
+    """Fitted BM25 index for one CSV plus the row store it ranks and its column facets"""
+
+    __slots__ = ("bm25", "rows", "facets", "source", "output_cols", "_spell")
+
+    def __init__(self, bm25, rows, facets, source, output_cols):
+        self.bm25 = bm25
+        self.rows = rows
+        self.facets = facets
+        self.source = source
+        self.output_cols = output_cols
+        self._spell = None
+
+    @property
+    def spell(self):
+        """SpellIndex over the vocabulary, built on the first fuzzy lookup (not persisted)"""
+        if self._spell is None:
+            self._spell = SpellIndex(self.bm25)
+        return self._spell
+
+    def correct(self, query):
+        """spell.correct(query), without building the SpellIndex while every word is indexed"""
+        if not _has_unknown_words(query, self.bm25.tokenizer, self.bm25.vocab.__contains__):
+            return query, {}
+        return self.spell.correct(query)
+
+    def memory_usage(self):
+        """Approximate bytes held by the BM25 index, the row offsets and the facet bitmaps"""
+        return self.bm25.memory_usage() + self.rows.memory_usage() + self.facets.memory_usage()
+
+    def state(self):
+        return {"format": INDEX_FORMAT, "bm25": self.bm25.state(), "rows": self.rows.state(),
+                "facets": self.facets.state(), "source": self.source}
+
+    @classmethod
+    def from_state(cls, state, filepath, output_cols):
+        rows = RowStore.from_state(state["rows"], filepath, output_cols)
+        facets = FacetIndex.from_state(state["facets"])
+        return cls(BM25.from_state(state["bm25"]), rows, facets, state["source"], output_cols)
+
+
+def _source_signature(filepath):
+    """Size and mtime of a CSV (its content hash is added while it is read)"""
+    st = filepath.stat()
+    return {"size": st.st_size, "mtime_ns": st.st_mtime_ns}
+
+
+def _hashed_lines(f, hasher):
+    """Iterate a binary file's lines, feeding them to hasher on the way"""
+    for line in f:
+        hasher.update(line)
+        yield line
+
+
+_INDEX_PATHS = {}
+
+
+def _index_path(filepath, search_cols, output_cols, tokenizer):
+    """Cache file for a CSV + column/tokenizer config (changing any gets a new file)"""
+    spec = tokenizer.spec()
+    memo_key = (str(filepath), tuple(search_cols), tuple(output_cols), tuple(sorted(spec.items())))
+    path = _INDEX_PATHS.get(memo_key)
+    if path is None:
+        key = repr((str(filepath.resolve()), search_cols, output_cols, spec, INDEX_FORMAT))
+        # crc32, not hashlib: importing hashlib (OpenSSL) costs more than a warm search
+        digest = f"{zlib.crc32(key.encode('utf-8')):08x}"
+        path = _INDEX_PATHS[memo_key] = INDEX_DIR / f"{filepath.stem}.{digest}.idx"
+    return path
+
+
+def _documents(records, fieldnames, search_cols, starts, ends, facets):
+    """Stream search documents from CSV records, recording each row's byte range and facets"""
+    for start, end, fields in records:
+        # Blank records are skipped, like csv.DictReader
+        if not fields:
+            continue
+        starts.append(start)
+        ends.append(end)
+        row = _record_to_row(fieldnames, fields)
+        facets.add(len(starts) - 1, row)
+        yield " ".join(str(row.get(col, "")) for col in search_cols)
 
-# ============ SEARCH FUNCTIONS ============
-def _load_csv(filepath):
-    """Load CSV and return list of dicts"""
-    with open(filepath, 'r', encoding='utf-8') as f:
-        return list(csv.DictReader(f))
 
+def _build_index(filepath, f, search_cols, output_cols, source, tokenizer):
+    """Fit a fresh index from a CSV stream; source["sha256"] is filled in as it is read"""
+    import hashlib
+    hasher = hashlib.sha256()
+    records = _iter_records(_hashed_lines(f, hasher))
+    header = next(records, None)
+    fieldnames = header[2] if header else []
+    starts, ends = array("Q"), array("Q")
 
-def _search_csv(filepath, search_cols, output_cols, query, max_results):
-    """Core search function using BM25"""
+    bm25 = BM25(tokenizer=tokenizer)
+    facets = FacetIndex()
+    bm25.fit(_documents(records, fieldnames, search_cols, starts, ends, facets))
+    for _record in records:
+        pass  # hash anything the fit did not consume
+    facets.flush()
+    source["sha256"] = hasher.hexdigest()
+    rows = RowStore(filepath, fieldnames, output_cols, starts, ends)
+    return SearchIndex(bm25, rows, facets, source, output_cols)
+
+
+def _hash_prefix(f, size):
+    """sha256 object over the first `size` bytes of f"""
+    import hashlib
+    hasher = hashlib.sha256()
+    remaining = size
+    while remaining > 0:
+        chunk = f.read(min(remaining, 1 << 20))
+        if not chunk:
+            break
+        hasher.update(chunk)
+        remaining -= len(chunk)
+    return hasher
+
+
+def _update_index(index, f, search_cols, current):
+    """Bring an index up to date with its CSV, reading the file once.
+
+    Returns the index itself when the content is unchanged (only re-keyed),
+    applies just the new rows when the file only grew, and returns None when
+    a full rebuild is needed.
+    """
+    old = index.source
+    if current["size"] < old["size"] or "sha256" not in old:
+        return None
+
+    hasher = _hash_prefix(f, old["size"])
+    if hasher.hexdigest() != old["sha256"]:
+        return None
+    if current["size"] == old["size"]:
+        index.source = {**current, "sha256": old["sha256"]}
+        return index
+
+    # The old content must end on a record boundary: either a line break, or
+    # (for files saved without a trailing newline) the appended bytes start with one
+    if not old["size"]:
+        return None
+    rows = index.rows
+    start = old["size"]
+    f.seek(start - 1)
+    if f.read(1) != b"\n":
+        head = f.read(2)
+        newline = 2 if head == b"\r\n" else 1 if head[:1] == b"\n" else 0
+        if not newline:
+            return None
+        hasher.update(head[:newline])
+        start += newline
+        if len(rows.ends) and rows.ends[-1] == old["size"]:
+            rows.ends[-1] = start
+        f.seek(start)
+
+    records = _iter_records(_hashed_lines(f, hasher), start=start)
+    index.bm25.add_documents(_documents(records, rows.fieldnames, search_cols, rows.starts, rows.ends, index.facets))
+    for _record in records:
+        pass
+    index.facets.flush()
+    rows.close()
+    index.source = {**current, "sha256": hasher.hexdigest()}
+    return index
+
+
+def _split_arrays(value, blocks):
+    """Copy of a state with every array replaced by {"__block__": (typecode, number)}; arrays go to blocks"""
+    if isinstance(value, dict):
+        return {key: _split_arrays(item, blocks) for key, item in value.items()}
+    if isinstance(value, (array, memoryview)):
+        blocks.append(value)
+        return {"__block__": (value.typecode if isinstance(value, array) else value.format, len(blocks) - 1)}
+    return value
+
+
+def _map_arrays(value, views):
+    """Inverse of _split_arrays over the mapped blocks"""
+    if isinstance(value, dict):
+        block = value.get("__block__")
+        if block is not None and len(value) == 1:
+            return views[block[1]].cast(block[0])
+        return {key: _map_arrays(item, views) for key, item in value.items()}
+    return value
+
+
+def _thaw(value):
+    """Private, writable copy of a state (mapped arrays are read-only and shared)"""
+    if isinstance(value, dict):
+        return {key: _thaw(item) for key, item in value.items()}
+    if isinstance(value, list):
+        return [_thaw(item) for item in value]
+    if isinstance(value, (array, memoryview)):
+        return array(value.typecode if isinstance(value, array) else value.format, value)
+    return value
+
+
+def _read_index(path):
+    """Map a compiled index read-only: arrays become memoryviews over the file's pages.
+
+    Layout: INDEX_MAGIC, header length (8 bytes, little-endian), JSON header
+    ({"state": state with arrays as blocks, "blocks": [[offset, nbytes]]}),
+    then each array's raw bytes at an INDEX_ALIGN-aligned offset. The header
+    is plain data, never pickle: an index file is only ever parsed, not run.
+    """
+    try:
+        with open(path, "rb") as f:
+            data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        if data[:len(INDEX_MAGIC)] != INDEX_MAGIC:
+            return None
+        start = len(INDEX_MAGIC) + 8
+        header = json.loads(data[start:start + int.from_bytes(data[start - 8:start], "little")])
+    except (OSError, ValueError):
+        return None
+    if not isinstance(header, dict) or header.get("format") != INDEX_FORMAT:
+        return None
+    whole = memoryview(data)
+    views = [whole[offset:offset + nbytes] for offset, nbytes in header["blocks"]]
+    return _map_arrays(header["state"], views)
+
+
+def _atomic_write(path, writer):
+    """Write a cache file via writer(f) to a temporary file renamed into place, so
+    readers never see a partial file; an unwritable cache is not an error"""
+    import tempfile
+    try:
+        path.parent.mkdir(parents=True, exist_ok=True)
+        fd, tmp = tempfile.mkstemp(dir=path.parent, prefix=path.name, suffix=".tmp")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                writer(f)
+            os.replace(tmp, path)
+        except BaseException:
+            os.unlink(tmp)
+            raise
+    except OSError:
+        pass
+
+
+def _write_index(path, state):
+    """Persist a compiled index (see _atomic_write)"""
+    blocks = []
+    header = {"format": state["format"], "state": _split_arrays(state, blocks), "blocks": []}
+    offset = 0
+    for block in blocks:
+        nbytes = memoryview(block).nbytes
+        header["blocks"].append((offset, nbytes))
+        offset += -(-nbytes // INDEX_ALIGN) * INDEX_ALIGN
+    # Blocks start after the header, whose size depends on the offsets it records
+    relative, base = header["blocks"], 0
+    while True:
+        header["blocks"] = [(base + offset, nbytes) for offset, nbytes in relative]
+        blob = json.dumps(header, separators=(",", ":")).encode("utf-8")
+        needed = -(-(len(INDEX_MAGIC) + 8 + len(blob)) // INDEX_ALIGN) * INDEX_ALIGN
+        if needed <= base:
+            break
+        base = needed
+
+    def write(f):
+        f.write(INDEX_MAGIC)
+        f.write(len(blob).to_bytes(8, "little"))
+        f.write(blob)
+        for block, (block_offset, _nbytes) in zip(blocks, header["blocks"]):
+            f.write(b"\0" * (block_offset - f.tell()))
+            f.write(block)
+
+    _atomic_write(path, write)
+
+
+def _same_source(source, current):
+    return source["size"] == current["size"] and source["mtime_ns"] == current["mtime_ns"]
+
+
+def _compile_index(path, filepath, search_cols, output_cols, tokenizer, loaded=None):
+    """Load the compiled index from disk, updating or rebuilding it when the source changed.
+
+    `loaded` is this process's current copy, used as the base for an
+    incremental update when there is no usable copy on disk.
+    """
+    state = _read_index(path)
+    if state is None and loaded is not None:
+        # _refresh_index updates a private copy: other threads may still be searching `loaded`
+        state = loaded.state()
+    return _refresh_index(path, filepath, search_cols, output_cols, tokenizer, state)[0]
+
+
+def _refresh_index(path, filepath, search_cols, output_cols, tokenizer, state):
+    """Bring a compiled index state up to date with its CSV, persisting it when it changed.
+
+    Returns (index, status), status being "fresh", "rekeyed" (touched but
+    unchanged), "updated" (rows appended) or "built".
+    """
+    current = _source_signature(filepath)
+
+    # Fast path: same size and mtime as when the index was compiled
+    if state is not None and _same_source(state["source"], current):
+        return SearchIndex.from_state(state, filepath, output_cols), "fresh"
+
+    index = SearchIndex.from_state(_thaw(state), filepath, output_cols) if state is not None else None
+
+    rows = index.bm25.N if index is not None else None
+    with open(filepath, "rb") as f:
+        updated = _update_index(index, f, search_cols, current) if index is not None else None
+        if updated is None:
+            f.seek(0)
+            updated = _build_index(filepath, f, search_cols, output_cols, current, tokenizer)
+            status = "built"
+        else:
+            status = "rekeyed" if updated.bm25.N == rows else "updated"
+
+    _write_index(path, updated.state())
+    return updated, status
+
+
+# Indices already loaded by this process, keyed by their cache file
+_LOADED = {}
+_LOAD_LOCK = threading.Lock()
+
+
+def load_index(filepath, search_cols, output_cols, tokenizer=None):
+    """Return the index for a CSV, reusing the in-process copy while the file is unchanged"""
+    tokenizer = tokenizer or DEFAULT_TOKENIZER
+    path = _index_path(filepath, search_cols, output_cols, tokenizer)
+    index = _LOADED.get(path)
+    if index is not None and _same_source(index.source, _source_signature(filepath)):
+        return index
+
+    # One (re)build per CSV even when concurrent threads notice the change
+    with _LOAD_LOCK:
+        index = _LOADED.get(path)
+        if index is None or not _same_source(index.source, _source_signature(filepath)):
+            index = _compile_index(path, filepath, search_cols, output_cols, tokenizer, index)
+            _LOADED[path] = index
+    return index
+
+
+# Dense indices loaded by this process, keyed by their vectors file
+_DENSE = {}
+_DENSE_LOCK = threading.Lock()
+
+
+def load_dense(filepath, search_cols, output_cols):
+    """Return (SearchIndex, DenseIndex) for a CSV; the vectors are cached next to the BM25 index"""
+    index = load_index(filepath, search_cols, output_cols)
+    path = _index_path(filepath, search_cols, output_cols, DEFAULT_TOKENIZER).with_suffix(".dense.npz")
+    sha256 = index.source["sha256"]
+    dense = _DENSE.get(path)
+    if dense is None or dense.bm25 is not index.bm25:
+        with _DENSE_LOCK:
+            dense = _DENSE.get(path)
+            if dense is None or dense.bm25 is not index.bm25:
+                dense = DenseIndex.load(path, index.bm25, sha256)
+                if dense is None:
+                    dense = DenseIndex.build(index.bm25, sha256)
+                    dense.save(path)
+                _DENSE[path] = dense
+    return index, dense
+
+
+def iter_datasets(root=None):
+    """Yield (name, filepath, search_cols, output_cols) for every domain and stack CSV under root (DATA_DIR)"""
+    root = root or DATA_DIR
+    for domain, config in CSV_CONFIG.items():
+        yield domain, root / config["file"], config["search_cols"], config["output_cols"]
+    for stack, config in STACK_CONFIG.items():
+        yield stack, root / config["file"], _STACK_COLS["search_cols"], _STACK_COLS["output_cols"]
+
+
+class GlobalIndex:
+    """Single postings index over every domain and stack CSV"""
+
+    __slots__ = ("parts", "offsets", "bm25", "_spell", "_dense")
+
+    def __init__(self, parts):
+        # parts: [(name, SearchIndex)] in iter_datasets() order
+        self.parts = parts
+        self.offsets = []
+        offset = 0
+        for _name, index in parts:
+            self.offsets.append(offset)
+            offset += index.bm25.N
+        self.bm25 = BM25.merge([index.bm25 for _name, index in parts])
+        self._spell = None
+        self._dense = None
+
+    @property
+    def spell(self):
+        """SpellIndex over the merged vocabulary, built on the first fuzzy lookup"""
+        if self._spell is None:
+            self._spell = SpellIndex(self.bm25)
+        return self._spell
+
+    @property
+    def dense(self):
+        """DenseIndex over the merged postings, built in memory on first use"""
+        if self._dense is None:
+            self._dense = DenseIndex.build(self.bm25)
+        return self._dense
+
+    def top_k(self, query, k, mode="bm25"):
+        """Ranked (global doc id, score) pairs for a search mode"""
+        if mode == "dense":
+            return self.dense.top_k(query, k)
+        if mode == "hybrid":
+            return self.dense.hybrid_top_k(query, k)
+        return self.bm25.top_k(query, k)
+
+    def locate(self, doc_id):
+        """Map a global doc id to (name, SearchIndex, local row id)"""
+        i = bisect_left(self.offsets, doc_id + 1) - 1
+        name, index = self.parts[i]
+        return name, index, doc_id - self.offsets[i]
+
+
+_GLOBAL_INDEX = None
+
+
+def _load_datasets():
+    """[(name, SearchIndex)] for every domain and stack CSV present, in iter_datasets() order"""
+    return [(name, load_index(filepath, search_cols, output_cols))
+            for name, filepath, search_cols, output_cols in iter_datasets() if filepath.exists()]
+
+
+def load_global_index():
+    """Return the cross-domain index, re-merging only when a member index was reloaded"""
+    global _GLOBAL_INDEX
+    parts = _load_datasets()
+
+    current = _GLOBAL_INDEX
+    if (current is None or len(current.parts) != len(parts)
+            or any(a[1] is not b[1] for a, b in zip(current.parts, parts))):
+        current = _GLOBAL_INDEX = GlobalIndex(parts)
+    return current
+
+
+def correct_all(query):
+    """Fuzzy-correct a query against every dataset's vocabulary.
+
+    A word known to any dataset is known to the merged index, so the datasets'
+    own vocabularies decide first; the global index is only merged (and its
+    SpellIndex built) once some word is indexed nowhere.
+    """
+    parts = _load_datasets()
+    if not parts or not _has_unknown_words(query, DEFAULT_TOKENIZER,
+                                           lambda token: any(token in index.bm25.vocab for _name, index in parts)):
+        return query, {}
+    return load_global_index().spell.correct(query)
+
+
+# ============ INDEX MANAGER ============
+class IndexManager:
+    """Indices of named corpora, loaded on demand and kept within a memory budget.
+
+    A corpus is a directory laid out like DATA_DIR (missing CSVs are just
+    skipped). Each lookup marks its index most recently used; once the
+    resident indices' memory_usage() exceeds `budget` bytes the least
+    recently used are dropped, never the one just loaded. A dropped index
+    reopens from its compiled file, so a later miss maps it again rather
+    than rebuilding it. A miss compiles outside the manager's lock, under a
+    lock of its own per index, so lookups of other indices are not held up.
+    """
+
+    __slots__ = ("budget", "corpora", "_resident", "_stats", "_lock", "_building")
+
+    def __init__(self, budget=INDEX_MEMORY_BUDGET):
+        self.budget = budget
+        self.corpora = {}
+        self._resident = OrderedDict()  # (corpus, index path) -> (SearchIndex, bytes)
+        self._stats = {}
+        self._lock = threading.Lock()
+        self._building = {}  # (corpus, index path) -> lock held while that index compiles
+
+    def register(self, name, path):
+        """Add (or re-point) a corpus; its indices load on first use"""
+        path = Path(path).expanduser()
+        if not path.is_dir():
+            raise ValueError(f"Corpus directory not found: {path}")
+        with self._lock:
+            self._drop(name)
+            self.corpora[name] = path
+            self._stats[name] = {"hits": 0, "misses": 0, "evictions": 0, "load_s": 0.0, "max_load_s": 0.0}
+        return path
+
+    def unregister(self, name):
+        with self._lock:
+            self._drop(name)
+            self.corpora.pop(name, None)
+            self._stats.pop(name, None)
+
+    def _drop(self, name):
+        for key in [key for key in self._resident if key[0] == name]:
+            del self._resident[key]
+
+    def root(self, corpus):
+        """Directory of a registered corpus"""
+        path = self.corpora.get(corpus)
+        if path is None:
+            raise ValueError(f"Unknown corpus: {corpus}. Registered: {', '.join(self.corpora) or 'none'}")
+        return path
+
+    def datasets(self, corpus):
+        """iter_datasets() for a corpus, limited to the CSVs it has"""
+        return [dataset for dataset in iter_datasets(self.root(corpus)) if dataset[1].exists()]
+
+    def load(self, corpus, filepath, search_cols, output_cols, tokenizer=None):
+        """SearchIndex for one CSV of a corpus (load_index() under the budget)"""
+        tokenizer = tokenizer or DEFAULT_TOKENIZER
+        path = _index_path(filepath, search_cols, output_cols, tokenizer)
+        key = (corpus, path)
+        with self._lock:
+            index, entry = self._lookup(corpus, key, filepath)
+            if index is not None:
+                return index
+            building = self._building.setdefault(key, threading.Lock())
+
+        with building:
+            try:
+                with self._lock:
+                    # Another thread may have compiled it while this one waited
+                    index, entry = self._lookup(corpus, key, filepath)
+                if index is not None:
+                    return index
+
+                start = time.perf_counter()
+                index = _compile_index(path, filepath, search_cols, output_cols, tokenizer,
+                                       entry[0] if entry is not None else None)
+                elapsed = time.perf_counter() - start
+                with self._lock:
+                    stats = self._stats.get(corpus)
+                    if stats is not None:  # else unregistered meanwhile: answer, but keep nothing
+                        stats["misses"] += 1
+                        stats["load_s"] += elapsed
+                        stats["max_load_s"] = max(stats["max_load_s"], elapsed)
+                        self._resident[key] = (index, index.memory_usage())
+                        self._resident.move_to_end(key)
+                        self._evict()
+                return index
+            finally:
+                with self._lock:
+                    if self._building.get(key) is building:
+                        del self._building[key]
+
+    def _lookup(self, corpus, key, filepath):
+        """(resident index if its source is unchanged, else None; the resident entry), under _lock"""
+        stats = self._stats.get(corpus)
+        if stats is None:
+            raise ValueError(f"Unknown corpus: {corpus}. Registered: {', '.join(self.corpora) or 'none'}")
+        entry = self._resident.get(key)
+        if entry is not None and _same_source(entry[0].source, _source_signature(filepath)):
+            self._resident.move_to_end(key)
+            stats["hits"] += 1
+            return entry[0], entry
+        return None, entry
+
+    def _evict(self):
+        total = sum(size for _index, size in self._resident.values())
+        while total > self.budget and len(self._resident) > 1:
+            (corpus, _path), (_index, size) = self._resident.popitem(last=False)
+            total -= size
+            self._stats[corpus]["evictions"] += 1
+
+    def stats(self):
+        """Per-corpus hit rate, load times and resident bytes, plus the budget in use"""
+        with self._lock:
+            resident = defaultdict(lambda: [0, 0])
+            for (corpus, _path), (_index, size) in self._resident.items():
+                resident[corpus][0] += 1
+                resident[corpus][1] += size
+            corpora = {}
+            for name, stats in self._stats.items():
+                lookups = stats["hits"] + stats["misses"]
+                corpora[name] = {
+                    "path": str(self.corpora[name]),
+                    "hits": stats["hits"],
+                    "misses": stats["misses"],
+                    "hit_rate": round(stats["hits"] / lookups, 4) if lookups else 0.0,
+                    "evictions": stats["evictions"],
+                    "load_ms_mean": round(stats["load_s"] / stats["misses"] * 1000, 3) if stats["misses"] else None,
+                    "load_ms_max": round(stats["max_load_s"] * 1000, 3),
+                    "indices": resident[name][0],
+                    "resident_bytes": resident[name][1],
+                }
+            return {
+                "budget_bytes": self.budget,
+                "resident_bytes": sum(size for _index, size in self._resident.values()),
+                "corpora": corpora,
+            }
+
+
+def _register_corpora(manager, spec):
+    """Register NAME=DIR entries (os.pathsep-separated); bad entries are skipped"""
+    for entry in spec.split(os.pathsep):
+        name, sep, path = entry.partition("=")
+        if sep and name.strip():
+            try:
+                manager.register(name.strip(), path.strip())
+            except ValueError:
+                pass
+
+
+@functools.lru_cache(maxsize=None)
+def index_manager():
+    """The process-wide IndexManager, set up on first use.
+
+    The bundled data is a corpus too: searches naming it run under the budget,
+    sharing the mapped index files with the default (always warm) searches.
+    """
+    manager = IndexManager(INDEX_MEMORY_BUDGET)
+    if DATA_DIR.is_dir():
+        manager.register("bundled", DATA_DIR)
+    _register_corpora(manager, CORPORA)
+    return manager
+
+
+# ============ DESIGN SYSTEM JOINS ============
+def _name_key(name):
+    return " ".join(_WORD.findall(str(name).lower()))
+
+
+class DesignJoins:
+    """Product row -> row ids of the styles, colors, typography and landing patterns it references.
+
+    Every DESIGN_JOINS reference is resolved once when the joins are built,
+    so resolving a product afterwards is a handful of list reads.
+    """
+
+    __slots__ = ("indices", "links")
+
+    def __init__(self, indices):
+        self.indices = indices
+        names = {}
+        for _key, domain, _cols, _sep in DESIGN_JOINS:
+            if domain not in names:
+                names[domain] = self._names(indices[domain], CSV_CONFIG[domain]["name_col"])
+
+        products = indices["product"].rows
+        self.links = []
+        for row_id in range(len(products)):
+            row = products[row_id]
+            links = {}
+            for key, domain, cols, sep in DESIGN_JOINS:
+                text = " ".join(str(row.get(col) or "") for col in cols)
+                refs = text.split(sep) if sep else [text]
+                ids = []
+                for ref in refs:
+                    target = self._resolve(ref, indices[domain], names[domain], len(cols) > 1)
+                    if target is not None and target not in ids:
+                        ids.append(target)
+                links[key] = ids
+            self.links.append(links)
+
+    @staticmethod
+    def _names(index, col):
+        """(exact name key -> row id, leading words -> row id, each row's name tokens)"""
+        exact, leading, tokens = {}, {}, []
+        for row_id in range(len(index.rows)):
+            name = index.rows[row_id].get(col, "")
+            words = _name_key(name).split()
+            exact.setdefault(" ".join(words), row_id)
+            for n in range(1, len(words)):
+                leading.setdefault(" ".join(words[:n]), row_id)
+            tokens.append(set(index.bm25.tokenize(name)))
+        return exact, leading, tokens
+
+    @staticmethod
+    def _resolve(ref, index, names, description=False):
+        """Row id a reference names: exact (case/punctuation-insensitive) name, a name it
+        abbreviates ("Minimalism" -> "Minimalism & Swiss Style"), else a BM25 hit that
+        really matches it (see DESIGN_JOINS); None rather than a guess"""
+        if _NO_REFERENCE.match(ref):
+            return None
+        key = _name_key(ref)
+        exact, leading, name_tokens = names
+        if key in exact:
+            return exact[key]
+        if key in leading:
+            return leading[key]
+
+        bm25 = index.bm25
+        tokens = set(bm25.tokenize(ref))
+        terms = [term for term in map(bm25.vocab.get, tokens) if term is not None]
+        for doc_id, _score in bm25.top_k(ref, JOIN_CANDIDATES):
+            if tokens & name_tokens[doc_id]:
+                return doc_id
+            if description and sum(_has_posting(bm25, term, doc_id) for term in terms) >= JOIN_MIN_SHARED_TERMS:
+                return doc_id
+        return None
+
+
+def _has_posting(bm25, term, doc_id):
+    """Whether a document contains a term (binary search of the term's postings)"""
+    start, end = bm25.post_starts[term], bm25.post_starts[term + 1]
+    i = bisect_left(bm25.post_docs, doc_id, start, end)
+    return i < end and bm25.post_docs[i] == doc_id
+
+
+_DESIGN_JOINS = None
+
+
+def load_design_joins():
+    """Return the design-system joins, rebuilding them only when a member index was reloaded"""
+    global _DESIGN_JOINS
+    indices = {}
+    for domain in ("product", *dict.fromkeys(domain for _key, domain, _cols, _sep in DESIGN_JOINS)):
+        config = CSV_CONFIG[domain]
+        filepath = DATA_DIR / config["file"]
+        if not filepath.exists():
+            raise FileNotFoundError(f"File not found: {filepath}")
+        indices[domain] = load_index(filepath, config["search_cols"], config["output_cols"])
+
+    current = _DESIGN_JOINS
+    if current is None or any(current.indices.get(domain) is not index for domain, index in indices.items()):
+        current = _DESIGN_JOINS = DesignJoins(indices)
+    return current
+
+
+def resolve_design_system(query):
+    """Best-matching product type plus every row it references, in one lookup.
+
+    Returns {"query", "product", "style", "secondary_styles", "color",
+    "typography", "landing"}; all but "product" are lists of rows.
+    """
+    try:
+        joins = load_design_joins()
+    except (FileNotFoundError, ValueError) as e:
+        return {"error": str(e), "query": query}
+
+    products = joins.indices["product"]
+    ranked = products.bm25.top_k(query, 1)
+    if not ranked or ranked[0][1] <= 0:
+        return {"error": f"No product type matches: {query}", "query": query}
+
+    product_id = ranked[0][0]
+    bundle = {"query": query, "product": products.rows[product_id]}
+    for key, domain, _cols, _sep in DESIGN_JOINS:
+        rows = joins.indices[domain].rows
+        bundle[key] = [rows[row_id] for row_id in joins.links[product_id][key]]
+    return bundle
+
+
+# ============ SQLITE FTS5 BACKEND ============
+_FTS_LOCAL = threading.local()
+
+
+def _fts_connect():
+    """This thread's connection to the FTS database (sqlite3 connections are per thread)"""
+    db = getattr(_FTS_LOCAL, "db", None)
+    if db is None:
+        sqlite3 = _sqlite3()
+        FTS_PATH.parent.mkdir(parents=True, exist_ok=True)
+        db = sqlite3.connect(str(FTS_PATH), timeout=30.0, isolation_level=None)
+        try:
+            db.execute("PRAGMA journal_mode=WAL")
+            db.execute("CREATE TABLE IF NOT EXISTS sources "
+                       "(name TEXT PRIMARY KEY, size INTEGER, mtime_ns INTEGER, sha256 TEXT, filterable TEXT)")
+        except sqlite3.Error:
+            db.close()
+            raise
+        _FTS_LOCAL.db = db
+    return db
+
+
+def _fts_quote(text):
+    """FTS5 string literal (matched as one term, or a phrase when it holds several)"""
+    return '"' + text.replace('"', '""') + '"'
+
+
+def _fts_rows(fieldnames, records, search_cols, output_cols, tokenizer, filterable, dropped):
+    """(doc, *tokenized search cells, row JSON) per CSV record, plus its (col, value, doc) filter rows"""
+    doc = 0
+    for _start, _end, fields in records:
+        if not fields:
+            continue
+        row = _record_to_row(fieldnames, fields)
+        facets = []
+        for col, value in row.items():
+            if col is None or col in dropped:
+                continue
+            value = _facet_value(value)
+            values = filterable.setdefault(col, set())
+            if value not in values:
+                if len(values) >= FACET_MAX_VALUES or len(value) > FACET_MAX_LENGTH:
+                    dropped.add(col)
+                    del filterable[col]
+                    continue
+                values.add(value)
+            facets.append((col, value, doc))
+        cells = [" ".join(tokenizer(str(row.get(col, "")))) for col in search_cols]
+        output = {col: row.get(col, "") for col in output_cols if col in row}
+        yield (doc, *cells, json.dumps(output, ensure_ascii=False)), facets
+        doc += 1
+
+
+def _build_fts(db, table, f, search_cols, output_cols, tokenizer, current):
+    """(Re)create a CSV's FTS tables inside the caller's transaction; returns its filterable columns"""
+    import hashlib
+    hasher = hashlib.sha256()
+    records = _iter_records(_hashed_lines(f, hasher))
+    header = next(records, None)
+    fieldnames = header[2] if header else []
+
+    for suffix in ("", "_vocab", "_facets"):
+        db.execute(f'DROP TABLE IF EXISTS "{table}{suffix}"')
+    columns = ", ".join(f"c{i}" for i in range(len(search_cols)))
+    # Cells are already tokenized; "_" must stay inside tokens as it does for \w
+    db.execute(f'CREATE VIRTUAL TABLE "{table}" USING fts5({columns}, row UNINDEXED, '
+               f"tokenize = \"unicode61 remove_diacritics 0 tokenchars '_'\")")
+    db.execute(f'CREATE VIRTUAL TABLE "{table}_vocab" USING fts5vocab("{table}", row)')
+    db.execute(f'CREATE TABLE "{table}_facets" (col TEXT, value TEXT, doc INTEGER)')
+
+    insert_doc = f'INSERT INTO "{table}" (rowid, {columns}, row) VALUES ({", ".join("?" * (len(search_cols) + 2))})'
+    insert_facet = f'INSERT INTO "{table}_facets" VALUES (?, ?, ?)'
+    filterable, dropped = {}, set()
+    docs, facets = [], []
+    for doc, doc_facets in _fts_rows(fieldnames, records, search_cols, output_cols, tokenizer, filterable, dropped):
+        docs.append(doc)
+        facets.extend(doc_facets)
+        if len(docs) >= FTS_BATCH_SIZE:
+            db.executemany(insert_doc, docs)
+            db.executemany(insert_facet, facets)
+            docs, facets = [], []
+    db.executemany(insert_doc, docs)
+    db.executemany(insert_facet, facets)
+    for _record in records:
+        pass  # hash anything the build did not consume
+
+    # Columns dropped part-way through still have rows for their earlier values
+    db.executemany(f'DELETE FROM "{table}_facets" WHERE col = ?', [(col,) for col in dropped])
+    db.execute(f'CREATE INDEX "{table}_facets_value" ON "{table}_facets" (col, value, doc)')
+    filterable = list(filterable)
+    db.execute("INSERT OR REPLACE INTO sources VALUES (?, ?, ?, ?, ?)",
+               (table, current["size"], current["mtime_ns"], hasher.hexdigest(), json.dumps(filterable)))
+    return filterable
+
+
+class _FtsVocabulary:
+    """The part of the BM25 interface SpellIndex reads, filled from an fts5vocab table"""
+
+    __slots__ = ("terms", "vocab", "doc_freqs", "tokenizer")
+
+    def __init__(self, rows, tokenizer):
+        self.terms = [term for term, _doc_freq in rows]
+        self.doc_freqs = [doc_freq for _term, doc_freq in rows]
+        self.vocab = {term: i for i, term in enumerate(self.terms)}
+        self.tokenizer = tokenizer
+
+
+class FtsIndex:
+    """One CSV compiled into SQLite FTS5 tables and ranked by FTS5's bm25().
+
+    Search cells are stored as the shared tokenizer's output, so both backends
+    agree on what matches (case, short words, stemming). Output rows live as
+    JSON in an unindexed column and filter values in a side table, so a query
+    is answered from the database alone, without loading anything into memory.
+    """
+
+    __slots__ = ("table", "search_cols", "tokenizer", "source", "filterable", "_weights", "_spell")
+
+    def __init__(self, table, search_cols, tokenizer, source, filterable):
+        self.table = table
+        self.search_cols = search_cols
+        self.tokenizer = tokenizer
+        self.source = source
+        self.filterable = filterable
+        # bm25() takes one weight per column in declaration order; the trailing row column defaults to 1.0
+        self._weights = ", ".join(repr(float(FTS_COLUMN_WEIGHTS.get(col, 1.0))) for col in search_cols)
+        self._spell = None
+
+    @property
+    def spell(self):
+        """SpellIndex over the FTS vocabulary, built on the first fuzzy lookup"""
+        if self._spell is None:
+            rows = _fts_connect().execute(f'SELECT term, doc FROM "{self.table}_vocab" ORDER BY term').fetchall()
+            self._spell = SpellIndex(_FtsVocabulary(rows, self.tokenizer))
+        return self._spell
+
+    def correct(self, query):
+        """spell.correct(query), without reading the whole vocabulary while every word is indexed"""
+        db, sql = _fts_connect(), f'SELECT 1 FROM "{self.table}_vocab" WHERE term = ?'
+        if not _has_unknown_words(query, self.tokenizer,
+                                  lambda token: db.execute(sql, (token,)).fetchone() is not None):
+            return query, {}
+        return self.spell.correct(query)
+
+    def top_k(self, query, k, where=None):
+        """Ranked (row, score) pairs: any query token matches, quoted phrases are required"""
+        table = self.table
+        filters, params = [], []
+        names = {col.lower(): col for col in self.filterable}
+        for col, values in (where or {}).items():
+            name = names.get(str(col).strip().lower())
+            if name is None:
+                raise ValueError(f"Cannot filter on column: {col}. Filterable: {', '.join(self.filterable)}")
+            values = [_facet_value(value) for value in ([values] if isinstance(values, str) else values)]
+            filters.append(f'AND rowid IN (SELECT doc FROM "{table}_facets" '
+                           f'WHERE col = ? AND value IN ({", ".join("?" * len(values))}))')
+            params += [name, *values]
+
+        tokens, phrases = parse_query(query, self.tokenizer)
+        if not tokens or k <= 0:
+            return []  # LIMIT -1 would mean no limit at all
+        expression = " OR ".join(map(_fts_quote, dict.fromkeys(tokens)))
+        if phrases:
+            expression = " AND ".join([f"({expression})", *(_fts_quote(" ".join(phrase)) for phrase in phrases)])
+
+        sql = [f'SELECT row, bm25("{table}", {self._weights}) AS rank FROM "{table}" WHERE "{table}" MATCH ?',
+               *filters, "ORDER BY rank, rowid LIMIT ?"]
+        params = [expression, *params, k]
+        # bm25() is negative, lower is better
+        return [(json.loads(row), -rank) for row, rank in _fts_connect().execute(" ".join(sql), params)]
+
+
+# FTS indices opened by this process, keyed by table name
+_FTS_INDICES = {}
+_FTS_LOCK = threading.Lock()
+
+
+def load_fts(filepath, search_cols, output_cols, tokenizer=None):
+    """Return the FTS index for a CSV, compiling it into FTS_PATH when missing or stale"""
+    sqlite3 = _sqlite3()
+    tokenizer = tokenizer or DEFAULT_TOKENIZER
+    table = _index_path(filepath, search_cols, output_cols, tokenizer).stem.replace(".", "_")
+    current = _source_signature(filepath)
+    index = _FTS_INDICES.get(table)
+    if index is not None and _same_source(index.source, current):
+        return index
+
+    with _FTS_LOCK:
+        try:
+            db = _fts_connect()
+            # IMMEDIATE: one writer at a time across processes, and the check below sees their work
+            db.execute("BEGIN IMMEDIATE")
+            try:
+                row = db.execute("SELECT size, mtime_ns, sha256, filterable FROM sources WHERE name = ?",
+                                 (table,)).fetchone()
+                source = dict(zip(("size", "mtime_ns", "sha256"), row)) if row else None
+                if source is not None and _same_source(source, current):
+                    filterable = json.loads(row[3])
+                else:
+                    with open(filepath, "rb") as f:
+                        if source is not None and source["size"] == current["size"] and \
+                                _hash_prefix(f, current["size"]).hexdigest() == source["sha256"]:
+                            # Touched but unchanged: re-key only
+                            db.execute("UPDATE sources SET mtime_ns = ? WHERE name = ?", (current["mtime_ns"], table))
+                            filterable = json.loads(row[3])
+                        else:
+                            f.seek(0)
+                            filterable = _build_fts(db, table, f, search_cols, output_cols, tokenizer, current)
+                db.execute("COMMIT")
+            except BaseException:
+                db.execute("ROLLBACK")
+                raise
+        except sqlite3.OperationalError as e:
+            if "fts5" in str(e):
+                raise ValueError("This SQLite build has no FTS5 support; use the memory backend") from e
+            raise
+        index = _FTS_INDICES[table] = FtsIndex(table, search_cols, tokenizer, current, filterable)
+    return index
+
+
+# ============ PARALLEL BUILD ============
+def _build_dataset(filepath, search_cols, output_cols, dense=False):
+    """Pool task: bring one CSV's compiled index (and optionally its dense vectors) up to date"""
+    start = time.perf_counter()
+    path = _index_path(filepath, search_cols, output_cols, DEFAULT_TOKENIZER)
+    index, status = _refresh_index(path, filepath, search_cols, output_cols, DEFAULT_TOKENIZER, _read_index(path))
+    result = {"status": status, "rows": index.bm25.N}
+    if dense:
+        _LOADED[path] = index
+        load_dense(filepath, search_cols, output_cols)
+    result["seconds"] = round(time.perf_counter() - start, 3)
+    return result
+
+
+def build_indices(workers=None, dense=False, fts=False):
+    """Compile every dataset under DATA_DIR, one process per CSV; unchanged sources are skipped.
+
+    Index files are written atomically, so readers (a running daemon, other
+    CLI calls) keep using the old file until the new one replaces it. FTS5
+    tables are compiled afterwards in this process since SQLite takes one
+    writer at a time. Returns {name: status dict} in dataset order.
+    """
+    datasets = [(name, filepath, search_cols, output_cols)
+                for name, filepath, search_cols, output_cols in iter_datasets() if filepath.exists()]
+    if not datasets:
+        return {}
+
+    from concurrent.futures import ProcessPoolExecutor  # ~20 ms to import, only builds need it
+
+    results = {}
+    workers = workers or min(len(datasets), os.cpu_count() or 1)
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        futures = [(name, pool.submit(_build_dataset, filepath, search_cols, output_cols, dense))
+                   for name, filepath, search_cols, output_cols in datasets]
+        for name, future in futures:
+            try:
+                results[name] = future.result()
+            except Exception as e:
+                results[name] = {"status": "error", "error": f"{type(e).__name__}: {e}"}
+
+    if fts:
+        for name, filepath, search_cols, output_cols in datasets:
+            start = time.perf_counter()
+            try:
+                load_fts(filepath, search_cols, output_cols)
+            except (ValueError, _sqlite3().Error) as e:
+                results[name]["fts5_error"] = str(e)
+            else:
+                results[name]["fts5_seconds"] = round(time.perf_counter() - start, 3)
+    return results
+
+
+# ============ RESULT CACHE ============
+class ResultCache:
+    """LRU of search results, optionally backed by a persistent SQLite tier.
+
+    Keys embed the source CSV's size and mtime, so entries for an index that
+    has since been rebuilt are never served; stale disk rows are dropped as
+    soon as a newer version of the same source is stored.
+    """
+
+    __slots__ = ("maxsize", "disk_size", "path", "hits", "disk_hits", "misses", "evictions",
+                 "_entries", "_lock", "_db")
+
+    def __init__(self, maxsize=RESULT_CACHE_SIZE, path=None, disk_size=RESULT_CACHE_DISK_SIZE):
+        self.maxsize = maxsize
+        self.disk_size = disk_size
+        self.path = path
+        self.hits = self.disk_hits = self.misses = self.evictions = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self._db = None
+
+    def _connect(self):
+        """Open the disk tier on first use; any SQLite problem just disables it"""
+        if self._db is None and self.path:
+            sqlite3 = _sqlite3()
+            try:
+                Path(self.path).parent.mkdir(parents=True, exist_ok=True)
+                db = sqlite3.connect(self.path, timeout=1.0, check_same_thread=False)
+                db.execute("CREATE TABLE IF NOT EXISTS results "
+                           "(key TEXT PRIMARY KEY, source TEXT, version TEXT, value TEXT, used REAL)")
+                db.execute("CREATE INDEX IF NOT EXISTS results_source ON results (source)")
+                self._db = db
+            except (sqlite3.Error, OSError):
+                self.path = None
+        return self._db
+
+    def get(self, key):
+        """Cached results for key (a fresh copy), or None"""
+        with self._lock:
+            value = self._entries.get(key)
+            if value is not None:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return [dict(row) for row in value]
+
+            db = self._connect()
+            if db is not None:
+                try:
+                    row = db.execute("SELECT value FROM results WHERE key = ?", (key,)).fetchone()
+                    if row is not None:
+                        db.execute("UPDATE results SET used = ? WHERE key = ?", (time.time(), key))
+                        db.commit()
+                except _sqlite3().Error:
+                    row = None
+                if row is not None:
+                    value = json.loads(row[0])
+                    self._remember(key, value)
+                    self.hits += 1
+                    self.disk_hits += 1
+                    return [dict(row) for row in value]
+
+            self.misses += 1
+            return None
+
+    def put(self, key, value, source, version):
+        """Store results for key; `source`/`version` identify the index they came from"""
+        value = [dict(row) for row in value]
+        with self._lock:
+            self._remember(key, value)
+            db = self._connect()
+            if db is None:
+                return
+            try:
+                db.execute("DELETE FROM results WHERE source = ? AND version != ?", (source, version))
+                db.execute("INSERT OR REPLACE INTO results VALUES (?, ?, ?, ?, ?)",
+                           (key, source, version, json.dumps(value, ensure_ascii=False), time.time()))
+                db.execute("DELETE FROM results WHERE key IN "
+                           "(SELECT key FROM results ORDER BY used DESC LIMIT -1 OFFSET ?)", (self.disk_size,))
+                db.commit()
+            except _sqlite3().Error:
+                pass
+
+    def _remember(self, key, value):
+        self._entries[key] = value
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.maxsize:
+            self._entries.popitem(last=False)
+            self.evictions += 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        """Counters for sizing the cache"""
+        lookups = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "disk_hits": self.disk_hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0,
+            "evictions": self.evictions,
+            "size": len(self._entries),
+            "maxsize": self.maxsize,
+            "disk": self.path,
+        }
+
+
+RESULT_CACHE = ResultCache(RESULT_CACHE_SIZE, RESULT_CACHE_PATH)
+
+
+def _result_key(source, query, max_results, version, where=None, mode="bm25", backend="memory"):
+    """Cache key: parsed query (tokens in order, phrases) + source + max_results + index version (+ filters, mode, backend)"""
+    key = [source, *parse_query(query), max_results, version]
+    if mode != "bm25":
+        key.append(mode)
+    if backend != "memory":
+        key.append(backend)
+    if where:
+        key.append(sorted((_facet_value(col), sorted(_facet_value(value) for value in
+                           ([values] if isinstance(values, str) else values)))
+                          for col, values in where.items()))
+    return json.dumps(key, ensure_ascii=False)
+
+
+def _source_version(filepath):
+    current = _source_signature(filepath)
+    return f"{current['size']}:{current['mtime_ns']}"
+
+
+# ============ SNIPPETS ============
+def _cut(text, start, end):
+    """text[start:end] widened/narrowed to word boundaries, with … marking cut ends"""
+    if start > 0:
+        space = text.find(" ", start, min(end, start + 20))
+        start = space + 1 if space >= 0 else start
+    if end < len(text):
+        space = text.rfind(" ", max(start, end - 20), end)
+        end = space if space > start else end
+    return ("…" if start > 0 else "") + text[start:end].strip() + ("…" if end < len(text) else "")
+
+
+def snippet(text, terms, width=SNIPPET_CHARS, tokenizer=None):
+    """About `width` characters of text around its densest cluster of query terms.
+
+    The window covering the most distinct terms (then the most matches) wins;
+    text without matches is cut from the start. Whitespace runs collapse to one space.
+    """
+    text = " ".join(str(text).split())
+    if len(text) <= width:
+        return text
+    tokenizer = tokenizer or DEFAULT_TOKENIZER
+    hits = [(start, token) for token, start, _end in tokenizer.spans(text) if token in terms]
+    if not hits:
+        return _cut(text, 0, width)
+
+    best, best_start = None, 0
+    counts, lo = {}, 0
+    for start, token in hits:
+        counts[token] = counts.get(token, 0) + 1
+        while hits[lo][0] < start - width + 20:
+            old = hits[lo][1]
+            counts[old] -= 1
+            if not counts[old]:
+                del counts[old]
+            lo += 1
+        key = (len(counts), sum(counts.values()))
+        if best is None or key > best:
+            best, best_start = key, hits[lo][0]
+    # Lead in with a little context before the first matched term
+    start = max(0, min(best_start - width // 8, len(text) - width))
+    return _cut(text, start, start + width)
+
+
+def _leading_keys(result, row):
+    """Keys always kept whole: a search-all source tag plus the row's name_col"""
+    tags = [key for key in ("Domain", "Stack") if key in row]
+    if "Stack" in row or result.get("stack"):
+        name = _STACK_COLS["name_col"]
+    else:
+        name = CSV_CONFIG.get(row.get("Domain") or result.get("domain"), {}).get("name_col")
+    if name not in row:
+        name = next((key for key in row if key not in tags), None)
+    return tags + ([name] if name is not None else [])
+
+
+def _row_cost(row):
+    """Estimated characters of a row rendered as "- **key:** value" lines"""
+    return 16 + sum(len(str(key)) + len(str(value)) + 8 for key, value in row.items())
+
+
+def fit_budget(result, max_tokens):
+    """Copy of a search result trimmed to about max_tokens tokens of output.
+
+    Rows are packed in rank order until the budget is spent. Within a row the
+    name is kept whole, fields matching the query become snippet() windows and
+    the rest are abbreviated; if that does not fit, only the name and matching
+    fields are kept. The first row is always returned, in that minimal form when
+    the budget is too small for it; skipped rows are counted in "omitted".
+    """
+    if "error" in result:
+        return result
+    terms = set(parse_query(result.get("query", ""))[0]) | set((result.get("corrections") or {}).values())
+    budget = max_tokens * CHARS_PER_TOKEN - (120 + len(result.get("query", "")) + len(result.get("file", "")))
+
+    rows = []
+    for row in result.get("results", []):
+        leading = _leading_keys(result, row)
+        full, minimal = {}, {}
+        for key, value in row.items():
+            text = " ".join(str(value).split())
+            if key in leading:
+                full[key] = minimal[key] = text
+            elif terms & set(DEFAULT_TOKENIZER(text)):
+                full[key] = minimal[key] = snippet(text, terms)
+            elif text:
+                full[key] = text if len(text) <= ABBREVIATE_CHARS else _cut(text, 0, ABBREVIATE_CHARS)
+        for candidate in (full, minimal):
+            if _row_cost(candidate) <= budget:
+                break
+        else:
+            if rows:
+                break
+            candidate = minimal
+        rows.append(candidate)
+        budget -= _row_cost(candidate)
+
+    trimmed = {**result, "count": len(rows), "results": rows, "max_tokens": max_tokens}
+    omitted = len(result.get("results", [])) - len(rows)
+    if omitted:
+        trimmed["omitted"] = omitted
+    return trimmed
+
+
+# ============ QUERY LOG ============
+def result_id(row):
+    """Short content hash of a result row, for comparing rankings across runs"""
+    import hashlib
+    return hashlib.sha1(json.dumps(row, sort_keys=True, ensure_ascii=False).encode("utf-8")).hexdigest()[:12]
+
+
+class QueryLog:
+    """Append-only JSONL record of search calls; disabled while `path` is unset.
+
+    Each call becomes one line written with a single append, so processes
+    can share a log file. An unwritable log just turns logging off.
+    """
+
+    __slots__ = ("path", "_lock", "_file")
+
+    def __init__(self, path=None):
+        self.path = path
+        self._lock = threading.Lock()
+        self._file = None
+
+    def record(self, entry):
+        line = json.dumps(entry, ensure_ascii=False) + "\n"
+        with self._lock:
+            if not self.path:
+                return
+            try:
+                if self._file is None:
+                    Path(self.path).parent.mkdir(parents=True, exist_ok=True)
+                    self._file = open(self.path, "a", encoding="utf-8")
+                self._file.write(line)
+                self._file.flush()
+            except OSError:
+                self.path = None
+
+    def close(self):
+        with self._lock:
+            if self._file is not None:
+                self._file.close()
+                self._file = None
+
+
+QUERY_LOG = QueryLog(QUERY_LOG_PATH)
+
+
+def _logged(fn):
+    """Record each call of a search entry point in QUERY_LOG (a no-op while it is disabled)"""
+    # Positional parameters and defaults, bound by hand (inspect costs ~10 ms to import)
+    names = fn.__code__.co_varnames[:fn.__code__.co_argcount]
+    defaults = dict(zip(names[len(names) - len(fn.__defaults__ or ()):], fn.__defaults__ or ()))
+
+    @functools.wraps(fn)
+    def wrapper(*args, **kwargs):
+        if not QUERY_LOG.path:
+            return fn(*args, **kwargs)
+        start = time.perf_counter()
+        result = fn(*args, **kwargs)
+        latency = time.perf_counter() - start
+        given = {**dict(zip(names, args)), **kwargs}
+        arguments = {name: given[name] if name in given else defaults.get(name) for name in names}
+        entry = {"ts": round(time.time(), 3), "fn": fn.__name__, **arguments,
+                 "latency_ms": round(latency * 1000, 4), "result_domain": result.get("domain"),
+                 "count": result.get("count", 0), "ids": [result_id(row) for row in result.get("results", ())]}
+        if "error" in result:
+            entry["error"] = result["error"]
+        QUERY_LOG.record(entry)
+        return result
+
+    return wrapper
+
+
+# ============ DOMAIN ROUTING ============
+class DomainRouter:
+    """Keyword table compiled into a token/phrase lookup for domain detection.
+
+    Keywords match whole tokens (or token runs such as "dark mode", with hyphens
+    treated as spaces), so "sans" no longer fires inside "thousands"; plurals
+    are folded with s_stem. A query costs one tokenizing pass plus a dict probe
+    per token window, however many domains and keywords are registered.
+    """
+
+    _TOKEN = re.compile(r"[^\W_]+|[^\w\s-]")
+
+    def __init__(self, domain_keywords):
+        self.domains = list(domain_keywords)
+        self.keywords = []
+        self._phrases = {}
+        self._stems = {}
+        self._heads = {}
+        for domain, keywords in domain_keywords.items():
+            for keyword in keywords:
+                tokens = self._TOKEN.findall(keyword.lower())
+                forms = {" ".join(tokens), " ".join(map(s_stem, tokens))}
+                kw_id = next((self._phrases[form] for form in forms if form in self._phrases), None)
+                if kw_id is None:
+                    kw_id = len(self.keywords)
+                    self.keywords.append([])
+                if domain not in self.keywords[kw_id]:
+                    self.keywords[kw_id].append(domain)
+                for form in forms:
+                    self._phrases[form] = kw_id
+                    words = form.split(" ")
+                    if len(words) > 1:
+                        self._heads[words[0]] = max(self._heads.get(words[0], 0), len(words))
+
+    def _stem(self, token):
+        stem = self._stems.get(token)
+        if stem is None:
+            if len(self._stems) >= Tokenizer.MEMO_SIZE:
+                self._stems.clear()
+            stem = self._stems[token] = s_stem(token)
+        return stem
+
+    def scores(self, query):
+        """Count the distinct keywords of each domain found in the query"""
+        tokens = self._TOKEN.findall(str(query).lower())
+        phrases, heads = self._phrases, self._heads
+        matched = set()
+        for stream in (tokens, [self._stem(token) for token in tokens]):
+            for i, token in enumerate(stream):
+                kw_id = phrases.get(token)
+                if kw_id is not None:
+                    matched.add(kw_id)
+                # Multi-word keywords are only tried where one can start
+                for n in range(2, heads.get(token, 0) + 1):
+                    kw_id = phrases.get(" ".join(stream[i:i + n]))
+                    if kw_id is not None:
+                        matched.add(kw_id)
+        scores = dict.fromkeys(self.domains, 0)
+        for kw_id in matched:
+            for domain in self.keywords[kw_id]:
+                scores[domain] += 1
+        return scores
+
+    def route(self, query):
+        """Best-scoring domain, or None when no keyword matches"""
+        scores = self.scores(query)
+        best = max(self.domains, key=scores.get)
+        return best if scores[best] > 0 else None
+
+
+@functools.lru_cache(maxsize=None)
+def domain_router():
+    """DomainRouter over DOMAIN_KEYWORDS, built on the first auto-routed query"""
+    return DomainRouter(DOMAIN_KEYWORDS)
+
+
+def _idf_mass(query, domain):
+    """IDF mass a domain's index gives the query's matching terms (0.0 without its CSV)"""
+    config = CSV_CONFIG[domain]
+    filepath = DATA_DIR / config["file"]
+    if not filepath.exists():
+        return 0.0
+    bm25 = load_index(filepath, config["search_cols"], config["output_cols"]).bm25
+    vocab, idf = bm25.vocab, bm25.idf
+    return sum(idf[vocab[token]] for token in set(bm25.tokenize(query)) if token in vocab)
+
+
+def _idf_mass_domain(query):
+    """Domain whose index gives the query's matching terms the most IDF mass"""
+    best, best_mass = None, 0.0
+    for domain in CSV_CONFIG:
+        mass = _idf_mass(query, domain)
+        if mass > best_mass:
+            best, best_mass = domain, mass
+    return best
+
+
+# ============ SEARCH FUNCTIONS ============
+def _search_csv(filepath, search_cols, output_cols, query, max_results, where=None, fuzzy=False, mode="bm25",
+                backend="memory", corpus=None):
+    """Core search function using BM25 (or dense / hybrid `mode`), ranking only rows that match `where`.
+
+    Returns (results, corrections); with `fuzzy`, unknown query words are first
+    replaced by their closest indexed terms and reported in corrections. The
+    "fts5" backend serves keyword (bm25 mode) searches from SQLite instead.
+    A registered `corpus` is searched in memory through index_manager().
+    """
     if not filepath.exists():
-        return []
+        return [], {}
 
-    data = _load_csv(filepath)
+    if corpus is not None:
+        if mode != "bm25":
+            raise ValueError(f"Mode {mode} is not available for registered corpora (use bm25)")
+        backend = "memory"
+        load = functools.partial(index_manager().load, corpus)
+    else:
+        if mode != "bm25":
+            backend = "memory"  # dense vectors are derived from the in-memory index
+        load = load_fts if backend == "fts5" else load_index
+    index = corrections = None
+    if fuzzy:
+        index = load(filepath, search_cols, output_cols)
+        query, corrections = index.correct(query)
 
-    # Build documents from search columns
-    documents = [" ".join(str(row.get(col, "")) for col in search_cols) for row in data]
+    source = str(_index_path(filepath, search_cols, output_cols, DEFAULT_TOKENIZER))
+    version = _source_version(filepath)
+    key = _result_key(source, query, max_results, version, where, mode, backend)
+    results = RESULT_CACHE.get(key)
+    if results is not None:
+        return results, corrections or {}
 
-    # BM25 search
-    bm25 = BM25()
-    bm25.fit(documents)
-    ranked = bm25.score(query)
+    index = index or load(filepath, search_cols, output_cols)
+    if backend == "fts5":
+        results = [row for row, score in index.top_k(query, max_results, where) if score > 0]
+        RESULT_CACHE.put(key, results, source, version)
+        return results, corrections or {}
+
+    allowed = index.facets.mask(where, index.bm25.N) if where else None
+    if mode == "bm25":
+        ranked = index.bm25.top_k(query, max_results, allowed=allowed)
+    else:
+        index, dense = load_dense(filepath, search_cols, output_cols)
+        if mode == "dense":
+            ranked = dense.top_k(query, max_results, allowed)
+        else:
+            ranked = dense.hybrid_top_k(query, max_results, allowed)
 
     # Get top results with score > 0
     results = []
-    for idx, score in ranked[:max_results]:
+    for idx, score in ranked:
         if score > 0:
-            row = data[idx]
-            results.append({col: row.get(col, "") for col in output_cols if col in row})
+            results.append(index.rows[idx])
 
-    return results
+    RESULT_CACHE.put(key, results, source, version)
+    return results, corrections or {}
 
 
-def detect_domain(query):
+def detect_domain(query, fallback=None):
     """Auto-detect the most relevant domain from query"""
-    query_lower = query.lower()
-
-    domain_keywords = {
-        "color": ["color", "palette", "hex", "#", "rgb"],
-        "chart": ["chart", "graph", "visualization", "trend", "bar", "pie", "scatter", "heatmap", "funnel"],
-        "landing": ["landing", "page", "cta", "conversion", "hero", "testimonial", "pricing", "section"],
-        "product": ["saas", "ecommerce", "e-commerce", "fintech", "healthcare", "gaming", "portfolio", "crypto", "dashboard"],
-        "prompt": ["prompt", "css", "implementation", "variable", "checklist", "tailwind"],
-        "style": ["style", "design", "ui", "minimalism", "glassmorphism", "neumorphism", "brutalism", "dark mode", "flat", "aurora"],
-        "ux": ["ux", "usability", "accessibility", "wcag", "touch", "scroll", "animation", "keyboard", "navigation", "mobile"],
-        "typography": ["font", "typography", "heading", "serif", "sans"]
-    }
+    domain = domain_router().route(query)
+    if domain is None and (ROUTE_FALLBACK if fallback is None else fallback):
+        domain = _idf_mass_domain(query)
+    return domain or DEFAULT_DOMAIN
 
-    scores = {domain: sum(1 for kw in keywords if kw in query_lower) for domain, keywords in domain_keywords.items()}
-    best = max(scores, key=scores.get)
-    return best if scores[best] > 0 else "style"
 
+@_logged
+def search(query, domain=None, max_results=MAX_RESULTS, where=None, fuzzy=None, mode="bm25", backend=None,
+           corpus=None):
+    """Main search function with auto-domain detection ("all" searches every CSV).
 
-def search(query, domain=None, max_results=MAX_RESULTS):
-    """Main search function with auto-domain detection"""
+    `where` ({column: value or [values]}) keeps only rows whose columns match
+    (values of one column are OR'ed, columns AND'ed) before ranking. `fuzzy`
+    (default FUZZY_DEFAULT) corrects misspelled words against the index
+    vocabulary (every CSV's when the domain is auto-detected, so routing sees
+    the corrected words); applied corrections are returned under "corrections". `mode`
+    is one of SEARCH_MODES: keyword BM25, dense LSA vectors, or both fused.
+    `backend` (default SEARCH_BACKEND) picks where single-file keyword
+    searches run; "all" always uses the in-memory global index. `corpus`
+    searches a directory registered with index_manager() instead of DATA_DIR.
+    """
+    if mode not in SEARCH_MODES:
+        return {"error": f"Unknown mode: {mode}. Available: {', '.join(SEARCH_MODES)}"}
+    backend = backend or SEARCH_BACKEND
+    if backend not in SEARCH_BACKENDS:
+        return {"error": f"Unknown backend: {backend}. Available: {', '.join(SEARCH_BACKENDS)}"}
+    fuzzy = FUZZY_DEFAULT if fuzzy is None else fuzzy
+    searched, corrections = query, {}
     if domain is None:
-        domain = detect_domain(query)
+        if fuzzy and corpus is None:
+            searched, corrections = correct_all(query)
+            fuzzy = False
+        domain = detect_domain(searched)
+        if corrections and not _idf_mass(searched, domain):
+            # A corrected word can be a keyword of a domain whose rows never use it,
+            # or only be indexed by a stack: go where the corrected words are
+            domain = _idf_mass_domain(searched) or "all"
+    if domain == "all":
+        if where:
+            return {"error": "Column filters need a single domain or stack", "domain": domain}
+        if corpus is not None:
+            return {"error": "Corpus searches need a single domain or stack", "domain": domain}
+        result = search_all(searched, max_results, fuzzy, mode)
+        if corrections and "error" not in result:
+            result = _with_corrections({**result, "query": query}, corrections)
+        return result
 
-    config = CSV_CONFIG.get(domain, CSV_CONFIG["style"])
-    filepath = DATA_DIR / config["file"]
+    config = CSV_CONFIG.get(domain, CSV_CONFIG[DEFAULT_DOMAIN])
+    try:
+        root = DATA_DIR if corpus is None else index_manager().root(corpus)
+    except ValueError as e:
+        return {"error": str(e), "domain": domain}
+    filepath = root / config["file"]
 
     if not filepath.exists():
         return {"error": f"File not found: {filepath}", "domain": domain}
 
-    results = _search_csv(filepath, config["search_cols"], config["output_cols"], query, max_results)
+    try:
+        results, fixed = _search_csv(filepath, config["search_cols"], config["output_cols"],
+                                     searched, max_results, where, fuzzy, mode, backend, corpus)
+    except (ValueError, ImportError) as e:
+        return {"error": str(e), "domain": domain}
 
-    return {
+    result = {
         "domain": domain,
         "query": query,
         "file": config["file"],
         "count": len(results),
         "results": results
     }
+    if corpus is not None:
+        result["corpus"] = corpus
+    return _with_corrections(result, {**corrections, **fixed})
+
+
+def _with_corrections(result, corrections):
+    """Report fuzzy corrections (if any were applied) alongside the results"""
+    if corrections:
+        result["corrections"] = corrections
+    return result
 
 
-def search_stack(query, stack, max_results=MAX_RESULTS):
-    """Search stack-specific guidelines"""
+def _all_result(index, query, ranked):
+    results = []
+    for doc_id, _score in ranked:
+        name, source, row_id = index.locate(doc_id)
+        tag = {"Stack": name} if name in STACK_CONFIG else {"Domain": name}
+        results.append({**tag, **source.rows[row_id]})
+
+    return {
+        "domain": "all",
+        "query": query,
+        "file": "*",
+        "count": len(results),
+        "results": results
+    }
+
+
+def search_all(query, max_results=MAX_RESULTS, fuzzy=None, mode="bm25"):
+    """Rank every domain and stack CSV in one pass; each row is tagged with its source"""
+    searched, corrections = query, {}
+    if FUZZY_DEFAULT if fuzzy is None else fuzzy:
+        searched, corrections = correct_all(query)
+
+    version = ",".join(_source_version(filepath) for _name, filepath, _s, _o in iter_datasets() if filepath.exists())
+    key = _result_key("*", searched, max_results, version, mode=mode)
+    results = RESULT_CACHE.get(key)
+    if results is not None:
+        return _with_corrections({"domain": "all", "query": query, "file": "*", "count": len(results),
+                                  "results": results}, corrections)
+
+    index = load_global_index()
+    try:
+        ranked = index.top_k(searched, max_results, mode)
+    except ImportError as e:
+        return {"error": str(e), "domain": "all"}
+    result = _all_result(index, query, ranked)
+    RESULT_CACHE.put(key, result["results"], "*", version)
+    return _with_corrections(result, corrections)
+
+
+@_logged
+def search_stack(query, stack, max_results=MAX_RESULTS, where=None, fuzzy=None, mode="bm25", backend=None,
+                 corpus=None):
+    """Search stack-specific guidelines (`where`, `fuzzy`, `mode`, `backend` and `corpus` as in search())"""
+    if mode not in SEARCH_MODES:
+        return {"error": f"Unknown mode: {mode}. Available: {', '.join(SEARCH_MODES)}"}
+    backend = backend or SEARCH_BACKEND
+    if backend not in SEARCH_BACKENDS:
+        return {"error": f"Unknown backend: {backend}. Available: {', '.join(SEARCH_BACKENDS)}"}
     if stack not in STACK_CONFIG:
         return {"error": f"Unknown stack: {stack}. Available: {', '.join(AVAILABLE_STACKS)}"}
 
-    filepath = DATA_DIR / STACK_CONFIG[stack]["file"]
+    try:
+        root = DATA_DIR if corpus is None else index_manager().root(corpus)
+    except ValueError as e:
+        return {"error": str(e), "stack": stack}
+    filepath = root / STACK_CONFIG[stack]["file"]
 
     if not filepath.exists():
         return {"error": f"Stack file not found: {filepath}", "stack": stack}
 
-    results = _search_csv(filepath, _STACK_COLS["search_cols"], _STACK_COLS["output_cols"], query, max_results)
+    fuzzy = FUZZY_DEFAULT if fuzzy is None else fuzzy
+    try:
+        results, corrections = _search_csv(filepath, _STACK_COLS["search_cols"], _STACK_COLS["output_cols"],
+                                           query, max_results, where, fuzzy, mode, backend, corpus)
+    except (ValueError, ImportError) as e:
+        return {"error": str(e), "stack": stack}
 
-    return {
+    result = {
         "domain": "stack",
         "stack": stack,
         "query": query,
@@ -234,3 +3174,6 @@ def search_stack(query, stack, max_results=MAX_RESULTS):
         "count": len(results),
         "results": results
     }
+    if corpus is not None:
+        result["corpus"] = corpus
+    return _with_corrections(result, corrections)
@@ -0,0 +1,158 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+UI/UX Pro Max Replay - re-run a captured query log against the current engine
+Usage: python replay.py queries.jsonl [--concurrency 4] [--limit N] [--keep-cache] [--json]
+
+Capture a log by setting UI_UX_PRO_MAX_QUERY_LOG=queries.jsonl while the
+skill (or the daemon) serves real traffic. Replay reports recorded vs current
+latency percentiles and how many rankings changed (result ids differ).
+"""
+
+import argparse
+import json
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import core
+from bench import percentiles
+
+# Arguments each logged entry point is re-called with
+_ARGS = {
+    "search": ("query", "domain", "max_results", "where", "fuzzy", "mode", "backend", "corpus"),
+    "search_stack": ("query", "stack", "max_results", "where", "fuzzy", "mode", "backend", "corpus"),
+}
+EXAMPLES = 10
+
+
+def read_log(lines, limit=None):
+    """Logged calls that can be replayed, in order (malformed lines are skipped)"""
+    entries = []
+    for line in lines:
+        try:
+            entry = json.loads(line)
+        except ValueError:
+            continue
+        if isinstance(entry, dict) and entry.get("fn") in _ARGS and isinstance(entry.get("query"), str):
+            entries.append(entry)
+            if limit is not None and len(entries) >= limit:
+                break
+    return entries
+
+
+def replay_one(entry):
+    """Re-run one logged call; returns (latency seconds, result ids, error).
+
+    A call that raises is reported as that entry's error, so one bad entry
+    cannot abort the whole replay.
+    """
+    fn = getattr(core, entry["fn"])
+    kwargs = {name: entry[name] for name in _ARGS[entry["fn"]] if name in entry}
+    start = time.perf_counter()
+    try:
+        result = fn(**kwargs)
+    except Exception as e:
+        return time.perf_counter() - start, [], str(e) or type(e).__name__
+    latency = time.perf_counter() - start
+    return latency, [core.result_id(row) for row in result.get("results", ())], result.get("error")
+
+
+def _overlap(recorded, current):
+    """Share of recorded result ids still returned (1.0 when both are empty)"""
+    if not recorded:
+        return 1.0 if not current else 0.0
+    return len(set(recorded) & set(current)) / len(recorded)
+
+
+def replay(entries, concurrency=1):
+    """Replay entries on `concurrency` threads and compare with what was logged"""
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=max(1, concurrency)) as pool:
+        outcomes = list(pool.map(replay_one, entries))
+    wall = time.perf_counter() - start
+
+    identical = reordered = changed = top_changed = errors = 0
+    overlaps, examples = [], []
+    for entry, (_latency, ids, error) in zip(entries, outcomes):
+        recorded = entry.get("ids", [])
+        errors += error is not None
+        if ids == recorded:
+            identical += 1
+            continue
+        if sorted(ids) == sorted(recorded):
+            reordered += 1
+        else:
+            changed += 1
+        top_changed += ids[:1] != recorded[:1]
+        overlaps.append(_overlap(recorded, ids))
+        if len(examples) < EXAMPLES:
+            examples.append({"fn": entry["fn"], "query": entry["query"], "domain": entry.get("domain"),
+                             "stack": entry.get("stack"), "recorded": recorded, "current": ids})
+
+    count = len(entries)
+    recorded_latency = [entry["latency_ms"] / 1000 for entry in entries if isinstance(entry.get("latency_ms"), (int, float))]
+    return {
+        "queries": count,
+        "concurrency": concurrency,
+        "wall_s": round(wall, 4),
+        "qps": round(count / wall, 1) if wall else None,
+        "latency": {"recorded": percentiles(recorded_latency),
+                    "current": percentiles([latency for latency, _ids, _error in outcomes])},
+        "rankings": {
+            "identical": identical,
+            "reordered": reordered,
+            "changed": changed,
+            "top1_changed": top_changed,
+            "mean_overlap_of_differing": round(sum(overlaps) / len(overlaps), 4) if overlaps else None,
+            "errors": errors,
+        },
+        "examples": examples,
+    }
+
+
+def format_report(report):
+    lines = [f"Replayed {report['queries']} queries on {report['concurrency']} threads "
+             f"in {report['wall_s']}s ({report['qps']} q/s)", ""]
+    lines.append(f"{'latency (ms)':<14}{'p50':>10}{'p95':>10}{'p99':>10}{'mean':>10}")
+    for name in ("recorded", "current"):
+        stats = report["latency"][name]
+        if stats:
+            lines.append(f"{name:<14}" + "".join(f"{stats[key]:>10.3f}" for key in ("p50_ms", "p95_ms", "p99_ms", "mean_ms")))
+
+    rankings = report["rankings"]
+    lines += ["", "Rankings: " + ", ".join(f"{value} {key.replace('_', ' ')}" for key, value in rankings.items()
+                                         if key != "mean_overlap_of_differing")]
+    if rankings["mean_overlap_of_differing"] is not None:
+        lines.append(f"Recorded results kept by differing queries: {rankings['mean_overlap_of_differing']:.0%}")
+    for example in report["examples"]:
+        target = example["stack"] or example["domain"] or "auto"
+        lines.append(f"- {example['query']!r} ({target}): {example['recorded']} -> {example['current']}")
+    return "\n".join(lines)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Replay a UI Pro Max query log")
+    parser.add_argument("log", help="JSONL file written via UI_UX_PRO_MAX_QUERY_LOG ('-' for stdin)")
+    parser.add_argument("--concurrency", "-c", type=int, default=1, help="Replay threads (default: 1)")
+    parser.add_argument("--limit", type=int, help="Replay only the first N logged calls")
+    parser.add_argument("--keep-cache", action="store_true",
+                        help="Let the result cache answer repeated queries (default: every query is ranked)")
+    parser.add_argument("--json", action="store_true", help="Output as JSON")
+    args = parser.parse_args()
+
+    # Replayed calls must not be logged again, nor served from the cache unless asked
+    core.QUERY_LOG.path = None
+    if not args.keep_cache:
+        core.RESULT_CACHE = core.ResultCache(0)
+
+    if args.log == "-":
+        entries = read_log(sys.stdin, args.limit)
+    else:
+        with open(args.log, "r", encoding="utf-8") as f:
+            entries = read_log(f, args.limit)
+    if not entries:
+        parser.error(f"no replayable calls in {args.log}")
+
+    report = replay(entries, args.concurrency)
+    print(json.dumps(report, indent=2, ensure_ascii=False) if args.json else format_report(report))
@@ -1,78 +1,20 @@
-#!/usr/bin/env python3
-# -*- coding: utf-8 -*-
-"""
-UI/UX Pro Max Search - BM25 search engine for UI/UX style guides
-Usage: python search.py "<query>" [--domain <domain>] [--stack <stack>] [--max-results 3]
-
-Domains: style, prompt, color, chart, landing, product, ux, typography
-Stacks: html-tailwind, react, nextjs
-"""
-
-import argparse
-
-from core import AVAILABLE_STACKS, CSV_CONFIG, MAX_RESULTS, search, search_stack
-
-
-def format_output(result):
-    """Format results for Claude consumption (token-optimized)"""
-    if "error" in result:
-        return f"Error: {result['error']}"
-
-    output = []
-    if result.get("stack"):
-        output.append(f"## UI Pro Max Stack Guidelines")
-        output.append(f"**Stack:** {result['stack']} | **Query:** {result['query']}")
-    else:
-        output.append(f"## UI Pro Max Search Results")
-        output.append(f"**Domain:** {result['domain']} | **Query:** {result['query']}")
-    output.append(
-        f"**Source:** {result['file']} | **Found:** {result['count']} results\n"
-    )
-
-    for i, row in enumerate(result["results"], 1):
-        output.append(f"### Result {i}")
-        for key, value in row.items():
-            value_str = str(value)
-            if len(value_str) > 300:
-                value_str = value_str[:300] + "..."
-            output.append(f"- **{key}:** {value_str}")
-        output.append("")
-
-    return "\n".join(output)
-
-
-if __name__ == "__main__":
-    parser = argparse.ArgumentParser(description="UI Pro Max Search")
-    parser.add_argument("query", help="Search query")
-    parser.add_argument(
-        "--domain", "-d", choices=list(CSV_CONFIG.keys()), help="Search domain"
-    )
-    parser.add_argument(
-        "--stack",
-        "-s",
-        choices=AVAILABLE_STACKS,
-        help="Stack-specific search (html-tailwind, react, nextjs)",
-    )
-    parser.add_argument(
-        "--max-results",
-        "-n",
-        type=int,
-        default=MAX_RESULTS,
-        help="Max results (default: 3)",
-    )
-    parser.add_argument("--json", action="store_true", help="Output as JSON")
-
-    args = parser.parse_args()
-
-    # Stack search takes priority
-    if args.stack:
-        result = search_stack(args.query, args.stack, args.max_results)
-    else:
-        result = search(args.query, args.domain, args.max_results)
-
-    if args.json:
-        import json
-
-        print(json.dumps(result, indent=2, ensure_ascii=False))
-    else:
-        print(format_output(result))
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+UI/UX Pro Max Search - BM25 search engine for UI/UX style guides
+Usage: python search.py "<query>" [--domain <domain>] [--stack <stack>] [--max-results 3] [--where Col=Value ...] [--fuzzy] [--mode bm25|dense|hybrid] [--backend memory|fts5] [--max-tokens N] [--corpus NAME]
+       python search.py --batch [queries.jsonl]   (JSONL in, JSONL out; "-" or no file reads stdin)
+       python search.py serve [--socket PATH | --tcp HOST:PORT]   (keep indices warm for CLI calls)
+       python search.py resolve "<product query>" [--json]   (product + its styles, colors, fonts, landing)
+       python search.py build-index [--workers N] [--dense] [--fts]   (compile changed datasets in parallel)
+
+Domains: style, prompt, color, chart, landing, product, ux, typography, all (every domain + stack)
+Stacks: html-tailwind, react, nextjs
+"""
+
+# Python compiles the script it runs on every call but caches imported modules,
+# so the command line itself lives in cli.py
+from cli import main
+
+if __name__ == "__main__":
+    main()
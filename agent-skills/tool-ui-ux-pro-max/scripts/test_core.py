@@ -0,0 +1,592 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Tests for core.py
+Usage: python -m unittest test_core   (from the scripts directory)
+"""
+
+import json
+import os
+import pickle
+import random
+import re
+import tempfile
+import threading
+import unittest
+from pathlib import Path
+from unittest import mock
+
+# Indices compiled by searches go to a scratch directory, not the skill's .index
+_INDEX_DIR = tempfile.TemporaryDirectory()
+os.environ["UI_UX_PRO_MAX_INDEX_DIR"] = _INDEX_DIR.name
+
+import core  # noqa: E402  (reads UI_UX_PRO_MAX_INDEX_DIR on import)
+
+HEADER = ["No", "Name", "Category", "Description"]
+ROWS = [
+    ["1", "Glassmorphism", "Modern", "Frosted glass panels, blurred backgrounds"],
+    ["2", "Neumorphism", "Modern", "Soft extruded shapes, subtle shadows"],
+    ["3", "Brutalism", "Bold", "Raw layout, \"harsh\" contrast, system fonts"],
+    ["4", "Minimalism", "Clean", "Whitespace, few colors, clear hierarchy"],
+    ["5", "Claymorphism", "Modern", "Rounded 3D clay shapes, pastel colors"],
+    ["6", "Dark Mode", "Clean", "Dark surfaces, high contrast text, glass accents"],
+    ["7", "Bento Grid", "Bold", "Modular cards of mixed sizes, clean grid"],
+]
+SEARCH_COLS = ["Name", "Category", "Description"]
+OUTPUT_COLS = ["Name", "Category", "Description"]
+
+
+def _csv(rows, newline):
+    """CSV bytes for rows, each terminated by newline"""
+    lines = []
+    for row in rows:
+        cells = ['"' + cell.replace('"', '""') + '"' if '"' in cell or "," in cell else cell for cell in row]
+        lines.append(",".join(cells) + newline)
+    return "".join(lines).encode("utf-8")
+
+
+def tearDownModule():
+    _INDEX_DIR.cleanup()
+
+
+def _synthetic_corpus():
+    """Seeded BM25 over 340 short documents; the last 40 repeat the first, so scores tie"""
+    rng = random.Random(7)
+    words = "glass frosted soft shadow bold grid card dark light clean modern layout color contrast motion".split()
+    docs = [" ".join(rng.choice(words) for _ in range(rng.randint(3, 12))) for _ in range(300)]
+    bm25 = core.BM25()
+    bm25.fit(docs + docs[:40])
+    return bm25
+
+
+QUERIES = ["glass", "glass frosted", "dark dark card", "bold grid card modern", "clean light glass motion",
+           "\"soft shadow\" card", "zzz"]
+
+
+class IncrementalUpdateTest(unittest.TestCase):
+    """An index updated with appended rows must equal one built from the final file"""
+
+    def setUp(self):
+        self._tmp = tempfile.TemporaryDirectory()
+        self.csv = Path(self._tmp.name) / "styles.csv"
+        self.idx = Path(self._tmp.name) / "styles.idx"
+
+    def tearDown(self):
+        self._tmp.cleanup()
+
+    def _refresh(self, state):
+        return core._refresh_index(self.idx, self.csv, SEARCH_COLS, OUTPUT_COLS, core.DEFAULT_TOKENIZER, state)
+
+    def _assert_update_matches_rebuild(self, initial, appended):
+        self.csv.write_bytes(initial)
+        _index, status = self._refresh(None)
+        self.assertEqual(status, "built")
+
+        with open(self.csv, "ab") as f:
+            f.write(appended)
+        updated, status = self._refresh(core._read_index(self.idx))
+        self.assertEqual(status, "updated")
+
+        with open(self.csv, "rb") as f:
+            rebuilt = core._build_index(self.csv, f, SEARCH_COLS, OUTPUT_COLS,
+                                        core._source_signature(self.csv), core.DEFAULT_TOKENIZER)
+        self.assertEqual(core._thaw(updated.bm25.state()), core._thaw(rebuilt.bm25.state()))
+        self.assertEqual(list(updated.rows.starts), list(rebuilt.rows.starts))
+        self.assertEqual(list(updated.rows.ends), list(rebuilt.rows.ends))
+        self.assertEqual([updated.rows[i] for i in range(len(updated.rows))],
+                         [rebuilt.rows[i] for i in range(len(rebuilt.rows))])
+        self.assertEqual(core._thaw(updated.facets.state()), core._thaw(rebuilt.facets.state()))
+        self.assertEqual(updated.source["sha256"], rebuilt.source["sha256"])
+        self.assertEqual(updated.bm25.top_k("glass clean", 5), rebuilt.bm25.top_k("glass clean", 5))
+
+    def test_append_lf(self):
+        self._assert_update_matches_rebuild(_csv([HEADER] + ROWS[:4], "\n"), _csv(ROWS[4:], "\n"))
+
+    def test_append_crlf(self):
+        self._assert_update_matches_rebuild(_csv([HEADER] + ROWS[:4], "\r\n"), _csv(ROWS[4:], "\r\n"))
+
+    def test_append_after_missing_trailing_newline(self):
+        initial = _csv([HEADER] + ROWS[:4], "\n")[:-1]
+        self._assert_update_matches_rebuild(initial, b"\n" + _csv(ROWS[4:], "\n")[:-1])
+
+    def test_append_after_missing_trailing_crlf(self):
+        initial = _csv([HEADER] + ROWS[:4], "\r\n")[:-2]
+        self._assert_update_matches_rebuild(initial, b"\r\n" + _csv(ROWS[4:], "\r\n"))
+
+
+class TokenizerTest(unittest.TestCase):
+    """The precompiled pipeline tokenizes like the original substitute + split + filter"""
+
+    TEXTS = ["Glassmorphism: frosted-glass panels, blurred (backdrop) 3D", "Café_UI x-ray  a b cd efg",
+             "Dark Mode / OLED-friendly; WCAG 2.1 AA", ""]
+
+    def test_default_pipeline(self):
+        tokenizer = core.Tokenizer()
+        for text in self.TEXTS:
+            legacy = [word for word in re.sub(r"[^\w\s]", " ", text.lower()).split() if len(word) > 2]
+            self.assertEqual(tokenizer(text), legacy)
+
+    def test_normalizer(self):
+        tokenizer = core.Tokenizer(normalizer="s-stem")
+        self.assertEqual(tokenizer("Animations, animation"), ["animation", "animation"])
+        self.assertEqual(tokenizer.spans("Smooth  Animations"), [("smooth", 0, 6), ("animation", 8, 18)])
+
+        # Index and query share the pipeline, so the plural finds the singular
+        bm25 = core.BM25(tokenizer=tokenizer)
+        bm25.fit(["smooth animation curves", "static layout"])
+        self.assertEqual([doc for doc, _score in bm25.top_k("animations", 3)], [0])
+        self.assertEqual(core.BM25.from_state(bm25.state()).tokenizer.spec(), tokenizer.spec())
+
+    def test_unknown_normalizer(self):
+        with self.assertRaisesRegex(ValueError, "Unknown normalizer"):
+            core.Tokenizer(normalizer="porter")
+
+
+class RetrievalStrategyTest(unittest.TestCase):
+    """Heap and MaxScore retrieval must return exactly what exhaustive scoring ranks first"""
+
+    @classmethod
+    def setUpClass(cls):
+        cls.bm25 = _synthetic_corpus()
+        rng = random.Random(11)
+        cls.mask = bytes(rng.random() < 0.5 for _ in range(cls.bm25.N))
+
+    def _assert_strategies_agree(self, allowed):
+        for query in QUERIES:
+            for k in (1, 5, 20, 400):
+                expected = self.bm25.top_k(query, k, "exhaustive", allowed)
+                for strategy in ("heap", "maxscore"):
+                    with self.subTest(query=query, k=k, strategy=strategy):
+                        self.assertEqual(self.bm25.top_k(query, k, strategy, allowed), expected)
+
+    def test_non_positive_k(self):
+        for strategy in core.RETRIEVAL_STRATEGIES:
+            for k in (0, -1, -5):
+                with self.subTest(strategy=strategy, k=k):
+                    self.assertEqual(self.bm25.top_k("glass card", k, strategy), [])
+
+    def test_ties(self):
+        scores = [score for _doc, score in self.bm25.top_k("glass", 400, "exhaustive")]
+        self.assertLess(len(set(scores)), len(scores))
+
+    def test_unfiltered(self):
+        self._assert_strategies_agree(None)
+
+    def test_facet_mask(self):
+        self._assert_strategies_agree(self.mask)
+        for doc_id, _score in self.bm25.top_k("glass card", 400, "maxscore", self.mask):
+            self.assertTrue(self.mask[doc_id])
+
+
+class PhraseQueryTest(unittest.TestCase):
+    """Quoted phrases must appear as consecutive tokens; adjacent query words rank higher"""
+
+    @classmethod
+    def setUpClass(cls):
+        cls.bm25 = core.BM25()
+        cls.bm25.fit([" ".join(row[1:]) for row in ROWS])
+
+    def _docs(self, query):
+        return [doc for doc, _score in self.bm25.top_k(query, 10)]
+
+    def test_phrases(self):
+        self.assertEqual(self._docs("glass panels"), [0, 5])
+        self.assertEqual(self._docs('"glass panels"'), [0])
+        self.assertEqual(self._docs('"glass accents"'), [5])
+        self.assertEqual(self._docs('"panels glass"'), [])  # order matters
+        self.assertEqual(self._docs('"dark mode" glass'), [5])
+        self.assertEqual(self._docs('"frosted glass" "soft shapes"'), [])  # every phrase is required
+
+    def test_phrase_scores(self):
+        # The phrase only filters: a matching row keeps its unquoted score
+        self.assertEqual(self.bm25.top_k('"glass panels"', 10), self.bm25.top_k("glass panels", 1))
+
+    def test_proximity(self):
+        bm25 = core.BM25()
+        bm25.fit(["frosted blue green panel glass shadow", "blue green glass shadow frosted panel"])
+        self.assertEqual([doc for doc, _score in bm25.top_k("frosted panel", 2)], [1, 0])
+
+
+class MappedIndexTest(unittest.TestCase):
+    """An index mapped from its file must answer like the one just built"""
+
+    def setUp(self):
+        self._tmp = tempfile.TemporaryDirectory()
+        self.csv = Path(self._tmp.name) / "styles.csv"
+        self.idx = Path(self._tmp.name) / "styles.idx"
+        self.csv.write_bytes(_csv([HEADER] + ROWS + [["8", "Café", "Modern", "Warm écru tones"]], "\n"))
+
+    def tearDown(self):
+        self._tmp.cleanup()
+
+    def test_vocabulary_and_facets(self):
+        built, status = core._refresh_index(self.idx, self.csv, SEARCH_COLS, OUTPUT_COLS, core.DEFAULT_TOKENIZER, None)
+        self.assertEqual(status, "built")
+        mapped, status = core._refresh_index(self.idx, self.csv, SEARCH_COLS, OUTPUT_COLS, core.DEFAULT_TOKENIZER,
+                                             core._read_index(self.idx))
+        self.assertEqual(status, "fresh")
+        self.assertIsInstance(mapped.bm25.vocab, core.Vocabulary)
+
+        self.assertEqual(list(mapped.bm25.terms), built.bm25.terms)
+        self.assertEqual(dict(mapped.bm25.vocab), built.bm25.vocab)
+        for token in ("glass", "café", "écru", "zzz", ""):
+            self.assertEqual(mapped.bm25.vocab.get(token), built.bm25.vocab.get(token))
+        self.assertEqual(mapped.bm25.top_k("clean glass", 5), built.bm25.top_k("clean glass", 5))
+
+        where = {"category": ["modern", "Bold"]}
+        self.assertEqual(mapped.facets.match(where), built.facets.match(where))
+
+    def test_header_is_data(self):
+        core._refresh_index(self.idx, self.csv, SEARCH_COLS, OUTPUT_COLS, core.DEFAULT_TOKENIZER, None)
+        data = self.idx.read_bytes()
+        start = len(core.INDEX_MAGIC) + 8
+        header = json.loads(data[start:start + int.from_bytes(data[start - 8:start], "little")])
+        self.assertEqual(header["format"], core.INDEX_FORMAT)
+
+        # A header that is not JSON (e.g. a pickle) is never deserialized: the index is rebuilt
+        payload = pickle.dumps({"format": core.INDEX_FORMAT})
+        self.idx.write_bytes(core.INDEX_MAGIC + len(payload).to_bytes(8, "little") + payload)
+        self.assertIsNone(core._read_index(self.idx))
+        _index, status = core._refresh_index(self.idx, self.csv, SEARCH_COLS, OUTPUT_COLS, core.DEFAULT_TOKENIZER,
+                                             core._read_index(self.idx))
+        self.assertEqual(status, "built")
+
+
+class ResultCacheTest(unittest.TestCase):
+    """Cached results are served until their CSV changes, from memory or the disk tier"""
+
+    def setUp(self):
+        self._tmp = tempfile.TemporaryDirectory()
+        self.csv = Path(self._tmp.name) / "styles.csv"
+        self.csv.write_bytes(_csv([HEADER] + ROWS, "\n"))
+        self.db = str(Path(self._tmp.name) / "results.db")
+
+    def tearDown(self):
+        self._tmp.cleanup()
+
+    def _search(self, cache):
+        with mock.patch.object(core, "RESULT_CACHE", cache):
+            results, _corrections = core._search_csv(self.csv, SEARCH_COLS, OUTPUT_COLS, "glass", 10)
+        return [row["Name"] for row in results]
+
+    def test_memory(self):
+        cache = core.ResultCache(16)
+        self.assertEqual(self._search(cache), ["Glassmorphism", "Dark Mode"])
+        self.assertEqual(self._search(cache), ["Glassmorphism", "Dark Mode"])
+        self.assertEqual((cache.hits, cache.misses), (1, 1))
+
+        with open(self.csv, "ab") as f:
+            f.write(_csv([["8", "Liquid Glass", "Modern", "Glass layers that refract the content behind"]], "\n"))
+        self.assertEqual(self._search(cache), ["Liquid Glass", "Glassmorphism", "Dark Mode"])
+        self.assertEqual((cache.hits, cache.misses), (1, 2))
+
+    def test_disk(self):
+        self.assertEqual(self._search(core.ResultCache(16, self.db)), ["Glassmorphism", "Dark Mode"])
+        cache = core.ResultCache(16, self.db)  # a later process
+        self.assertEqual(self._search(cache), ["Glassmorphism", "Dark Mode"])
+        self.assertEqual(cache.disk_hits, 1)
+
+        self.csv.write_bytes(_csv([HEADER] + ROWS[1:], "\n"))
+        cache = core.ResultCache(16, self.db)
+        self.assertEqual(self._search(cache), ["Dark Mode"])
+        self.assertEqual((cache.disk_hits, cache.misses), (0, 1))
+        rows = core._sqlite3().connect(self.db).execute("SELECT COUNT(*) FROM results").fetchone()[0]
+        self.assertEqual(rows, 1)  # the stale version's row was dropped
+
+
+class FacetFilterTest(unittest.TestCase):
+    """--where ranks only rows whose cells match; long or many-valued columns cannot be filtered"""
+
+    def setUp(self):
+        self._tmp = tempfile.TemporaryDirectory()
+        self.csv = Path(self._tmp.name) / "styles.csv"
+        long_description = "Layered translucent cards over vivid gradients, with glass borders and soft glows"
+        self.csv.write_bytes(_csv([HEADER] + ROWS + [["8", "Aurora", "Modern", long_description]], "\n"))
+
+    def tearDown(self):
+        self._tmp.cleanup()
+
+    def _search(self, query, where=None):
+        results, _corrections = core._search_csv(self.csv, SEARCH_COLS, OUTPUT_COLS, query, 10, where)
+        return [row["Name"] for row in results]
+
+    def test_single_value(self):
+        self.assertEqual(self._search("glass"), ["Glassmorphism", "Dark Mode", "Aurora"])
+        self.assertEqual(self._search("glass", {"Category": "Modern"}), ["Glassmorphism", "Aurora"])
+        self.assertEqual(self._search("glass", {"Category": "Clean"}), ["Dark Mode"])
+
+    def test_values_and_columns(self):
+        # Case and surrounding whitespace are ignored; values of a column are OR'ed, columns AND'ed
+        self.assertEqual(self._search("modern clean", {"category": [" bold ", "CLEAN"]}),
+                         ["Minimalism", "Bento Grid", "Dark Mode"])
+        self.assertEqual(self._search("clean contrast", {"Category": "bold", "name": "Brutalism"}), ["Brutalism"])
+        self.assertEqual(self._search("glass", {"Category": "Retro"}), [])
+
+    def test_unfilterable_columns(self):
+        index = core.load_index(self.csv, SEARCH_COLS, OUTPUT_COLS)
+        self.assertIn("Description", index.facets.dropped)  # one value is longer than FACET_MAX_LENGTH
+        for col in ("Description", "Severity"):
+            with self.assertRaisesRegex(ValueError, "Cannot filter on column"):
+                self._search("glass", {col: "x"})
+
+
+def _has_fts5():
+    try:
+        core._sqlite3().connect(":memory:").execute("CREATE VIRTUAL TABLE probe USING fts5(text)")
+    except core._sqlite3().Error:
+        return False
+    return True
+
+
+@unittest.skipUnless(_has_fts5(), "SQLite has no FTS5 support")
+class FtsBackendTest(unittest.TestCase):
+    """The FTS5 backend returns the same rows, keys and filter errors as the memory backend"""
+
+    def setUp(self):
+        self._tmp = tempfile.TemporaryDirectory()
+        self.csv = Path(self._tmp.name) / "styles.csv"
+        self.csv.write_bytes(_csv([HEADER] + ROWS, "\n"))
+
+    def tearDown(self):
+        self._tmp.cleanup()
+
+    def _search(self, backend, query, where=None):
+        results, _corrections = core._search_csv(self.csv, SEARCH_COLS, ["Name", "Description"], query, 10, where,
+                                                 backend=backend)
+        return results
+
+    def test_same_results(self):
+        for query, where in (("glass", None), ("modern clean", None), ("modern clean", {"category": "clean"}),
+                             ('"glass panels"', None), ("zzz", None)):
+            with self.subTest(query=query, where=where):
+                memory, fts = self._search("memory", query, where), self._search("fts5", query, where)
+                self.assertEqual(fts, memory)
+                self.assertEqual([list(row) for row in fts], [["Name", "Description"]] * len(memory))
+
+    def test_unfilterable_column(self):
+        for backend in ("memory", "fts5"):
+            with self.assertRaisesRegex(ValueError, "Cannot filter on column"):
+                self._search(backend, "glass", {"Severity": "High"})
+
+
+class TokenBudgetTest(unittest.TestCase):
+    """--max-tokens output stays within its budget and keeps the query's words in view"""
+
+    TEXT = ("Layered translucent cards over vivid gradients. " * 6 + "Frosted glass panels with blurred "
+            "backgrounds and subtle borders. " + "Spacing follows an eight point grid throughout. " * 6)
+
+    def test_snippet(self):
+        window = core.snippet(self.TEXT, {"glass", "blurred"}, 80)
+        self.assertLessEqual(len(window), 80 + 2)  # plus the … marking each cut end
+        self.assertIn("glass panels with blurred", window)
+        self.assertTrue(window.startswith("…") and window.endswith("…"))
+        self.assertTrue(core.snippet(self.TEXT, {"zzz"}, 80).startswith("Layered translucent"))
+        self.assertEqual(core.snippet("Short  text", {"glass"}, 80), "Short text")
+
+    def test_fit_budget(self):
+        result = core.search("glass dark minimal", "style", 8)
+        self.assertEqual(result["count"], 8)
+        name = core.CSV_CONFIG["style"]["name_col"]
+        for max_tokens in (30, 120, 250, 500, 2000):
+            with self.subTest(max_tokens=max_tokens):
+                trimmed = core.fit_budget(result, max_tokens)
+                rows = trimmed["results"]
+                self.assertEqual([row[name] for row in rows], [row[name] for row in result["results"][:len(rows)]])
+                self.assertEqual(trimmed["count"] + trimmed.get("omitted", 0), 8)
+                if len(rows) > 1:  # the first row is kept even when the budget cannot hold it
+                    self.assertLessEqual(sum(map(core._row_cost, rows)), max_tokens * core.CHARS_PER_TOKEN)
+                for row in rows:
+                    for key, value in row.items():
+                        if key != name:
+                            self.assertLessEqual(len(value), core.SNIPPET_CHARS + 2)
+        self.assertEqual(core.fit_budget(result, 2000)["count"], 8)
+
+
+class IndexManagerTest(unittest.TestCase):
+    """Resident corpus indices stay within the memory budget, least recently used first out"""
+
+    def setUp(self):
+        self._tmp = tempfile.TemporaryDirectory()
+        self.csvs = {}
+        for name, rows in (("a", ROWS[:4]), ("b", ROWS[3:])):
+            root = Path(self._tmp.name) / name
+            root.mkdir()
+            self.csvs[name] = root / "styles.csv"
+            self.csvs[name].write_bytes(_csv([HEADER] + rows, "\n"))
+
+    def tearDown(self):
+        self._tmp.cleanup()
+
+    def _manager(self, budget):
+        manager = core.IndexManager(budget)
+        for name, path in self.csvs.items():
+            manager.register(name, path.parent)
+        return manager
+
+    def _load(self, manager, name):
+        return manager.load(name, self.csvs[name], SEARCH_COLS, OUTPUT_COLS)
+
+    def _counts(self, manager, key):
+        return {name: corpus[key] for name, corpus in manager.stats()["corpora"].items()}
+
+    def test_eviction(self):
+        for name in ("a", "b"):
+            self._load(self._manager(2**30), name)  # compile; the managers below map the files
+        sizes = [self._load(self._manager(2**30), name).memory_usage() for name in ("a", "b")]
+        manager = self._manager(max(sizes) + min(sizes) // 2)  # room for one index, not both
+        self._load(manager, "a")
+        self._load(manager, "a")
+        self._load(manager, "b")
+        self.assertEqual(self._counts(manager, "indices"), {"a": 0, "b": 1})
+        self.assertEqual(self._counts(manager, "evictions"), {"a": 1, "b": 0})
+        self.assertLessEqual(manager.stats()["resident_bytes"], manager.budget)
+
+        self.assertEqual([row["Name"] for row in self._load(manager, "a").rows], [row[1] for row in ROWS[:4]])
+        self.assertEqual(self._counts(manager, "misses"), {"a": 2, "b": 1})
+        self.assertEqual(self._counts(manager, "hits"), {"a": 1, "b": 0})
+        self.assertEqual(self._counts(manager, "indices"), {"a": 1, "b": 0})
+
+    def test_within_budget(self):
+        manager = self._manager(2**30)
+        first = self._load(manager, "a")
+        self._load(manager, "b")
+        self.assertIs(self._load(manager, "a"), first)
+        self.assertEqual(self._counts(manager, "indices"), {"a": 1, "b": 1})
+
+    def test_compiles_outside_the_lock(self):
+        manager = self._manager(2**30)
+        resident = self._load(manager, "b")
+        started, release, calls = threading.Event(), threading.Event(), []
+        compile_index = core._compile_index
+
+        def slow_compile(*args):
+            calls.append(args[1])
+            started.set()
+            release.wait(5)
+            return compile_index(*args)
+
+        answered = []
+        threads = [threading.Thread(target=self._load, args=(manager, "a")) for _ in range(2)]
+        threads.append(threading.Thread(target=lambda: answered.append(self._load(manager, "b"))))
+        with mock.patch.object(core, "_compile_index", slow_compile):
+            try:
+                for thread in threads[:2]:
+                    thread.start()
+                self.assertTrue(started.wait(5))
+                threads[2].start()
+                threads[2].join(2)
+                self.assertEqual(answered, [resident])  # answered while "a" compiles
+            finally:
+                release.set()
+                for thread in threads:
+                    if thread.ident is not None:
+                        thread.join(5)
+        self.assertEqual(calls, [self.csvs["a"]])  # the second loader waited for the first
+        self.assertEqual(self._counts(manager, "misses"), {"a": 1, "b": 1})
+        self.assertEqual(self._counts(manager, "hits"), {"a": 1, "b": 1})
+
+    def test_keeps_the_index_just_loaded(self):
+        manager = self._manager(1)
+        self._load(manager, "a")
+        self._load(manager, "b")
+        self.assertEqual(self._counts(manager, "indices"), {"a": 0, "b": 1})
+
+
+class DesignJoinsTest(unittest.TestCase):
+    """References resolve to the row they name, or to nothing"""
+
+    @classmethod
+    def setUpClass(cls):
+        tmp = tempfile.TemporaryDirectory()
+        cls.addClassCleanup(tmp.cleanup)
+        path = Path(tmp.name) / "styles.csv"
+        path.write_bytes(_csv([HEADER] + ROWS, "\n"))
+        cls.index, _status = core._refresh_index(Path(tmp.name) / "styles.idx", path, SEARCH_COLS, OUTPUT_COLS,
+                                                 core.DEFAULT_TOKENIZER, None)
+        cls.names = core.DesignJoins._names(cls.index, "Name")
+
+    def _resolve(self, ref, description=False):
+        return core.DesignJoins._resolve(ref, self.index, self.names, description)
+
+    def test_names(self):
+        self.assertEqual(self._resolve("glassmorphism"), 0)
+        self.assertEqual(self._resolve("Bento"), 6)  # leading words
+        self.assertEqual(self._resolve("Dark Theme"), 5)  # a hit sharing a name word
+
+    def test_not_a_reference(self):
+        for ref in ("N/A - Modern focused", "n/a", "None", "", " - "):
+            self.assertIsNone(self._resolve(ref))
+            self.assertIsNone(self._resolve(ref, description=True))
+
+    def test_no_match(self):
+        self.assertIsNone(self._resolve("Frosted Panels"))  # hits Glassmorphism's description only
+        self.assertIsNone(self._resolve("Trust & Authority"))
+        self.assertIsNone(self._resolve("frosted", description=True))
+        self.assertEqual(self._resolve("frosted glass, blurred", description=True), 0)
+
+
+class SpellCorrectionTest(unittest.TestCase):
+    """Fuzzy correction only builds its dictionary once a word is unknown"""
+
+    def setUp(self):
+        self._tmp = tempfile.TemporaryDirectory()
+        path = Path(self._tmp.name) / "styles.csv"
+        path.write_bytes(_csv([HEADER] + ROWS, "\n"))
+        self.index, _status = core._refresh_index(Path(self._tmp.name) / "styles.idx", path, SEARCH_COLS,
+                                                  OUTPUT_COLS, core.DEFAULT_TOKENIZER, None)
+
+    def tearDown(self):
+        self._tmp.cleanup()
+
+    def test_known_words(self):
+        self.assertEqual(self.index.correct("Frosted glass panels"), ("Frosted glass panels", {}))
+        self.assertIsNone(self.index._spell)
+
+    def test_unknown_words(self):
+        self.assertEqual(self.index.correct("frosted glas pannels"),
+                         ("frosted glass panels", {"glas": "glass", "pannels": "panels"}))
+        self.assertIsNotNone(self.index._spell)
+
+
+@unittest.skipIf(core._numpy() is None or core._sparse() is None, "numpy/scipy are not installed")
+class SparseBM25Test(unittest.TestCase):
+    """The vectorized scorer ranks like the pure-Python BM25, to floating-point tolerance"""
+
+    def _assert_matches_bm25(self, scorer):
+        bm25 = scorer.bm25
+        for query, ranked in zip(QUERIES, scorer.top_k_batch(QUERIES, 400)):
+            expected = bm25.top_k(query, 400, "exhaustive")
+            with self.subTest(query=query):
+                self.assertEqual([doc for doc, _score in ranked], [doc for doc, _score in expected])
+                for (_doc, score), (_same, want) in zip(ranked, expected):
+                    self.assertAlmostEqual(score, want, places=9)
+
+    def test_sparse_matrix(self):
+        scorer = core.SparseBM25(_synthetic_corpus())
+        self.assertIsNotNone(scorer.matrix)
+        self._assert_matches_bm25(scorer)
+
+    def test_per_term_columns(self):
+        scorer = core.SparseBM25(_synthetic_corpus())
+        scorer.matrix = None  # the NumPy-only path used without scipy
+        self._assert_matches_bm25(scorer)
+
+
+@unittest.skipIf(core._numpy() is None, "numpy is not installed")
+class DenseIndexTest(unittest.TestCase):
+    """Dense and hybrid retrieval over a small fitted corpus"""
+
+    def setUp(self):
+        bm25 = core.BM25()
+        bm25.fit([" ".join(row[1:]) for row in ROWS])
+        self.dense = core.DenseIndex.build(bm25)
+
+    def test_non_positive_k(self):
+        for k in (0, -2):
+            self.assertEqual(self.dense.top_k("glass modern", k), [])
+            self.assertEqual(self.dense.hybrid_top_k("glass modern", k), [])
+        self.assertTrue(self.dense.top_k("glass modern", 2))
+
+
+if __name__ == "__main__":
+    unittest.main()